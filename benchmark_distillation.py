@@ -0,0 +1,53 @@
+"""
+蒸馏对比脚本 - 在验证集上比较教师模型与蒸馏学生模型的准确率、延迟和模型大小
+"""
+
+import argparse
+import json
+from config import Config
+from dataset_io import load_dataset
+from model import ScheduleT5Model
+from benchmark_quantization import evaluate_model
+
+def main():
+    """对比教师与学生模型"""
+    parser = argparse.ArgumentParser(description="比较教师模型与蒸馏学生模型的准确率和延迟")
+    parser.add_argument("--teacher-path", default=f"{Config.OUTPUT_DIR}/best_model", help="教师模型检查点目录")
+    parser.add_argument("--student-path", default=f"{Config.DISTILL_OUTPUT_DIR}/best_model", help="学生模型检查点目录")
+    parser.add_argument("--val-path", default=Config.VAL_DATA_PATH, help="验证数据路径")
+    parser.add_argument("--limit", type=int, default=None, help="仅使用前 N 条验证样本")
+    parser.add_argument("--output", default=None, help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    samples = load_dataset(args.val_path)
+    if args.limit:
+        samples = samples[:args.limit]
+
+    results = {}
+    for name, path in [("teacher", args.teacher_path), ("student", args.student_path)]:
+        print(f"评估 {name} 模型...")
+        model = ScheduleT5Model(path, decoding_strategy=Config.DECODING_STRATEGY, num_beams=Config.NUM_BEAMS)
+        results[name] = evaluate_model(model, samples)
+        results[name]["num_parameters"] = sum(param.numel() for param in model.model.parameters())
+
+    print(f"\n验证样本: {len(samples)} 条")
+    print(f"{'模型':<8} {'参数(M)':>8} {'完全匹配':>8} {'任务F1':>8} {'时长准确':>8} {'优先级准确':>10} "
+          f"{'p50(ms)':>9} {'p95(ms)':>9} {'大小(MB)':>9}")
+    print("-" * 90)
+    for name, result in results.items():
+        print(f"{name:<8} {result['num_parameters'] / 1e6:>8.1f} {result['exact_match']:>8.3f} "
+              f"{result['task_f1']:>8.3f} {result['duration_accuracy']:>8.3f} {result['priority_accuracy']:>10.3f} "
+              f"{result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['model_size_mb']:>9.1f}")
+
+    teacher, student = results["teacher"], results["student"]
+    if student["p50_ms"]:
+        print(f"\n学生模型 p50 延迟加速: {teacher['p50_ms'] / student['p50_ms']:.1f}x, "
+              f"任务F1 变化: {student['task_f1'] - teacher['task_f1']:+.3f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+规则解析吞吐测试 - 统计 RuleBasedParser 每秒解析的任务片段数
+"""
+
+import argparse
+import json
+import time
+from typing import List, Dict, Any
+from config import Config
+from data_generator import DataGenerator
+from lightweight_main import RuleBasedParser, SegmentCache
+
+def build_segments(num_samples: int, seed: int = 42) -> List[str]:
+    """用数据生成器构造输入，并按解析器的分割规则切成任务片段"""
+    parser = RuleBasedParser()
+    segments = []
+    for sample in DataGenerator(seed=seed).generate_dataset(num_samples):
+        segments.extend(parser._extract_task_descriptions(sample["input_text"]))
+    return segments
+
+def benchmark_segments(parser: RuleBasedParser, segments: List[str], repeats: int) -> Dict[str, Any]:
+    """重复解析全部片段，返回最快一轮的吞吐（有缓存时首轮即预热）"""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for segment in segments:
+            parser._parse_segment(segment)
+        best = min(best, time.perf_counter() - start)
+
+    result = {
+        "num_segments": len(segments),
+        "best_seconds": best,
+        "segments_per_second": len(segments) / best if best else 0.0
+    }
+    if parser.cache is not None:
+        result["cache"] = parser.cache.get_stats()
+    return result
+
+def main():
+    """运行吞吐测试"""
+    parser = argparse.ArgumentParser(description="规则解析器吞吐测试（片段/秒）")
+    parser.add_argument("--samples", type=int, default=10000, help="生成的输入条数")
+    parser.add_argument("--repeats", type=int, default=5, help="重复轮数（取最快一轮）")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--cache-size", type=int, default=Config.SEGMENT_CACHE_SIZE, help="片段缓存条数")
+    parser.add_argument("--output", default=None, help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    segments = build_segments(args.samples, args.seed)
+    results = {
+        "no_cache": benchmark_segments(RuleBasedParser(cache=None), segments, args.repeats),
+        "cached": benchmark_segments(RuleBasedParser(SegmentCache(args.cache_size)), segments, args.repeats)
+    }
+
+    print(f"片段数: {len(segments)}")
+    for name, result in results.items():
+        line = f"{name:<10} 最快一轮 {result['best_seconds'] * 1000:8.1f} ms, 吞吐 {result['segments_per_second']:>12,.0f} 片段/秒"
+        if "cache" in result:
+            line += f", 命中率 {result['cache']['hit_rate']:.3f}"
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+训练精度与内存对比 - 比较 fp32 / bf16 autocast、梯度累积与梯度检查点组合下的每次更新耗时和峰值内存（RSS）
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Iterator
+from config import Config
+from training_metrics import peak_rss_mb
+
+def build_config(overrides: Dict[str, Any]) -> Config:
+    """在默认配置上覆盖部分配置项"""
+    config = Config()
+    for key, value in overrides.items():
+        setattr(config, key, value)
+    return config
+
+def prepare_data_files():
+    """生成数据文件与预分词产物，避免其内存开销计入第一个模式的峰值"""
+    from trainer import ScheduleTrainer
+    ScheduleTrainer(Config()).prepare_data()
+
+def run_mode(overrides: Dict[str, Any], num_updates: int) -> Dict[str, Any]:
+    """按给定配置运行 num_updates 次参数更新（每次含 GRADIENT_ACCUMULATION_STEPS 个微批）。
+
+    在独立进程中执行，峰值 RSS 只反映该模式本身。
+    """
+    from transformers import AdamW, get_constant_schedule
+    from trainer import ScheduleTrainer
+
+    config = build_config(overrides)
+    trainer = ScheduleTrainer(config)
+    trainer.prepare_data()
+    loaded_rss_mb = peak_rss_mb()
+
+    trainer.model.model.train()
+    optimizer = AdamW(trainer.model.model.parameters(), lr=config.LEARNING_RATE)
+    scheduler = get_constant_schedule(optimizer)
+    accumulation_steps = config.GRADIENT_ACCUMULATION_STEPS
+
+    def micro_batches() -> Iterator:
+        for epoch in itertools.count():
+            yield from trainer._epoch_batches(epoch)
+
+    batches = micro_batches()
+
+    update_times = []
+    # 第一次更新包含内存分配等一次性开销，不计时
+    for update in range(num_updates + 1):
+        start = time.perf_counter()
+        for _ in range(accumulation_steps):
+            trainer._backward(next(batches), accumulation_steps)
+        trainer._optimizer_step(optimizer, scheduler)
+        if update > 0:
+            update_times.append(time.perf_counter() - start)
+
+    seconds_per_update = sum(update_times) / len(update_times)
+    effective_batch_size = config.BATCH_SIZE * accumulation_steps
+    return {
+        "batch_size": config.BATCH_SIZE,
+        "accumulation_steps": accumulation_steps,
+        "effective_batch_size": effective_batch_size,
+        "seconds_per_update": seconds_per_update,
+        "samples_per_second": effective_batch_size / seconds_per_update,
+        "loaded_rss_mb": loaded_rss_mb,
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def main():
+    """对比各精度、梯度检查点与梯度累积组合（有效批大小相同）"""
+    parser = argparse.ArgumentParser(description="比较混合精度、梯度累积与梯度检查点的训练耗时和峰值内存")
+    parser.add_argument("--updates", type=int, default=10, help="每种模式计时的参数更新次数")
+    parser.add_argument("--effective-batch-size", type=int, default=Config.BATCH_SIZE * 4,
+                        help="有效批大小（微批大小 = 有效批大小 / 累积步数）")
+    parser.add_argument("--precisions", nargs="+", default=["fp32", "bf16"], choices=["fp32", "bf16"])
+    parser.add_argument("--accumulation-steps", type=int, nargs="+", default=[1, 4], help="对比的梯度累积步数")
+    parser.add_argument("--checkpointing", nargs="+", default=["off", "on"], choices=["off", "on"],
+                        help="是否开启梯度检查点")
+    parser.add_argument("--output", default=None, help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    modes = {}
+    for precision, checkpointing, accumulation_steps in itertools.product(
+            args.precisions, args.checkpointing, args.accumulation_steps):
+        if args.effective_batch_size % accumulation_steps != 0:
+            parser.error(f"有效批大小 {args.effective_batch_size} 不能被累积步数 {accumulation_steps} 整除")
+        name = f"{precision}{'+ckpt' if checkpointing == 'on' else ''}/acc{accumulation_steps}"
+        modes[name] = {
+            "MIXED_PRECISION": "bf16" if precision == "bf16" else None,
+            "GRADIENT_CHECKPOINTING": checkpointing == "on",
+            "GRADIENT_ACCUMULATION_STEPS": accumulation_steps,
+            "BATCH_SIZE": args.effective_batch_size // accumulation_steps
+        }
+
+    # 每种模式在新的进程中运行（spawn），峰值 RSS 互不影响
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        executor.submit(prepare_data_files).result()
+    results = {}
+    for name, overrides in modes.items():
+        print(f"测试 {name}...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[name] = executor.submit(run_mode, overrides, args.updates).result()
+
+    print(f"\n{'模式':<16} {'微批':>6} {'秒/更新':>10} {'样本/秒':>10} {'峰值RSS(MB)':>12}")
+    print("-" * 60)
+    for name, result in results.items():
+        print(f"{name:<16} {result['batch_size']:>6} {result['seconds_per_update']:>10.3f} "
+              f"{result['samples_per_second']:>10.1f} {result['peak_rss_mb']:>12,.0f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+量化对比脚本 - 在验证集上比较 fp32 与 int8 动态量化模型的准确率和延迟
+"""
+
+import argparse
+import io
+import json
+import time
+import torch
+from typing import List, Dict, Any
+from config import Config
+from dataset_io import load_dataset
+from model import ScheduleT5Model
+from metrics import compute_task_metrics, latency_summary
+
+def model_size_mb(model: torch.nn.Module) -> float:
+    """序列化后的模型权重大小（MB）"""
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024 / 1024
+
+def evaluate_model(model: ScheduleT5Model, samples: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """逐条预测验证样本，返回准确率与延迟统计"""
+    model.model.eval()
+    predictions = []
+    latencies = []
+
+    for sample in samples:
+        start = time.perf_counter()
+        predictions.append(model.predict_tasks(sample["input_text"]))
+        latencies.append(time.perf_counter() - start)
+
+    result = compute_task_metrics(predictions, [sample["output_tasks"] for sample in samples])
+    result.update(latency_summary(latencies))
+    result["model_size_mb"] = model_size_mb(model.model)
+    return result
+
+def main():
+    """对比 fp32 与 int8 模型"""
+    parser = argparse.ArgumentParser(description="比较 fp32 与 int8 动态量化模型的准确率和延迟")
+    parser.add_argument("--model-path", default=f"{Config.OUTPUT_DIR}/best_model", help="训练好的检查点目录")
+    parser.add_argument("--val-path", default=Config.VAL_DATA_PATH, help="验证数据路径")
+    parser.add_argument("--limit", type=int, default=None, help="仅使用前 N 条验证样本")
+    parser.add_argument("--output", default=None, help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    samples = load_dataset(args.val_path)
+    if args.limit:
+        samples = samples[:args.limit]
+
+    results = {}
+    for mode in [None, "int8"]:
+        name = mode or "fp32"
+        print(f"评估 {name} 模型...")
+        model = ScheduleT5Model(
+            Config.MODEL_NAME,
+            decoding_strategy=Config.DECODING_STRATEGY,
+            num_beams=Config.NUM_BEAMS
+        )
+        load_start = time.perf_counter()
+        model.load_model(args.model_path, quantize=mode)
+        load_seconds = time.perf_counter() - load_start
+
+        results[name] = evaluate_model(model, samples)
+        results[name]["load_seconds"] = load_seconds
+
+    print(f"\n验证样本: {len(samples)} 条")
+    print(f"{'模式':<6} {'完全匹配':>8} {'任务F1':>8} {'时长准确':>8} {'p50(ms)':>9} {'p95(ms)':>9} {'大小(MB)':>9}")
+    print("-" * 64)
+    for name, result in results.items():
+        print(f"{name:<6} {result['exact_match']:>8.3f} {result['task_f1']:>8.3f} "
+              f"{result['duration_accuracy']:>8.3f} {result['p50_ms']:>9.1f} "
+              f"{result['p95_ms']:>9.1f} {result['model_size_mb']:>9.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到: {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""
+规则引擎压力测试 - 按参数生成大规模调度场景（任务数、时长分布、偏好倾斜、固定任务密度、天数），
+统计 schedule_tasks / validate_schedule 的延迟分位数、内存分配峰值、任务安排率与校验错误，并可与保存的基线对比
+"""
+
+import argparse
+import json
+import math
+import random
+import sys
+import time
+import tracemalloc
+from typing import List, Dict, Any, Optional
+from config import Config
+from metrics import latency_summary
+from scheduler import ScheduleRuleEngine
+
+# 任务时长分布：model 与训练数据一致；short 为大量短任务；long_tail 为对数正态长尾（中位数 45 分钟）
+DURATION_PROFILES = ["model", "short", "long_tail"]
+
+# 额外固定任务的时间粒度（分钟）
+FIXED_BLOCK_MINUTES = 30
+
+# 与基线对比的指标（越小越好）；耗时只比较中位数，p95 在十几次重复下波动过大，只输出不对比
+COMPARED_METRICS = ["schedule.p50_ms", "validate.p50_ms", "total_ms", "peak_alloc_kb"]
+
+# 耗时指标对应的离散程度（中位数绝对偏差，毫秒），用作该指标的噪声下限
+NOISE_METRICS = {"schedule.p50_ms": "schedule.mad_ms", "validate.p50_ms": "validate.mad_ms", "total_ms": "total_mad_ms"}
+
+def _to_minutes(time_str: str) -> int:
+    """"HH:MM" -> 当天分钟数"""
+    hours, minutes = time_str.split(":")
+    return int(hours) * 60 + int(minutes)
+
+def _to_time(minutes: int) -> str:
+    """当天分钟数 -> "HH:MM\""""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def sample_duration(rng: random.Random, profile: str) -> int:
+    """按时长分布抽取任务时长（分钟）"""
+    if profile == "model":
+        return rng.choice([30, 60, 90, 120, 180, 240])
+    if profile == "short":
+        return rng.choice([5, 10, 15, 20, 25, 30])
+    if profile == "long_tail":
+        # 取整到 5 分钟，限制在 5 分钟到 8 小时之间
+        return min(max(int(round(rng.lognormvariate(math.log(45), 0.8) / 5)) * 5, 5), 480)
+    raise ValueError(f"未知的时长分布: {profile}，可选: {DURATION_PROFILES}")
+
+def generate_fixed_tasks(rng: random.Random, config, density: float) -> Dict[str, Dict[str, Any]]:
+    """在清醒时间内随机生成额外的固定任务，覆盖约 density 比例的空闲时间。
+
+    以 FIXED_BLOCK_MINUTES 为粒度选取不与配置中固定任务重叠的时间格，相邻时间格合并为一个固定任务。
+    """
+    if density <= 0:
+        return {}
+
+    day_start = _to_minutes(config.SLEEP_END)
+    day_end = _to_minutes(config.SLEEP_START)
+    occupied = [
+        (_to_minutes(info["start"]), _to_minutes(info["end"]))
+        for info in config.FIXED_TASKS.values()
+        if _to_minutes(info["start"]) < _to_minutes(info["end"])  # 跨天的睡眠不在清醒时间内
+    ]
+    free_cells = [
+        start for start in range(day_start, day_end - FIXED_BLOCK_MINUTES + 1, FIXED_BLOCK_MINUTES)
+        if all(start + FIXED_BLOCK_MINUTES <= begin or end <= start for begin, end in occupied)
+    ]
+    cells = sorted(rng.sample(free_cells, min(round(density * len(free_cells)), len(free_cells))))
+
+    fixed_tasks = {}
+    block_start = None
+    for index, cell in enumerate(cells):
+        if block_start is None:
+            block_start = cell
+        if index + 1 == len(cells) or cells[index + 1] != cell + FIXED_BLOCK_MINUTES:
+            block_end = cell + FIXED_BLOCK_MINUTES
+            fixed_tasks[f"固定任务{len(fixed_tasks) + 1}"] = {
+                "start": _to_time(block_start),
+                "end": _to_time(block_end),
+                "duration": block_end - block_start
+            }
+            block_start = None
+    return fixed_tasks
+
+def generate_scenario(num_tasks: int, num_days: int = 1, duration_profile: str = "model",
+                      pref_skew: float = 0.0, fixed_density: float = 0.0, seed: int = 42,
+                      config=Config) -> Dict[str, Any]:
+    """生成调度场景：num_tasks 个待安排任务，以及每天的额外固定任务。
+
+    偏好时间按 TIME_SLOTS 中的顺序以 1/(k+1)^pref_skew 加权（0 为均匀，越大越集中在前几个时间段）。
+    """
+    rng = random.Random(seed)
+    preferences = list(config.TIME_SLOTS)
+    weights = [1 / (rank + 1) ** pref_skew for rank in range(len(preferences))]
+    priorities = sorted(config.PRIORITY_LEVELS.values())
+
+    tasks = [
+        {
+            "task": f"任务{index + 1}",
+            "duration": sample_duration(rng, duration_profile),
+            "pref_time": rng.choices(preferences, weights)[0],
+            "priority": rng.choice(priorities)
+        }
+        for index in range(num_tasks)
+    ]
+    return {
+        "params": {
+            "num_tasks": num_tasks,
+            "num_days": num_days,
+            "duration_profile": duration_profile,
+            "pref_skew": pref_skew,
+            "fixed_density": fixed_density,
+            "seed": seed
+        },
+        "tasks": tasks,
+        "fixed_tasks_by_day": [generate_fixed_tasks(rng, config, fixed_density) for _ in range(num_days)]
+    }
+
+def build_day_engines(scenario: Dict[str, Any], max_tasks_per_day: Optional[int]) -> List[ScheduleRuleEngine]:
+    """每天一个规则引擎：配置中的固定任务加上当天的额外固定任务；max_tasks_per_day 为 None 时不限制每日任务数"""
+    engines = []
+    for extra_fixed_tasks in scenario["fixed_tasks_by_day"]:
+        config = Config()
+        config.FIXED_TASKS = {**Config.FIXED_TASKS, **extra_fixed_tasks}
+        config.MAX_TASKS_PER_DAY = max_tasks_per_day if max_tasks_per_day is not None else len(scenario["tasks"])
+        engines.append(ScheduleRuleEngine(config))
+    return engines
+
+def run_scenario(scenario: Dict[str, Any], engines: List[ScheduleRuleEngine]) -> Dict[str, Any]:
+    """逐天调度：当天未安排的任务顺延到下一天，返回每天的耗时、安排数（含未通过校验的）、
+    通过校验的安排数与校验错误数"""
+    pending = scenario["tasks"]
+    schedule_seconds = []
+    validate_seconds = []
+    placed = 0
+    valid_placed = 0
+    validation_errors = 0
+
+    for engine in engines:
+        start = time.perf_counter()
+        schedule = engine.schedule_tasks(pending)
+        scheduled = time.perf_counter()
+        validation = engine.validate_schedule(schedule)
+        schedule_seconds.append(scheduled - start)
+        validate_seconds.append(time.perf_counter() - scheduled)
+
+        placed_tasks = [task for task in schedule["scheduled_tasks"] if not task.get("is_fixed", False)]
+        placed += len(placed_tasks)
+        valid_placed += sum(1 for task in placed_tasks if task["task"] not in validation["invalid_tasks"])
+        validation_errors += len(validation["errors"])
+        pending = schedule["remaining_tasks"]
+
+    return {
+        "schedule_seconds": schedule_seconds,
+        "validate_seconds": validate_seconds,
+        "placed": placed,
+        "valid_placed": valid_placed,
+        "validation_errors": validation_errors
+    }
+
+def median_abs_deviation_ms(seconds: List[float]) -> float:
+    """中位数绝对偏差（毫秒），不受个别离群的慢样本影响"""
+    if not seconds:
+        return 0.0
+    ordered = sorted(seconds)
+    median = ordered[len(ordered) // 2]
+    deviations = sorted(abs(value - median) for value in ordered)
+    return deviations[len(deviations) // 2] * 1000
+
+def benchmark_scenario(scenario: Dict[str, Any], repeats: int, max_tasks_per_day: Optional[int],
+                       warmup: int = 1) -> Dict[str, Any]:
+    """先不计时地运行 warmup 次（首次运行的缓存与内存分配开销不计入），再重复运行 repeats 次统计延迟；
+    另以 tracemalloc 单独运行一次统计内存分配（避免追踪开销影响计时）"""
+    engines = build_day_engines(scenario, max_tasks_per_day)
+    for _ in range(warmup):
+        run_scenario(scenario, engines)
+    schedule_seconds = []
+    validate_seconds = []
+    run_seconds = []
+    for _ in range(repeats):
+        run = run_scenario(scenario, engines)
+        schedule_seconds.extend(run["schedule_seconds"])
+        validate_seconds.extend(run["validate_seconds"])
+        run_seconds.append(sum(run["schedule_seconds"]) + sum(run["validate_seconds"]))
+
+    tracemalloc.start()
+    try:
+        run = run_scenario(scenario, engines)
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    num_tasks = len(scenario["tasks"])
+    return {
+        **scenario["params"],
+        "schedule": {**latency_summary(schedule_seconds), "mad_ms": median_abs_deviation_ms(schedule_seconds)},
+        "validate": {**latency_summary(validate_seconds), "mad_ms": median_abs_deviation_ms(validate_seconds)},
+        "total_ms": latency_summary(run_seconds)["p50_ms"],
+        "total_mad_ms": median_abs_deviation_ms(run_seconds),
+        "placed": run["placed"],
+        "placement_rate": run["placed"] / num_tasks if num_tasks else 0.0,
+        # 只计通过校验（未出现在校验错误中）的任务
+        "valid_placement_rate": run["valid_placed"] / num_tasks if num_tasks else 0.0,
+        "validation_errors": run["validation_errors"],
+        "peak_alloc_kb": peak / 1024,
+        "retained_alloc_kb": retained / 1024
+    }
+
+def _metric(result: Dict[str, Any], name: str) -> float:
+    """按 "schedule.p50_ms" 形式的路径取指标"""
+    value = result
+    for key in name.split("."):
+        value = value[key]
+    return value
+
+def _noise_ms(result: Dict[str, Any], metric: str) -> float:
+    """耗时指标的中位数绝对偏差（毫秒），旧基线中没有记录时为 0"""
+    group, _, key = NOISE_METRICS[metric].rpartition(".")
+    return (result.get(group, {}) if group else result).get(key, 0.0)
+
+def compare_results(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float,
+                    min_delta_ms: float, noise_mult: float) -> List[str]:
+    """与基线对比，返回回退项：指标超过基线 (1 + tolerance) 倍，任务安排率（含有效安排率）下降，或校验错误增加。
+
+    耗时指标还需绝对差超过噪声下限：两次结果中较大的中位数绝对偏差乘以 noise_mult，且不小于 min_delta_ms。
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        previous = baseline[name]
+        for metric in COMPARED_METRICS:
+            old_value, new_value = _metric(previous, metric), _metric(result, metric)
+            if metric in NOISE_METRICS:
+                noise = max(_noise_ms(previous, metric), _noise_ms(result, metric))
+                if new_value - old_value <= max(min_delta_ms, noise_mult * noise):
+                    continue
+            if new_value > old_value * (1 + tolerance):
+                regressions.append(f"{name} {metric}: {old_value:.3f} -> {new_value:.3f} "
+                                   f"({new_value / old_value if old_value else float('inf'):.2f}x)")
+        for metric in ["placement_rate", "valid_placement_rate"]:
+            # 旧基线没有有效安排率时不对比
+            if metric in previous and result[metric] < previous[metric]:
+                regressions.append(f"{name} {metric}: {previous[metric]:.4f} -> {result[metric]:.4f}")
+        if result["validation_errors"] > previous["validation_errors"]:
+            regressions.append(f"{name} validation_errors: {previous['validation_errors']} -> {result['validation_errors']}")
+    return regressions
+
+def main():
+    """运行压力测试"""
+    parser = argparse.ArgumentParser(description="规则引擎压力测试（延迟分位数、内存分配、任务安排率）")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="任务数")
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 7], help="调度天数（未安排的任务顺延到下一天）")
+    parser.add_argument("--duration-profile", default="model", choices=DURATION_PROFILES, help="任务时长分布")
+    parser.add_argument("--pref-skew", type=float, default=1.0, help="偏好时间倾斜度（0 为均匀）")
+    parser.add_argument("--fixed-density", type=float, default=0.2, help="额外固定任务占空闲时间的比例")
+    parser.add_argument("--max-tasks-per-day", type=int, default=None,
+                        help="每日最大任务数（默认不限制，使引擎对所有任务搜索时间段）")
+    parser.add_argument("--repeats", type=int, default=10, help="每个场景计时的重复次数")
+    parser.add_argument("--warmup", type=int, default=1, help="每个场景计时前不计时运行的次数")
+    parser.add_argument("--seed", type=int, default=42, help="随机种子")
+    parser.add_argument("--output", default=None, help="将结果写入 JSON 文件（可作为基线）")
+    parser.add_argument("--baseline", default=None, help="与保存的基线结果对比，发现回退时以非零状态退出")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的相对回退比例")
+    parser.add_argument("--min-delta-ms", type=float, default=0.1, help="耗时变化的最小噪声下限（毫秒）")
+    parser.add_argument("--noise-mult", type=float, default=3.0,
+                        help="耗时变化需超过中位数绝对偏差的该倍数才视为回退")
+    args = parser.parse_args()
+
+    params = {
+        "duration_profile": args.duration_profile,
+        "pref_skew": args.pref_skew,
+        "fixed_density": args.fixed_density,
+        "max_tasks_per_day": args.max_tasks_per_day,
+        "repeats": args.repeats,
+        "warmup": args.warmup,
+        "seed": args.seed
+    }
+    results = {}
+    for num_days in args.days:
+        for num_tasks in args.sizes:
+            name = f"{num_tasks}x{num_days}d"
+            print(f"测试 {name}...")
+            scenario = generate_scenario(num_tasks, num_days, args.duration_profile, args.pref_skew,
+                                         args.fixed_density, args.seed)
+            results[name] = benchmark_scenario(scenario, args.repeats, args.max_tasks_per_day, args.warmup)
+
+    print(f"\n{'场景':<12} {'调度p50(ms)':>12} {'调度p95(ms)':>12} {'校验p50(ms)':>12} {'总计(ms)':>10} "
+          f"{'峰值分配(KB)':>13} {'安排率':>8} {'有效安排率':>10} {'校验错误':>8}")
+    print("-" * 109)
+    for name, result in results.items():
+        print(f"{name:<12} {result['schedule']['p50_ms']:>12.2f} {result['schedule']['p95_ms']:>12.2f} "
+              f"{result['validate']['p50_ms']:>12.2f} {result['total_ms']:>10.1f} {result['peak_alloc_kb']:>13,.0f} "
+              f"{result['placement_rate']:>8.3f} {result['valid_placement_rate']:>10.3f} {result['validation_errors']:>8}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"params": params, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline["params"] != params:
+            print(f"\n警告: 基线参数不同，对比可能无意义: {baseline['params']}")
+        regressions = compare_results(results, baseline["results"], args.tolerance, args.min_delta_ms,
+                                      args.noise_mult)
+        if regressions:
+            print(f"\n发现 {len(regressions)} 项回退:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("\n与基线相比未发现回退")
+
+if __name__ == "__main__":
+    main()
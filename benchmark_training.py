@@ -0,0 +1,117 @@
+"""
+训练吞吐对比 - 比较固定填充、动态填充、按长度分组与序列打包等数据加载方式的每秒 token 数
+"""
+
+import argparse
+import copy
+import json
+import time
+import torch
+from torch.utils.data import DataLoader
+from typing import Dict, Any
+from config import Config
+from trainer import ScheduleTrainer
+from training_data import (
+    ScheduleCollator, LengthGroupedBatchSampler, PackedDataset, PackedCollator,
+    forward_batch, count_real_tokens
+)
+
+def build_loader(trainer: ScheduleTrainer, mode: str) -> DataLoader:
+    """按模式构建训练数据加载器：fixed 为原先的填充到 MAX_LENGTH，dynamic 为动态填充，grouped 再按长度分组，
+    packed 为序列打包（每批 BATCH_SIZE 个窗口）"""
+    pad_token_id = trainer.model.tokenizer.pad_token_id
+    # 配置开启打包时 prepare_data 得到的是打包数据集，各模式都从逐样本数据集构建
+    dataset = getattr(trainer.train_dataset, "dataset", trainer.train_dataset)
+    if mode == "packed":
+        return DataLoader(
+            PackedDataset(dataset, trainer.config.PACK_LENGTH),
+            batch_size=trainer.config.BATCH_SIZE,
+            shuffle=True,
+            collate_fn=PackedCollator(pad_token_id, trainer.model.model.config.decoder_start_token_id)
+        )
+    if mode == "fixed":
+        collator = ScheduleCollator(pad_token_id, trainer.config.MAX_LENGTH)
+    else:
+        collator = ScheduleCollator(pad_token_id)
+
+    if mode == "grouped":
+        return DataLoader(
+            dataset,
+            batch_sampler=LengthGroupedBatchSampler(dataset.lengths, trainer.config.BATCH_SIZE),
+            collate_fn=collator
+        )
+    return DataLoader(
+        dataset,
+        batch_size=trainer.config.BATCH_SIZE,
+        shuffle=True,
+        collate_fn=collator
+    )
+
+def benchmark_loader(trainer: ScheduleTrainer, loader: DataLoader, num_steps: int) -> Dict[str, Any]:
+    """运行 num_steps 个训练步（前向、反向、优化器），统计真实 token 与填充后 token 的吞吐"""
+    model = trainer.model.model
+    model.train()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=trainer.config.LEARNING_RATE)
+
+    real_tokens = 0
+    padded_tokens = 0
+    steps = 0
+    start = time.perf_counter()
+
+    while steps < num_steps:
+        for batch in loader:
+            batch = {key: value.to(trainer.device) for key, value in batch.items()}
+            loss = forward_batch(model, batch).loss
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+
+            real_tokens += count_real_tokens(batch, trainer.model.tokenizer.pad_token_id)
+            padded_tokens += batch["input_ids"].numel() + batch["labels"].numel()
+            steps += 1
+            if steps >= num_steps:
+                break
+
+    elapsed = time.perf_counter() - start
+    return {
+        "steps": steps,
+        "seconds_per_step": elapsed / steps,
+        "real_tokens_per_second": real_tokens / elapsed,
+        "padded_tokens_per_second": padded_tokens / elapsed,
+        "padding_ratio": 1 - real_tokens / padded_tokens if padded_tokens else 0.0,
+        "estimated_epoch_seconds": elapsed / steps * len(loader)
+    }
+
+def main():
+    """对比各数据加载方式"""
+    parser = argparse.ArgumentParser(description="比较不同填充/分批方式的训练吞吐")
+    parser.add_argument("--steps", type=int, default=20, help="每种方式运行的训练步数")
+    parser.add_argument("--modes", nargs="+", default=["fixed", "dynamic", "grouped", "packed"],
+                        choices=["fixed", "dynamic", "grouped", "packed"], help="对比的加载方式")
+    parser.add_argument("--output", default=None, help="将结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    trainer = ScheduleTrainer(Config())
+    trainer.prepare_data()
+    # 每种方式都从相同的初始权重开始
+    initial_state = copy.deepcopy(trainer.model.model.state_dict())
+
+    results = {}
+    for mode in args.modes:
+        print(f"测试 {mode}...")
+        trainer.model.model.load_state_dict(initial_state)
+        results[mode] = benchmark_loader(trainer, build_loader(trainer, mode), args.steps)
+
+    print(f"\n{'方式':<8} {'秒/步':>8} {'真实token/秒':>14} {'填充比例':>8} {'预计每轮(秒)':>12}")
+    print("-" * 58)
+    for mode, result in results.items():
+        print(f"{mode:<8} {result['seconds_per_step']:>8.3f} {result['real_tokens_per_second']:>14,.0f} "
+              f"{result['padding_ratio']:>8.1%} {result['estimated_epoch_seconds']:>12.1f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存到: {args.output}")
+
+if __name__ == "__main__":
+    main()
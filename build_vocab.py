@@ -0,0 +1,246 @@
+"""
+领域词表构建 - 在 DataGenerator 生成的样本（及线上日志）上训练小型 SentencePiece 词表，
+将已有模型的词嵌入映射到新词表，输出可直接加载的模型目录
+"""
+
+import argparse
+import json
+import os
+import unicodedata
+import warnings
+import torch
+import sentencepiece as spm
+from tokenizers import decoders, models
+from transformers import T5TokenizerFast
+from typing import List, Dict, Any, Iterator, Tuple
+from config import Config
+from data_generator import DataGenerator
+from model import ScheduleT5Model, load_tokenizer
+from task_format import TaskOutputMixin
+
+# 词表训练产物的文件名前缀（与 T5 分词器的 spiece.model 一致）
+SPIECE_PREFIX = "spiece"
+
+# DataGenerator 任务模板之外的任务名：含语料中未出现的字符，用于检查 <unk> 与编码再解码能否还原
+PROBE_TASK_NAMES = [
+    "整理衣柜", "复习考试", "给猫洗澡", "修理水龙头", "准备述职报告", "预约牙医",
+    "缴纳燃气费", "练习尤克里里", "拜访客户", "浇花", "review PR", "🎂生日聚会"
+]
+
+def iter_log_texts(path: str) -> Iterator[str]:
+    """读取日志中的输入文本：JSON 行取 input_text 字段，其余非空行按原文"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    record = None
+                if isinstance(record, dict):
+                    if record.get("input_text"):
+                        yield record["input_text"]
+                    continue
+            yield line
+
+def build_corpus(samples: List[Dict[str, Any]], log_paths: List[str]) -> List[str]:
+    """词表训练语料：样本的输入与目标文本（编码器与解码器共用词表），加上日志中的输入"""
+    output_format = TaskOutputMixin()
+    texts = []
+    for sample in samples:
+        texts.append(sample["input_text"])
+        texts.append(output_format.format_output(sample["output_tasks"]))
+    for path in log_paths:
+        texts.extend(iter_log_texts(path))
+    return texts
+
+def train_sentencepiece(texts: List[str], output_dir: str, vocab_size: int) -> str:
+    """训练 unigram SentencePiece 词表，返回 .model 文件路径"""
+    model_prefix = os.path.join(output_dir, SPIECE_PREFIX)
+    spm.SentencePieceTrainer.train(
+        sentence_iterator=iter(texts),
+        model_prefix=model_prefix,
+        vocab_size=vocab_size,
+        model_type="unigram",
+        # 保留语料中出现的全部汉字；未见过的字符回退为 UTF-8 字节，不产生 <unk>
+        character_coverage=1.0,
+        byte_fallback=True,
+        # 与 T5 的特殊 token 编号一致（无 bos）
+        pad_id=0,
+        eos_id=1,
+        unk_id=2,
+        bos_id=-1,
+        # 输出标签各占一个 token
+        user_defined_symbols=ScheduleT5Model.SPECIAL_TOKENS,
+        # 语料较小时实际词表可以小于 vocab_size
+        hard_vocab_limit=False,
+        num_threads=os.cpu_count() or 1
+    )
+    return f"{model_prefix}.model"
+
+def build_fast_tokenizer(spiece_path: str) -> T5TokenizerFast:
+    """由 SentencePiece 模型构造支持字节回退的快速分词器。
+
+    transformers 的 T5 转换器不实现字节回退，语料中未出现的字符会变成 <unk>，与 T5Tokenizer 的切分不一致；
+    因此把转换结果的模型换成 byte_fallback=True 的 Unigram，解码时再把字节 token 拼回 UTF-8 字符。
+    """
+    with warnings.catch_warnings():
+        # 转换器关于不支持字节回退的警告：下面替换模型后不再适用
+        warnings.simplefilter("ignore", UserWarning)
+        converted = T5TokenizerFast(vocab_file=spiece_path, extra_ids=0)
+    processor = spm.SentencePieceProcessor(model_file=spiece_path)
+    backend = converted.backend_tokenizer
+    backend.model = models.Unigram(
+        [(processor.id_to_piece(i), processor.get_score(i)) for i in range(processor.get_piece_size())],
+        unk_id=processor.unk_id(),
+        byte_fallback=True
+    )
+    backend.decoder = decoders.Sequence([
+        decoders.Replace("\u2581", " "), decoders.ByteFallback(), decoders.Fuse(), decoders.Strip(" ", 1, 0)
+    ])
+    # 以 tokenizer_object 构造：保存的配置中不含 add_prefix_space，重新加载时直接读取 tokenizer.json，
+    # 而不是再由慢速分词器转换（那样会丢掉字节回退）
+    return T5TokenizerFast(tokenizer_object=backend, vocab_file=spiece_path, extra_ids=0)
+
+def remap_embedding(old_weight: torch.Tensor, old_tokenizer, new_tokenizer) -> Tuple[torch.Tensor, Dict[str, int]]:
+    """按 token 文本把旧词嵌入映射到新词表。
+
+    旧词表中有同名 token 时直接复制；否则取该 token 文本经旧分词器切分后各 token 嵌入的均值；
+    仍无法对应（如字节回退 token）时使用旧词嵌入的整体均值。
+    """
+    old_vocab = old_tokenizer.get_vocab()
+    new_weight = old_weight.new_empty((len(new_tokenizer), old_weight.size(1)))
+    mean_embedding = old_weight.mean(dim=0)
+    stats = {"copied": 0, "composed": 0, "mean": 0}
+
+    for token, new_id in new_tokenizer.get_vocab().items():
+        old_id = old_vocab.get(token)
+        if old_id is not None and old_id < old_weight.size(0):
+            new_weight[new_id] = old_weight[old_id]
+            stats["copied"] += 1
+            continue
+
+        text = new_tokenizer.convert_tokens_to_string([token])
+        old_ids = [
+            token_id for token_id in old_tokenizer.encode(text, add_special_tokens=False)
+            if token_id != old_tokenizer.unk_token_id
+        ]
+        if old_ids:
+            new_weight[new_id] = old_weight[old_ids].mean(dim=0)
+            stats["composed"] += 1
+        else:
+            new_weight[new_id] = mean_embedding
+            stats["mean"] += 1
+
+    return new_weight, stats
+
+def remap_model_vocab(schedule_model: ScheduleT5Model, new_tokenizer) -> Dict[str, int]:
+    """把模型的输入词嵌入（及未共享权重时的输出层）映射到新词表，并替换模型的分词器"""
+    model = schedule_model.model
+    input_embeddings = model.get_input_embeddings().weight.data
+    output_embeddings = model.get_output_embeddings().weight.data
+    tied = output_embeddings.data_ptr() == input_embeddings.data_ptr()
+
+    input_weight, stats = remap_embedding(input_embeddings, schedule_model.tokenizer, new_tokenizer)
+    if not tied:
+        output_weight, _ = remap_embedding(output_embeddings, schedule_model.tokenizer, new_tokenizer)
+
+    model.resize_token_embeddings(len(new_tokenizer))
+    with torch.no_grad():
+        model.get_input_embeddings().weight.copy_(input_weight)
+        if not tied:
+            model.get_output_embeddings().weight.copy_(output_weight)
+
+    schedule_model.tokenizer = new_tokenizer
+    return stats
+
+def _normalize_text(text: str) -> str:
+    """与 SentencePiece 的 nmt_nfkc 规范化一致（NFKC、合并空白），用于判断解码结果是否还原原文"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+def tokenizer_report(tokenizer, samples: List[Dict[str, Any]], probe_texts: List[str]) -> Dict[str, float]:
+    """分词效果：生成样本的输入/目标平均 token 数；探测文本（模板外任务名及日志输入）的 <unk> 数、
+    <unk> 比例，以及编码再解码后保持不变的比例"""
+    output_format = TaskOutputMixin()
+    input_lengths = [len(tokenizer.encode(sample["input_text"])) for sample in samples]
+    target_lengths = [len(tokenizer.encode(output_format.format_output(sample["output_tasks"]))) for sample in samples]
+
+    probe_tokens = 0
+    unk_count = 0
+    round_trips = 0
+    for text in probe_texts:
+        token_ids = tokenizer.encode(text, add_special_tokens=False)
+        probe_tokens += len(token_ids)
+        unk_count += token_ids.count(tokenizer.unk_token_id)
+        round_trips += int(_normalize_text(tokenizer.decode(token_ids)) == _normalize_text(text))
+
+    return {
+        "vocab_size": len(tokenizer),
+        "avg_input_tokens": sum(input_lengths) / len(input_lengths),
+        "avg_target_tokens": sum(target_lengths) / len(target_lengths),
+        "unk_count": unk_count,
+        "unk_ratio": unk_count / probe_tokens if probe_tokens else 0.0,
+        "round_trip": round_trips / len(probe_texts) if probe_texts else 0.0
+    }
+
+def compare_tokenizers(sources: Dict[str, str], samples: List[Dict[str, Any]],
+                       probe_texts: List[str]) -> Dict[str, Dict[str, float]]:
+    """按运行时的方式（load_tokenizer 并添加特殊 token）加载每个词表的慢速与快速分词器，分别统计分词效果"""
+    reports = {}
+    for name, path in sources.items():
+        for use_fast in (False, True):
+            tokenizer = load_tokenizer(path, use_fast=use_fast)
+            tokenizer.add_tokens(ScheduleT5Model.SPECIAL_TOKENS)
+            reports[f"{name}/{'fast' if use_fast else 'slow'}"] = tokenizer_report(tokenizer, samples, probe_texts)
+    return reports
+
+def main():
+    """训练领域词表并映射模型词嵌入"""
+    parser = argparse.ArgumentParser(description="训练日程领域的 SentencePiece 词表并映射模型词嵌入")
+    parser.add_argument("--source", default=Config.MODEL_NAME, help="原模型（hub 名称或本地检查点目录）")
+    parser.add_argument("--output-dir", default=Config.DOMAIN_VOCAB_DIR, help="输出的模型目录")
+    parser.add_argument("--vocab-size", type=int, default=8000, help="词表大小上限")
+    parser.add_argument("--num-samples", type=int, default=20000, help="用于训练词表的生成样本数")
+    parser.add_argument("--logs", nargs="*", default=[], help="额外的语料文件（JSONL 取 input_text 字段，或每行一条文本）")
+    parser.add_argument("--seed", type=int, default=Config.SEED, help="生成样本的随机种子")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    print("生成语料...")
+    samples = DataGenerator(seed=args.seed).generate_dataset(args.num_samples)
+    texts = build_corpus(samples, args.logs)
+    print(f"语料: {len(texts)} 条文本")
+
+    print("训练 SentencePiece 词表...")
+    spiece_path = train_sentencepiece(texts, args.output_dir, args.vocab_size)
+    # 由 SentencePiece 模型转换出快速分词器，save_pretrained 同时写出 spiece.model 与 tokenizer.json
+    new_tokenizer = build_fast_tokenizer(spiece_path)
+
+    print(f"加载原模型: {args.source}")
+    schedule_model = ScheduleT5Model(args.source)
+    stats = remap_model_vocab(schedule_model, new_tokenizer)
+    print(f"词嵌入映射: 直接复制 {stats['copied']}, 由旧 token 组合 {stats['composed']}, 均值初始化 {stats['mean']}")
+    schedule_model.save_model(args.output_dir)
+
+    # 生成样本（未参与训练的种子）只用于比较序列长度：它与训练语料共用任务模板，<unk> 与还原率
+    # 在模板外的任务名及日志输入上统计
+    held_out = DataGenerator(seed=args.seed + 1).generate_dataset(500)
+    probe_texts = PROBE_TASK_NAMES + [text for path in args.logs for text in iter_log_texts(path)]
+    reports = compare_tokenizers({"original": args.source, "domain": args.output_dir}, held_out, probe_texts)
+    with open(os.path.join(args.output_dir, "vocab_report.json"), 'w', encoding='utf-8') as f:
+        json.dump({"embedding_remap": stats, "tokenizers": reports}, f, ensure_ascii=False, indent=2)
+
+    print(f"\n探测文本: {len(PROBE_TASK_NAMES)} 个模板外任务名, {len(probe_texts) - len(PROBE_TASK_NAMES)} 条日志输入")
+    print(f"{'词表/分词器':<16} {'大小':>8} {'输入token':>10} {'目标token':>10} {'<unk>数':>8} {'<unk>比例':>10} {'还原率':>8}")
+    print("-" * 78)
+    for name, report in reports.items():
+        print(f"{name:<16} {report['vocab_size']:>8} {report['avg_input_tokens']:>10.1f} "
+              f"{report['avg_target_tokens']:>10.1f} {report['unk_count']:>8} {report['unk_ratio']:>10.2%} "
+              f"{report['round_trip']:>8.1%}")
+    print(f"\n模型已保存到: {args.output_dir}（可设为 Config.MODEL_NAME 后用 trainer.py 继续微调）")
+
+if __name__ == "__main__":
+    main()
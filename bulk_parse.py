@@ -0,0 +1,76 @@
+"""
+批量规则解析 - 流式读取请求日志（JSONL 或纯文本），多进程解析后逐行写出 JSONL 结果
+"""
+
+import argparse
+import sys
+import time
+from lightweight_main import RuleBasedParser
+
+def detect_format(path: str) -> str:
+    """按扩展名判断输入格式"""
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "text"
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="流式批量解析请求日志，结果写为 JSONL")
+    parser.add_argument("input", help="输入文件路径，- 表示标准输入")
+    parser.add_argument("--output", default="-", help="结果文件路径，- 表示标准输出")
+    parser.add_argument("--errors", default=None, help="将无法解析的行写入该文件")
+    parser.add_argument("--format", choices=["auto", "jsonl", "text"], default="auto", help="输入格式")
+    parser.add_argument("--field", default="input_text", help="JSONL 中的文本字段")
+    parser.add_argument("--workers", type=int, default=1, help="工作进程数")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="每块的行数")
+    parser.add_argument("--report-every", type=int, default=100000, help="每处理多少行输出一次进度")
+    args = parser.parse_args()
+
+    input_format = args.format
+    if input_format == "auto":
+        input_format = detect_format(args.input)
+
+    # 以二进制方式逐行读取，解码在工作进程中完成，解码失败计为坏行
+    input_file = sys.stdin.buffer if args.input == "-" else open(args.input, 'rb')
+    output_file = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8')
+    errors_file = open(args.errors, 'w', encoding='utf-8') if args.errors else None
+
+    num_parsed = 0
+    num_bad = 0
+    start = time.perf_counter()
+
+    try:
+        records = RuleBasedParser().parse_stream(
+            input_file,
+            input_format=input_format,
+            text_field=args.field,
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            serialize=True
+        )
+        for is_error, line in records:
+            if is_error:
+                num_bad += 1
+                if errors_file:
+                    errors_file.write(line + "\n")
+                continue
+
+            num_parsed += 1
+            output_file.write(line + "\n")
+
+            if args.report_every and num_parsed % args.report_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f"已处理 {num_parsed + num_bad} 行 ({(num_parsed + num_bad) / elapsed:,.0f} 行/秒)", file=sys.stderr)
+    finally:
+        if input_file is not sys.stdin.buffer:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+        if errors_file:
+            errors_file.close()
+
+    elapsed = time.perf_counter() - start
+    num_lines = num_parsed + num_bad
+    print(f"解析完成: {num_lines} 行, 成功 {num_parsed}, 坏行 {num_bad}", file=sys.stderr)
+    print(f"耗时 {elapsed:.2f} 秒, 吞吐 {num_lines / elapsed if elapsed else 0.0:,.0f} 行/秒", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
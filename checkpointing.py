@@ -0,0 +1,117 @@
+"""
+训练检查点 - 保存/恢复完整训练状态（模型、优化器、学习率调度、随机数状态与数据位置），后台线程异步写盘
+"""
+
+import os
+import random
+import re
+import threading
+import numpy as np
+import torch
+from typing import Any, Dict, List, Optional
+
+# 检查点文件名：step-<参数更新次数>.pt
+CHECKPOINT_PATTERN = re.compile(r"^step-(\d+)\.pt$")
+
+def to_cpu(obj: Any) -> Any:
+    """递归复制状态中的张量到 CPU（与训练中继续更新的张量脱离），其他对象原样返回"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {key: to_cpu(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(value) for value in obj)
+    return obj
+
+def get_rng_state() -> Dict[str, Any]:
+    """当前进程的随机数状态（Python、NumPy、torch，有 GPU 时含 CUDA）"""
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state()
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state: Dict[str, Any]):
+    """恢复 get_rng_state 保存的随机数状态"""
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+def list_checkpoints(checkpoint_dir: str) -> List[str]:
+    """目录中已完成的检查点，按参数更新次数升序（写入中的临时文件不计入）"""
+    if not os.path.isdir(checkpoint_dir):
+        return []
+    steps = []
+    for filename in os.listdir(checkpoint_dir):
+        match = CHECKPOINT_PATTERN.match(filename)
+        if match:
+            steps.append((int(match.group(1)), filename))
+    return [os.path.join(checkpoint_dir, filename) for _, filename in sorted(steps)]
+
+def latest_checkpoint(checkpoint_dir: str) -> Optional[str]:
+    """最新的检查点路径，没有时返回 None"""
+    checkpoints = list_checkpoints(checkpoint_dir)
+    return checkpoints[-1] if checkpoints else None
+
+def load_checkpoint(path: str) -> Dict[str, Any]:
+    """读取检查点（张量加载到 CPU）"""
+    # 状态中含 NumPy 随机数状态等非张量对象，需关闭 weights_only
+    return torch.load(path, map_location="cpu", weights_only=False)
+
+class AsyncCheckpointer:
+    """异步检查点写入器。
+
+    save 在调用线程中把状态复制到 CPU（训练随后可以继续修改参数），再由后台线程写盘：
+    先写临时文件并 fsync，再原子重命名为 step-<N>.pt，因此中途被杀死也不会留下不完整的检查点；
+    写完后只保留最近 keep 个。同一时刻最多一个写入任务，上一次未完成时 save 会先等待。
+    """
+
+    def __init__(self, checkpoint_dir: str, keep: int = 3):
+        self.checkpoint_dir = checkpoint_dir
+        self.keep = keep
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    def save(self, step: int, state: Dict[str, Any]):
+        """保存第 step 次参数更新后的训练状态"""
+        self.wait()
+        snapshot = to_cpu(state)
+        self._thread = threading.Thread(target=self._write, args=(step, snapshot), daemon=True)
+        self._thread.start()
+
+    def wait(self):
+        """等待正在进行的写入完成；写入失败时在此抛出异常"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("检查点写入失败") from error
+
+    def _write(self, step: int, snapshot: Dict[str, Any]):
+        """后台线程：写临时文件、原子重命名、轮换旧检查点"""
+        path = os.path.join(self.checkpoint_dir, f"step-{step:08d}.pt")
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        try:
+            with open(tmp_path, 'wb') as f:
+                torch.save(snapshot, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self._rotate()
+        except BaseException as e:
+            self._error = e
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _rotate(self):
+        """删除超出保留数量的旧检查点"""
+        checkpoints = list_checkpoints(self.checkpoint_dir)
+        for path in checkpoints[:max(len(checkpoints) - self.keep, 0)]:
+            os.remove(path)
@@ -6,15 +6,79 @@ class Config:
     # 模型配置
     MODEL_NAME = "t5-small"  # 使用较小的模型以减少内存占用
     MAX_LENGTH = 512
+    USE_FAST_TOKENIZER = False  # 使用 T5TokenizerFast（Rust 实现，批量编码更快），False 时使用 SentencePiece 的 T5Tokenizer
+    DOMAIN_VOCAB_DIR = "models/domain_vocab"  # build_vocab.py 输出的领域词表模型目录（可作为 MODEL_NAME 继续微调）
     BATCH_SIZE = 8
     LEARNING_RATE = 3e-5
     NUM_EPOCHS = 10
     WARMUP_STEPS = 500
+    DYNAMIC_PADDING = True  # 每批填充到最长序列（False 时填充到 MAX_LENGTH）
+    GROUP_BY_LENGTH = True  # 训练时按长度分组成批，减少填充
+    PACK_SEQUENCES = False  # 把多个短样本打包进同一窗口训练（样本之间互不可见），BATCH_SIZE 即每批窗口数
+    PACK_LENGTH = 256       # 打包窗口的最大输入/目标长度
+    MIXED_PRECISION = None  # "bf16": 前向在 bfloat16 autocast 下计算（CPU 与 GPU 均可），None 为 fp32
+    GRADIENT_ACCUMULATION_STEPS = 1  # 每次参数更新累积的微批数，有效批大小 = BATCH_SIZE * 该值
+    GRADIENT_CHECKPOINTING = False   # 对 T5 各层做梯度检查点：反向时重算激活，以计算换内存
+    SEED = 42  # 训练随机种子（数据打乱顺序与 dropout），恢复训练时据此复现
+    CHECKPOINT_DIR = "models/checkpoints"  # 完整训练状态检查点目录（python trainer.py --resume 恢复）
+    CHECKPOINT_EVERY_STEPS = 500  # 每多少次参数更新保存一次检查点（后台线程写盘），0 表示不保存
+    CHECKPOINT_KEEP = 3           # 保留最近的检查点个数
+    
+    # 训练中验证与早停配置
+    EVAL_EVERY_STEPS = 0       # 每多少次参数更新验证一次，0 表示每个 epoch 结束时验证
+    EVAL_SUBSAMPLE = None      # 训练中验证损失使用的样本数（固定的随机子集），None 表示整个验证集
+    GENERATION_EVAL_SAMPLES = 64    # 生成式指标（批量贪心解码 + parse_output）使用的验证样本数，0 表示不计算
+    GENERATION_EVAL_BATCH_SIZE = 32 # 生成式指标的批大小
+    EVAL_METRIC = "val_loss"   # 选择最佳模型与早停的指标：val_loss（越小越好）或 task_f1 等生成式指标（越大越好）
+    EARLY_STOPPING_PATIENCE = 0     # 连续多少次验证没有改进就停止训练，0 表示不早停
+    EARLY_STOPPING_MIN_DELTA = 0.0  # 视为改进所需的最小变化量
+    
+    # 训练度量与性能分析
+    TRAIN_METRICS_PATH = "models/train_metrics.jsonl"  # 每次参数更新一行的度量（耗时拆分、吞吐、填充比例、RSS），None 表示不写
+    PROFILE_STEPS = None        # (A, B)：在第 A..B 次参数更新期间运行 torch profiler，None 表示不开启
+    PROFILE_DIR = "models/profile"  # profiler trace 输出目录
+    
+    # 知识蒸馏配置（python trainer.py --distill <教师检查点目录>）
+    DISTILL_OUTPUT_DIR = "models/student"  # 学生模型输出目录，best_model 可直接作为 PersonalScheduleGenerator 的 model_path
+    DISTILL_LEARNING_RATE = 1e-3   # 学生从头初始化，学习率高于微调
+    DISTILL_TEMPERATURE = 2.0      # 软目标温度
+    DISTILL_ALPHA = 0.5            # 软目标（KL）损失的权重，其余为硬标签交叉熵
+    DISTILL_TEACHER_LABELS = False # True: 硬标签为教师贪心解码的结果（序列级蒸馏）；False: 使用数据生成器的标注
+    STUDENT_D_MODEL = 256          # 学生模型结构（本地构建，不从 hub 下载）
+    STUDENT_D_FF = 1024
+    STUDENT_D_KV = 64
+    STUDENT_NUM_HEADS = 4
+    STUDENT_NUM_LAYERS = 2         # 编码器与解码器各自的层数
+    
+    # 分布式训练配置（torchrun --nproc_per_node=N trainer.py 启动时生效，BATCH_SIZE 为全局批大小）
+    DIST_BACKEND = "gloo"            # CPU 上使用 gloo 通信后端
+    DIST_THREADS_PER_PROCESS = None  # 每个训练进程的 torch 线程数，None 表示按本机 CPU 核数均分
+    
+    # 解码配置
+    DECODING_STRATEGY = "adaptive"  # adaptive: 先贪心解码，校验失败再用束搜索；beam: 始终束搜索
+    NUM_BEAMS = 4
+    QUANTIZE = None  # "int8": 对线性层做动态量化，仅用于 CPU 推理
+    SPECULATIVE_DRAFT = True  # 贪心解码时以规则解析结果为草稿做推测解码
+    
+    # 推理服务配置
+    SERVER_MAX_BATCH_SIZE = 16  # 单次批量生成的最大请求数
+    SERVER_MAX_WAIT_MS = 10     # 攒批的最长等待时间（毫秒）
+    SERVER_NUM_THREADS = 4      # 规则解析与调度线程池大小
+    REQUEST_DEADLINE_MS = None  # 单个请求的时限（毫秒），None 表示不限制
+    MODEL_STAGE_SHARE = 0.7     # 模型解析阶段可占用的时限比例，超出后改用规则解析
+    SEGMENT_CACHE_SIZE = 50000  # 规则解析的任务片段缓存条数（LRU），0 表示不缓存
     
     # 数据配置
     TRAIN_DATA_PATH = "data/train_data.json"
     VAL_DATA_PATH = "data/val_data.json"
+    PRETOKENIZED_DIR = "data/pretokenized"  # 预分词产物目录（与分词器指纹绑定）
+    TRAIN_DATA_SOURCE = "file"  # file: 预分词的训练数据文件；stream: 由 DataGenerator 实时生成的无限数据流
+    STREAM_STEPS_PER_EPOCH = 125  # stream 模式下每个 epoch 的训练步数
+    STREAM_SEED = 42             # stream 模式的随机种子（各工作进程由此派生互不重复的种子）
+    NUM_WORKERS = 2              # stream 模式的 DataLoader 工作进程数（生成与分词在其中完成）
     OUTPUT_DIR = "models/"
+    PREPARED_MODEL_DIR = "models/prepared"  # 模型注册表的预处理产物目录
+    USE_MODEL_REGISTRY = True  # 通过模型注册表加载（内存映射权重，多进程共享），量化模式下不使用
     
     # 日程配置
     SLEEP_START = "22:00"  # 睡眠开始时间
@@ -2,13 +2,39 @@
 数据生成器 - 生成训练和验证数据
 """
 
+import argparse
 import json
+import os
 import random
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Optional, Sequence
+from config import Config
+from dataset_io import save_dataset, load_dataset
+
+# 批量生成时每次向量化抽样并渲染的样本数（固定值，保证同一种子的输出与进程数无关）
+BULK_CHUNK_SIZE = 100000
+
+def format_duration(minutes: int) -> str:
+    """时长文本：90 -> 1小时30分钟"""
+    hours = minutes // 60
+    minutes = minutes % 60
+    if hours > 0:
+        time_str = f"{hours}小时"
+        if minutes > 0:
+            time_str += f"{minutes}分钟"
+    else:
+        time_str = f"{minutes}分钟"
+    return time_str
 
 class DataGenerator:
-    def __init__(self):
+    def __init__(self, seed: Optional[int] = None):
+        # 指定种子时使用独立的随机数生成器，否则沿用全局 random
+        self.rng = random.Random(seed) if seed is not None else random
+        # 批量生成使用 NumPy Generator（未指定种子时从系统熵初始化）
+        self.np_rng = np.random.default_rng(seed)
         self.task_templates = [
             "写周报", "健身", "开会", "学习", "阅读", "写作", "编程", "设计",
             "购物", "做饭", "打扫", "洗衣服", "看电影", "听音乐", "散步",
@@ -19,22 +45,34 @@ class DataGenerator:
         self.priorities = ["紧急重要", "重要", "一般", "低优先级"]
         self.locations = ["在家", "公司", "健身房", "图书馆", "咖啡厅", "户外"]
         self.weekdays = ["周一", "周二", "周三", "周四", "周五", "周六", "周日"]
+        self.durations = [30, 60, 90, 120, 180, 240]  # 分钟
+        
+        # 批量渲染用的查找表：上下文前缀按 (星期, 地点)，任务描述按 (任务, 时长) 预先拼好
+        self._context_texts = [
+            f"上下文：{weekday} {location} ｜ 需求：" for weekday in self.weekdays for location in self.locations
+        ]
+        self._task_descriptions = [
+            f"{task}{format_duration(duration)}" for task in self.task_templates for duration in self.durations
+        ]
+        self._priority_levels = [self.get_priority_level(priority) for priority in self.priorities]
+        self._output_task_table = self._output_tasks()
+        self._output_task_json = [json.dumps(task, ensure_ascii=False) for task in self._output_task_table]
         
     def generate_single_sample(self) -> Dict[str, Any]:
         """生成单个训练样本"""
         # 随机选择上下文信息
-        weekday = random.choice(self.weekdays)
-        location = random.choice(self.locations)
+        weekday = self.rng.choice(self.weekdays)
+        location = self.rng.choice(self.locations)
         
         # 生成1-4个任务
-        num_tasks = random.randint(1, 4)
+        num_tasks = self.rng.randint(1, 4)
         tasks = []
         
         for _ in range(num_tasks):
-            task = random.choice(self.task_templates)
-            duration = random.choice([30, 60, 90, 120, 180, 240])  # 分钟
-            pref_time = random.choice(self.time_preferences)
-            priority = random.choice(self.priorities)
+            task = self.rng.choice(self.task_templates)
+            duration = self.rng.choice(self.durations)
+            pref_time = self.rng.choice(self.time_preferences)
+            priority = self.rng.choice(self.priorities)
             
             tasks.append({
                 "task": task,
@@ -47,16 +85,7 @@ class DataGenerator:
         input_text = f"上下文：{weekday} {location} ｜ 需求："
         task_descriptions = []
         for task in tasks:
-            hours = task["duration"] // 60
-            minutes = task["duration"] % 60
-            if hours > 0:
-                time_str = f"{hours}小时"
-                if minutes > 0:
-                    time_str += f"{minutes}分钟"
-            else:
-                time_str = f"{minutes}分钟"
-            
-            task_descriptions.append(f"{task['task']}{time_str}")
+            task_descriptions.append(f"{task['task']}{format_duration(task['duration'])}")
         
         input_text += "，".join(task_descriptions)
         
@@ -75,40 +104,156 @@ class DataGenerator:
         }
         return priority_map.get(priority_name, 3)
     
+    def _draw_batch(self, num_samples: int) -> Dict[str, np.ndarray]:
+        """一次性为 num_samples 个样本抽取全部随机字段（分布与 generate_single_sample 相同）。
+
+        所有样本的任务展平成一维数组，按 num_tasks 的累计和（task_ends）切分回各样本。
+        """
+        rng = self.np_rng
+        num_tasks = rng.integers(1, 5, size=num_samples)
+        context_ids = (rng.integers(len(self.weekdays), size=num_samples) * len(self.locations)
+                       + rng.integers(len(self.locations), size=num_samples))
+        
+        total_tasks = int(num_tasks.sum())
+        task_ids = rng.integers(len(self.task_templates), size=total_tasks)
+        duration_ids = rng.integers(len(self.durations), size=total_tasks)
+        pref_ids = rng.integers(len(self.time_preferences), size=total_tasks)
+        priority_ids = rng.integers(len(self.priorities), size=total_tasks)
+        
+        # 任务描述与输出任务都由 (任务, 时长, 偏好时间, 优先级) 唯一确定，合成一个查找表下标
+        description_ids = task_ids * len(self.durations) + duration_ids
+        output_ids = (description_ids * len(self.time_preferences) + pref_ids) * len(self.priorities) + priority_ids
+        return {
+            "context_ids": context_ids,
+            "task_ends": np.cumsum(num_tasks),
+            "description_ids": description_ids,
+            "output_ids": output_ids
+        }
+    
+    def _output_tasks(self) -> List[Dict[str, Any]]:
+        """所有 (任务, 时长, 偏好时间, 优先级) 组合的输出任务，顺序与 _draw_batch 的 output_ids 一致"""
+        return [
+            {"task": task, "duration": duration, "pref_time": pref_time, "priority": priority}
+            for task in self.task_templates
+            for duration in self.durations
+            for pref_time in self.time_preferences
+            for priority in self._priority_levels
+        ]
+    
+    def generate_batch(self, num_samples: int) -> List[Dict[str, Any]]:
+        """批量生成样本：向量化抽取随机字段，再用查找表渲染文本（np_rng 同一种子结果可复现）"""
+        draw = self._draw_batch(num_samples)
+        descriptions = [self._task_descriptions[i] for i in draw["description_ids"].tolist()]
+        output_tasks = [dict(self._output_task_table[i]) for i in draw["output_ids"].tolist()]
+        
+        samples = []
+        start = 0
+        for context_id, end in zip(draw["context_ids"].tolist(), draw["task_ends"].tolist()):
+            samples.append({
+                "input_text": self._context_texts[context_id] + "，".join(descriptions[start:end]),
+                "output_tasks": output_tasks[start:end]
+            })
+            start = end
+        return samples
+    
+    def generate_jsonl_batch(self, num_samples: int) -> str:
+        """批量生成样本并直接渲染成 JSONL 文本（每行一个样本）。
+
+        与 generate_batch 消耗相同的随机数，输出等同于对其结果逐条 json.dumps(ensure_ascii=False)；
+        模板文本不含需转义的字符，行由预先序列化的片段拼接而成，省去逐条序列化的开销。
+        """
+        draw = self._draw_batch(num_samples)
+        descriptions = [self._task_descriptions[i] for i in draw["description_ids"].tolist()]
+        output_tasks = [self._output_task_json[i] for i in draw["output_ids"].tolist()]
+        
+        lines = []
+        start = 0
+        for context_id, end in zip(draw["context_ids"].tolist(), draw["task_ends"].tolist()):
+            lines.append(
+                f'{{"input_text": "{self._context_texts[context_id]}{"，".join(descriptions[start:end])}", '
+                f'"output_tasks": [{", ".join(output_tasks[start:end])}]}}\n'
+            )
+            start = end
+        return "".join(lines)
+    
     def generate_dataset(self, num_samples: int) -> List[Dict[str, Any]]:
         """生成完整数据集"""
         dataset = []
-        for _ in range(num_samples):
-            sample = self.generate_single_sample()
-            dataset.append(sample)
+        while len(dataset) < num_samples:
+            dataset.extend(self.generate_batch(min(num_samples - len(dataset), BULK_CHUNK_SIZE)))
         return dataset
     
-    def save_dataset(self, dataset: List[Dict[str, Any]], filepath: str):
-        """保存数据集到文件"""
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(dataset, f, ensure_ascii=False, indent=2)
+    def save_dataset(self, dataset: Iterable[Dict[str, Any]], filepath: str):
+        """保存数据集到文件（按扩展名选择 .json / .jsonl，见 dataset_io）"""
+        save_dataset(dataset, filepath)
+    
+    def load_dataset(self, filepath: str) -> Sequence[Dict[str, Any]]:
+        """从文件加载数据集（.jsonl 返回按需读取的 JsonlDataset）"""
+        return load_dataset(filepath)
+
+def shard_seeds(seed: int, num_shards: int) -> List[int]:
+    """由总种子派生各分片互相独立的种子（SeedSequence.spawn），分片内容与并行进程数无关"""
+    children = np.random.SeedSequence(seed).spawn(num_shards)
+    return [int.from_bytes(child.generate_state(4).tobytes(), "little") for child in children]
+
+def write_shard(path: str, num_samples: int, seed: int) -> int:
+    """生成一个分片并写成 JSONL（每行一个样本），按 BULK_CHUNK_SIZE 分块生成，内存与分片大小无关"""
+    generator = DataGenerator(seed=seed)
+    tmp_path = f"{path}.tmp"
+    written = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        while written < num_samples:
+            batch_size = min(num_samples - written, BULK_CHUNK_SIZE)
+            f.write(generator.generate_jsonl_batch(batch_size))
+            written += batch_size
+    # 写完再改名，中途中断不会留下看似完整的分片
+    os.replace(tmp_path, path)
+    return written
+
+def generate_shards(num_samples: int, output_dir: str, num_shards: int, seed: int,
+                    num_workers: Optional[int] = None) -> List[str]:
+    """把 num_samples 个样本均分到 num_shards 个 JSONL 分片，由 num_workers 个进程并行生成写入，返回分片路径"""
+    os.makedirs(output_dir, exist_ok=True)
+    sizes = [num_samples // num_shards + (1 if i < num_samples % num_shards else 0) for i in range(num_shards)]
+    paths = [os.path.join(output_dir, f"shard-{i:05d}-of-{num_shards:05d}.jsonl") for i in range(num_shards)]
     
-    def load_dataset(self, filepath: str) -> List[Dict[str, Any]]:
-        """从文件加载数据集"""
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
+    with ProcessPoolExecutor(max_workers=num_workers or os.cpu_count()) as executor:
+        list(executor.map(write_shard, paths, sizes, shard_seeds(seed, num_shards)))
+    return paths
 
 def main():
     """生成训练和验证数据"""
-    generator = DataGenerator()
+    parser = argparse.ArgumentParser(description="生成训练和验证数据")
+    parser.add_argument("--train-samples", type=int, default=1000, help="训练样本数")
+    parser.add_argument("--val-samples", type=int, default=200, help="验证样本数")
+    parser.add_argument("--seed", type=int, default=Config.SEED, help="随机种子（验证集使用 seed + 1）")
+    parser.add_argument("--bulk", type=int, default=None, help="批量模式：生成指定数量的样本，写成多个 JSONL 分片")
+    parser.add_argument("--shards", type=int, default=64, help="批量模式的分片数")
+    parser.add_argument("--workers", type=int, default=None, help="批量模式的并行进程数（默认 CPU 核数）")
+    parser.add_argument("--output-dir", default="data/bulk", help="批量模式的输出目录")
+    args = parser.parse_args()
+    
+    if args.bulk is not None:
+        start = time.perf_counter()
+        paths = generate_shards(args.bulk, args.output_dir, args.shards, args.seed, args.workers)
+        elapsed = time.perf_counter() - start
+        print(f"生成 {args.bulk} 个样本，{len(paths)} 个分片，耗时 {elapsed:.1f} 秒"
+              f"（{args.bulk / elapsed:,.0f} 样本/秒）: {args.output_dir}")
+        return
     
     # 创建数据目录
-    import os
     os.makedirs("data", exist_ok=True)
     
     # 生成训练数据
     print("生成训练数据...")
-    train_data = generator.generate_dataset(1000)
+    generator = DataGenerator(seed=args.seed)
+    train_data = generator.generate_dataset(args.train_samples)
     generator.save_dataset(train_data, "data/train_data.json")
     
     # 生成验证数据
     print("生成验证数据...")
-    val_data = generator.generate_dataset(200)
+    generator = DataGenerator(seed=args.seed + 1)
+    val_data = generator.generate_dataset(args.val_samples)
     generator.save_dataset(val_data, "data/val_data.json")
     
     print(f"训练数据: {len(train_data)} 样本")
@@ -0,0 +1,152 @@
+"""
+数据集读写 - 按扩展名选择格式：.json（整个列表一次读入）或 .jsonl（逐行流式读写，附偏移索引支持随机访问）
+"""
+
+import json
+import os
+import numpy as np
+from collections.abc import Sequence
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Union
+
+# JSONL 的偏移索引文件：<数据文件>.idx，int64 数组，依次为每个样本行的起始字节偏移，最后一项为数据文件大小
+INDEX_SUFFIX = ".idx"
+
+# 写入时每累计多少个偏移刷写一次索引（内存占用与数据集大小无关）
+INDEX_FLUSH_SIZE = 65536
+
+def dataset_format(filepath: str) -> str:
+    """由扩展名判断数据集格式"""
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == ".json":
+        return "json"
+    if extension == ".jsonl":
+        return "jsonl"
+    raise ValueError(f"不支持的数据集格式: {filepath}（支持 .json / .jsonl）")
+
+def save_dataset(dataset: Iterable[Dict[str, Any]], filepath: str):
+    """保存数据集。.jsonl 逐条写入（dataset 可以是生成器）并同时写出偏移索引"""
+    if dataset_format(filepath) == "json":
+        with open(filepath, 'w', encoding='utf-8') as f:
+            json.dump(list(dataset), f, ensure_ascii=False, indent=2)
+        return
+
+    index_path = filepath + INDEX_SUFFIX
+    tmp_path = f"{filepath}.tmp{os.getpid()}"
+    tmp_index_path = f"{index_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f, open(tmp_index_path, 'wb') as index_file:
+        offsets = []
+        position = 0
+        for sample in dataset:
+            line = (json.dumps(sample, ensure_ascii=False) + "\n").encode('utf-8')
+            f.write(line)
+            offsets.append(position)
+            position += len(line)
+            if len(offsets) >= INDEX_FLUSH_SIZE:
+                np.asarray(offsets, dtype=np.int64).tofile(index_file)
+                offsets = []
+        offsets.append(position)
+        np.asarray(offsets, dtype=np.int64).tofile(index_file)
+    # 先替换数据文件再替换索引，索引的修改时间不早于数据文件
+    os.replace(tmp_path, filepath)
+    os.replace(tmp_index_path, index_path)
+
+def load_dataset(filepath: str) -> Union[List[Dict[str, Any]], "JsonlDataset"]:
+    """加载数据集：.json 返回列表；.jsonl 返回按需读取的 JsonlDataset，内存占用与样本数无关"""
+    if dataset_format(filepath) == "json":
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return JsonlDataset(filepath)
+
+def iter_jsonl(filepath: str) -> Iterator[Dict[str, Any]]:
+    """顺序流式读取 JSONL 文件中的样本（跳过空行）"""
+    with open(filepath, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def build_jsonl_index(filepath: str, index_path: Optional[str] = None) -> str:
+    """扫描一遍 JSONL 文件，写出偏移索引（如由 data_generator 批量模式生成的分片）"""
+    index_path = index_path or filepath + INDEX_SUFFIX
+    tmp_index_path = f"{index_path}.tmp{os.getpid()}"
+    with open(filepath, 'rb') as f, open(tmp_index_path, 'wb') as index_file:
+        offsets = []
+        position = 0
+        for line in f:
+            if line.strip():
+                offsets.append(position)
+                if len(offsets) >= INDEX_FLUSH_SIZE:
+                    np.asarray(offsets, dtype=np.int64).tofile(index_file)
+                    offsets = []
+            position += len(line)
+        offsets.append(position)
+        np.asarray(offsets, dtype=np.int64).tofile(index_file)
+    os.replace(tmp_index_path, index_path)
+    return index_path
+
+def is_index_current(filepath: str, index_path: str) -> bool:
+    """索引存在、不早于数据文件，且记录的文件大小与数据文件一致"""
+    if not os.path.exists(index_path):
+        return False
+    index_size = os.path.getsize(index_path)
+    if index_size < 8 or index_size % 8 != 0:
+        return False
+    if os.path.getmtime(index_path) < os.path.getmtime(filepath):
+        return False
+    with open(index_path, 'rb') as f:
+        f.seek(-8, os.SEEK_END)
+        recorded_size = int(np.frombuffer(f.read(8), dtype=np.int64)[0])
+    return recorded_size == os.path.getsize(filepath)
+
+class JsonlDataset(Sequence):
+    """JSONL 数据集的只读随机访问视图。
+
+    偏移索引以 np.memmap 映射，按下标读取时只 seek 并解析对应的一行；顺序迭代则流式读取整个文件。
+    索引缺失或过期时先重建。文件句柄在首次访问时打开，DataLoader 工作进程各自重新打开。
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        self.index_path = filepath + INDEX_SUFFIX
+        if not is_index_current(filepath, self.index_path):
+            build_jsonl_index(filepath, self.index_path)
+        self._length = os.path.getsize(self.index_path) // 8 - 1
+        self._offsets = None
+        self._file = None
+
+    def _open(self):
+        """首次访问时映射索引并打开数据文件"""
+        if self._file is None:
+            self._offsets = np.memmap(self.index_path, dtype=np.int64, mode='r')
+            self._file = open(self.filepath, 'rb')
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(f"样本下标越界: {index}")
+        self._open()
+        start, end = int(self._offsets[index]), int(self._offsets[index + 1])
+        self._file.seek(start)
+        return json.loads(self._file.read(end - start))
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter_jsonl(self.filepath)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # 不序列化文件句柄与映射
+        state = self.__dict__.copy()
+        state["_offsets"] = None
+        state["_file"] = None
+        return state
+
+    def close(self):
+        """关闭数据文件"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._offsets = None
@@ -0,0 +1,232 @@
+"""
+模型导出 - 将训练好的检查点导出为 ONNX 编码器/解码步计算图，并校验与 eager 模型的一致性
+"""
+
+import argparse
+import json
+import os
+import time
+import torch
+import torch.nn as nn
+from typing import List, Dict, Any
+from transformers import T5ForConditionalGeneration, T5TokenizerFast
+from config import Config
+from dataset_io import load_dataset
+from model import ScheduleT5Model
+from metrics import latency_summary
+from onnx_model import (
+    ScheduleOnnxModel, ENCODER_FILE, DECODER_INIT_FILE, DECODER_STEP_FILE,
+    TOKENIZER_FILE, EXPORT_CONFIG_FILE, PAST_KINDS, past_names
+)
+
+class EncoderGraph(nn.Module):
+    """编码器：input_ids, attention_mask -> encoder_hidden_states"""
+
+    def __init__(self, model: T5ForConditionalGeneration):
+        super().__init__()
+        self.encoder = model.get_encoder()
+
+    def forward(self, input_ids, attention_mask):
+        return self.encoder(input_ids=input_ids, attention_mask=attention_mask, return_dict=False)[0]
+
+class DecoderGraph(nn.Module):
+    """单步解码器：输出 logits 与展平的缓存。
+
+    with_past=False 为首步，计算交叉注意力缓存；with_past=True 时输入上一步的缓存。
+    """
+
+    def __init__(self, model: T5ForConditionalGeneration, with_past: bool):
+        super().__init__()
+        self.decoder = model.get_decoder()
+        self.lm_head = model.lm_head
+        self.with_past = with_past
+        # 与 T5ForConditionalGeneration.forward 一致：共享词嵌入时对输出做缩放
+        self.output_scale = model.model_dim ** -0.5 if model.config.tie_word_embeddings else 1.0
+
+    def forward(self, decoder_input_ids, encoder_hidden_states, encoder_attention_mask, *past):
+        past_key_values = None
+        if self.with_past:
+            num_kinds = len(PAST_KINDS)
+            past_key_values = tuple(
+                tuple(past[i:i + num_kinds]) for i in range(0, len(past), num_kinds)
+            )
+
+        outputs = self.decoder(
+            input_ids=decoder_input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            encoder_attention_mask=encoder_attention_mask,
+            past_key_values=past_key_values,
+            use_cache=True,
+            return_dict=False
+        )
+        logits = self.lm_head(outputs[0] * self.output_scale)
+
+        present = outputs[1]
+        if hasattr(present, "to_legacy_cache"):
+            present = present.to_legacy_cache()
+        return (logits,) + tuple(tensor for layer in present for tensor in layer)
+
+def _past_dynamic_axes(names, self_axis: str):
+    """缓存张量的动态维度：batch 与序列长度（交叉注意力缓存的长度为编码序列长度）"""
+    return {
+        name: {0: "batch", 2: "encoder_sequence" if "cross" in name else self_axis}
+        for name in names
+    }
+
+def export_model(checkpoint_path: str, output_dir: str, opset_version: int = 14):
+    """将 ScheduleTrainer.save_model 保存的检查点导出为 ONNX"""
+    os.makedirs(output_dir, exist_ok=True)
+
+    model = T5ForConditionalGeneration.from_pretrained(checkpoint_path)
+    model.eval()
+    tokenizer = T5TokenizerFast.from_pretrained(checkpoint_path)
+    num_layers = model.config.num_decoder_layers
+    input_names = ["decoder_input_ids", "encoder_hidden_states", "encoder_attention_mask"]
+    decoder_axes = {
+        "decoder_input_ids": {0: "batch", 1: "decoder_sequence"},
+        "encoder_hidden_states": {0: "batch", 1: "encoder_sequence"},
+        "encoder_attention_mask": {0: "batch", 1: "encoder_sequence"},
+        "logits": {0: "batch", 1: "decoder_sequence"}
+    }
+
+    # 示例输入使用 batch=2、多 token，避免长度为 1 的维度在导出时被固化
+    sample = tokenizer(
+        ["上下文：周三 在家 ｜ 需求：写周报2小时，健身1小时", "上下文：周五 公司 ｜ 需求：学习编程3小时"],
+        padding=True,
+        return_tensors="pt"
+    )
+    input_ids, attention_mask = sample["input_ids"], sample["attention_mask"]
+    decoder_start = torch.full((2, 1), model.config.decoder_start_token_id, dtype=torch.long)
+    decoder_prefix = torch.full((2, 3), model.config.decoder_start_token_id, dtype=torch.long)
+
+    with torch.no_grad():
+        encoder = EncoderGraph(model)
+        print("导出编码器...")
+        torch.onnx.export(
+            encoder,
+            (input_ids, attention_mask),
+            os.path.join(output_dir, ENCODER_FILE),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["encoder_hidden_states"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "encoder_sequence"},
+                "attention_mask": {0: "batch", 1: "encoder_sequence"},
+                "encoder_hidden_states": {0: "batch", 1: "encoder_sequence"}
+            },
+            opset_version=opset_version
+        )
+        encoder_hidden_states = encoder(input_ids, attention_mask)
+
+        decoder_init = DecoderGraph(model, with_past=False)
+        print("导出解码器首步...")
+        torch.onnx.export(
+            decoder_init,
+            (decoder_start, encoder_hidden_states, attention_mask),
+            os.path.join(output_dir, DECODER_INIT_FILE),
+            input_names=input_names,
+            output_names=["logits"] + past_names(num_layers, "present"),
+            dynamic_axes={**decoder_axes, **_past_dynamic_axes(past_names(num_layers, "present"), "decoder_sequence")},
+            opset_version=opset_version
+        )
+
+        past = decoder_init(decoder_prefix, encoder_hidden_states, attention_mask)[1:]
+        decoder_step = DecoderGraph(model, with_past=True)
+        print("导出解码器增量步...")
+        torch.onnx.export(
+            decoder_step,
+            (decoder_start, encoder_hidden_states, attention_mask) + tuple(past),
+            os.path.join(output_dir, DECODER_STEP_FILE),
+            input_names=input_names + past_names(num_layers),
+            output_names=["logits"] + past_names(num_layers, "present"),
+            dynamic_axes={
+                **decoder_axes,
+                **_past_dynamic_axes(past_names(num_layers), "past_sequence"),
+                **_past_dynamic_axes(past_names(num_layers, "present"), "total_sequence")
+            },
+            opset_version=opset_version
+        )
+
+    tokenizer.backend_tokenizer.save(os.path.join(output_dir, TOKENIZER_FILE))
+    export_config = {
+        "checkpoint": checkpoint_path,
+        "num_layers": num_layers,
+        "decoder_start_token_id": model.config.decoder_start_token_id,
+        "eos_token_id": model.config.eos_token_id,
+        "pad_token_id": model.config.pad_token_id,
+        "max_length": Config.MAX_LENGTH,
+        "opset_version": opset_version
+    }
+    with open(os.path.join(output_dir, EXPORT_CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump(export_config, f, ensure_ascii=False, indent=2)
+
+    print(f"模型已导出到: {output_dir}")
+
+def verify_parity(eager_model: ScheduleT5Model, onnx_model: ScheduleOnnxModel,
+                  input_texts: List[str], num_beams: int = 1) -> Dict[str, Any]:
+    """逐条比较 eager 模型与 ONNX 运行时的生成文本、解析结果和延迟"""
+    text_matches = 0
+    task_matches = 0
+    eager_latencies = []
+    onnx_latencies = []
+
+    for input_text in input_texts:
+        start = time.perf_counter()
+        eager_output = eager_model.generate(input_text, num_beams=num_beams)
+        eager_latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        onnx_output = onnx_model.generate(input_text, num_beams=num_beams)
+        onnx_latencies.append(time.perf_counter() - start)
+
+        text_matches += int(eager_output.split() == onnx_output.split())
+        if eager_model.parse_output(eager_output) == onnx_model.parse_output(onnx_output):
+            task_matches += 1
+        else:
+            print(f"不一致: {input_text}\n  eager: {eager_output}\n  onnx:  {onnx_output}")
+
+    total = len(input_texts)
+    return {
+        "num_samples": total,
+        "num_beams": num_beams,
+        "text_match": text_matches / total if total else 0.0,
+        "task_match": task_matches / total if total else 0.0,
+        "eager_latency": latency_summary(eager_latencies),
+        "onnx_latency": latency_summary(onnx_latencies)
+    }
+
+def main():
+    """命令行入口：export 导出模型，verify 校验一致性"""
+    parser = argparse.ArgumentParser(description="导出 ONNX 推理计算图并校验一致性")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="导出检查点为 ONNX")
+    export_parser.add_argument("--checkpoint", default=f"{Config.OUTPUT_DIR}/best_model", help="训练好的检查点目录")
+    export_parser.add_argument("--output", default=f"{Config.OUTPUT_DIR}/onnx", help="导出目录")
+    export_parser.add_argument("--opset", type=int, default=14, help="ONNX opset 版本")
+
+    verify_parser = subparsers.add_parser("verify", help="校验 ONNX 运行时与 eager 模型输出一致")
+    verify_parser.add_argument("--checkpoint", default=f"{Config.OUTPUT_DIR}/best_model", help="训练好的检查点目录")
+    verify_parser.add_argument("--export-dir", default=f"{Config.OUTPUT_DIR}/onnx", help="导出目录")
+    verify_parser.add_argument("--val-path", default=Config.VAL_DATA_PATH, help="验证数据路径")
+    verify_parser.add_argument("--limit", type=int, default=50, help="校验的样本数")
+    verify_parser.add_argument("--num-beams", type=int, nargs="+", default=[1, Config.NUM_BEAMS], help="校验的束宽")
+
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_model(args.checkpoint, args.output, args.opset)
+        return
+
+    samples = load_dataset(args.val_path)[:args.limit]
+    input_texts = [sample["input_text"] for sample in samples]
+
+    eager_model = ScheduleT5Model(args.checkpoint)
+    eager_model.model.eval()
+    onnx_model = ScheduleOnnxModel(args.export_dir)
+
+    for num_beams in args.num_beams:
+        result = verify_parity(eager_model, onnx_model, input_texts, num_beams)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+异步推理服务 - 将并发的T5解析请求合并为批量生成，规则解析与调度在线程池中执行
+"""
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple
+from config import Config
+from main import PersonalScheduleGenerator
+from data_generator import DataGenerator
+from metrics import latency_summary
+
+class MicroBatcher:
+    """微批处理器：收集并发请求，凑满 max_batch_size 条或等待 max_wait_ms 后做一次批量生成，再把结果分发给各调用方"""
+
+    def __init__(self, model, max_batch_size: int = Config.SERVER_MAX_BATCH_SIZE,
+                 max_wait_ms: float = Config.SERVER_MAX_WAIT_MS):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        # 模型前向在单独的线程中串行执行，不阻塞事件循环
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue: Optional[asyncio.Queue] = None
+        self.worker: Optional[asyncio.Task] = None
+        self.batch_sizes: List[int] = []
+        # 正在生成的批次（停止时需要让这些请求失败），以及是否已停止
+        self._in_flight: List[Tuple[str, asyncio.Future]] = []
+        self.stopped = False
+
+    async def start(self):
+        """启动批处理循环（需在事件循环中调用）"""
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """停止批处理循环：正在生成与仍在排队的请求以 RuntimeError 失败，之后提交的请求直接被拒绝"""
+        self.stopped = True
+        if self.worker:
+            self.worker.cancel()
+            try:
+                await self.worker
+            except asyncio.CancelledError:
+                pass
+
+        error = RuntimeError("微批处理器已停止")
+        pending = list(self._in_flight)
+        self._in_flight = []
+        while self.queue is not None and not self.queue.empty():
+            pending.append(self.queue.get_nowait())
+        for _, future in pending:
+            if not future.done():
+                future.set_exception(error)
+        # 等待正在执行的生成结束时不阻塞事件循环
+        await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+
+    async def parse(self, input_text: str) -> List[Dict[str, Any]]:
+        """提交一条解析请求，等待所在批次完成后返回任务列表"""
+        if self.stopped or self.queue is None:
+            raise RuntimeError("微批处理器未启动或已停止")
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((input_text, future))
+        return await future
+
+    async def _collect_batch(self) -> List[Tuple[str, asyncio.Future]]:
+        """阻塞等待第一条请求，随后在等待窗口内尽量凑满一批。
+
+        已从队列取出的请求随即记入 _in_flight，等待窗口内被 stop 取消时也能让它们失败。
+        """
+        loop = asyncio.get_running_loop()
+        batch = self._in_flight = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            # 在剩余的等待窗口内挂起等待下一条请求，不轮询
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        """批处理循环"""
+        loop = asyncio.get_running_loop()
+        while True:
+            # 取消（stop）时保留 _in_flight（收集中与生成中的批次），由 stop 让这些请求失败
+            batch = await self._collect_batch()
+            input_texts = [input_text for input_text, _ in batch]
+            self.batch_sizes.append(len(batch))
+
+            try:
+                results = await loop.run_in_executor(self.executor, self.model.predict_tasks_batch, input_texts)
+            except Exception as e:
+                self._in_flight = []
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self._in_flight = []
+
+            for (_, future), tasks in zip(batch, results):
+                if not future.done():
+                    future.set_result(tasks)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """批次统计"""
+        num_batches = len(self.batch_sizes)
+        return {
+            "num_batches": num_batches,
+            "num_requests": sum(self.batch_sizes),
+            "avg_batch_size": sum(self.batch_sizes) / num_batches if num_batches else 0.0,
+            "max_batch_size": max(self.batch_sizes, default=0)
+        }
+
+class AsyncScheduleServer:
+    """PersonalScheduleGenerator 的异步前端：T5 解析走微批处理，规则解析回退与调度在线程池中执行"""
+
+    def __init__(self, generator: PersonalScheduleGenerator,
+                 max_batch_size: int = Config.SERVER_MAX_BATCH_SIZE,
+                 max_wait_ms: float = Config.SERVER_MAX_WAIT_MS,
+                 num_threads: int = Config.SERVER_NUM_THREADS):
+        self.generator = generator
+        self.batcher = MicroBatcher(generator.model, max_batch_size, max_wait_ms)
+        self.executor = ThreadPoolExecutor(max_workers=num_threads)
+
+    async def start(self):
+        """启动服务"""
+        await self.batcher.start()
+
+    async def stop(self):
+        """停止服务"""
+        await self.batcher.stop()
+        await asyncio.get_running_loop().run_in_executor(None, self.executor.shutdown)
+
+    async def generate_schedule(self, input_text: str) -> Dict[str, Any]:
+        """生成日程，返回结构与 PersonalScheduleGenerator.generate_schedule 相同"""
+        loop = asyncio.get_running_loop()
+
+        tasks = await self.batcher.parse(input_text)
+        # 如果模型未能解析出任务，则使用规则解析作为回退
+        if not tasks:
+            tasks = await loop.run_in_executor(
+                self.executor, self.generator.fallback_parser.parse_tasks, input_text
+            )
+
+        return await loop.run_in_executor(
+            self.executor, self.generator.schedule_parsed_tasks, input_text, tasks
+        )
+
+async def run_load_test(server: AsyncScheduleServer, input_texts: List[str]) -> Dict[str, Any]:
+    """并发发送全部请求，统计吞吐与延迟"""
+    latencies = []
+
+    async def timed_request(input_text: str):
+        start = time.perf_counter()
+        await server.generate_schedule(input_text)
+        latencies.append(time.perf_counter() - start)
+
+    await server.start()
+    start = time.perf_counter()
+    await asyncio.gather(*(timed_request(input_text) for input_text in input_texts))
+    elapsed = time.perf_counter() - start
+    await server.stop()
+
+    result = {
+        "num_requests": len(input_texts),
+        "elapsed_seconds": elapsed,
+        "requests_per_second": len(input_texts) / elapsed if elapsed else 0.0
+    }
+    result.update(latency_summary(latencies))
+    result.update(server.batcher.get_stats())
+    return result
+
+def main():
+    """压测：对比不同批大小下的吞吐"""
+    parser = argparse.ArgumentParser(description="微批处理异步推理服务压测")
+    parser.add_argument("--model-path", default=None, help="训练好的检查点目录")
+    parser.add_argument("--requests", type=int, default=64, help="并发请求数")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, Config.SERVER_MAX_BATCH_SIZE],
+                        help="对比的最大批大小")
+    parser.add_argument("--max-wait-ms", type=float, default=Config.SERVER_MAX_WAIT_MS, help="攒批等待时间（毫秒）")
+    args = parser.parse_args()
+
+    generator = PersonalScheduleGenerator(args.model_path)
+    input_texts = [sample["input_text"] for sample in DataGenerator().generate_dataset(args.requests)]
+
+    print(f"\n{'批大小':<8} {'请求/秒':>10} {'平均批':>8} {'p50(ms)':>10} {'p99(ms)':>10}")
+    print("-" * 52)
+    for max_batch_size in args.batch_sizes:
+        server = AsyncScheduleServer(generator, max_batch_size, args.max_wait_ms)
+        result = asyncio.run(run_load_test(server, input_texts))
+        print(f"{max_batch_size:<8} {result['requests_per_second']:>10.2f} {result['avg_batch_size']:>8.2f} "
+              f"{result['p50_ms']:>10.1f} {result['p99_ms']:>10.1f}")
+
+if __name__ == "__main__":
+    main()
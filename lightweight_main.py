@@ -2,37 +2,165 @@
 轻量级个人日程生成系统 - 使用规则解析替代T5模型
 """
 
+import json
+import multiprocessing
 import re
-from typing import List, Dict, Any
+import threading
+from collections import OrderedDict, deque
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Union
 from config import Config
 from scheduler import ScheduleRuleEngine
 
-class RuleBasedParser:
-    """基于规则的文本解析器"""
+class _CompiledMatcher:
+    """RuleBasedParser 的合并匹配器：一个预编译正则 + 关键词查找表。
     
-    def __init__(self):
-        self.time_patterns = {
-            r'(\d+)小时': lambda x: int(x) * 60,
-            r'(\d+)分钟': lambda x: int(x),
-            r'(\d+)h': lambda x: int(x) * 60,
-            r'(\d+)min': lambda x: int(x)
-        }
+    正则由两部分组成：时长 `(\\d+)(单位)` 直接消耗匹配文本；关键词放在零宽前瞻中，
+    每个起始位置报告最长的关键词，因此重叠的关键词（如“晚上午”中的“晚上”和“上午”）都能找到，
+    一次从左到右的扫描即可得到全部时长和关键词位置。
+    """
+    
+    def __init__(self, duration_units: Dict[str, int], time_preferences: Dict[str, List[str]],
+                 priority_keywords: Dict[int, List[str]]):
+        self.unit_rank = {unit: i for i, unit in enumerate(duration_units)}
         
-        self.time_preferences = {
-            '早晨': ['早晨', '早上', '早'],
-            '上午': ['上午'],
-            '下午': ['下午', '午后'],
-            '傍晚': ['傍晚', '黄昏'],
-            '晚上': ['晚上', '夜晚', '晚']
-        }
-       
+        # 移除顺序：先时间偏好词再优先级词，与原先依次 replace 的顺序一致
+        self.removal_order = {}
+        pref_of = {}
+        for pref, keywords in time_preferences.items():
+            for keyword in keywords:
+                self.removal_order.setdefault(keyword, len(self.removal_order))
+                pref_of.setdefault(keyword, pref)
+        priority_of = {}
+        for priority, keywords in priority_keywords.items():
+            for keyword in keywords:
+                self.removal_order.setdefault(keyword, len(self.removal_order))
+                priority_of.setdefault(keyword, priority)
         
-        self.priority_keywords = {
-            1: ['紧急', '重要', '必须', '关键'],
-            2: ['重要', '需要', '应该'],
-            3: ['一般', '普通', '可以'],
-            4: ['低', '不紧急', '可选']
+        keywords = sorted(self.removal_order, key=len, reverse=True)
+        # 同一位置上被最长关键词覆盖的较短关键词（如“晚上”覆盖“晚”）
+        self.prefixes = {
+            keyword: [other for other in keywords if other != keyword and keyword.startswith(other)]
+            for keyword in keywords
+        }
+        # 较短关键词先于最长关键词被移除时，不能直接按最长关键词移除
+        self.needs_replay = {
+            keyword for keyword, prefixes in self.prefixes.items()
+            if any(self.removal_order[prefix] < self.removal_order[keyword] for prefix in prefixes)
         }
+        
+        # 每个关键词（含其覆盖的较短关键词）对应的最靠前的时间偏好/优先级，以 (排序, 值) 表示
+        self.prefs = list(time_preferences)
+        self.priorities = list(priority_keywords)
+        self.pref_rank = {}
+        self.priority_rank = {}
+        for keyword in keywords:
+            covered = [keyword] + self.prefixes[keyword]
+            pref_ranks = [self.prefs.index(pref_of[k]) for k in covered if k in pref_of]
+            priority_ranks = [self.priorities.index(priority_of[k]) for k in covered if k in priority_of]
+            self.pref_rank[keyword] = min(pref_ranks, default=len(self.prefs))
+            self.priority_rank[keyword] = min(priority_ranks, default=len(self.priorities))
+        
+        units = '|'.join(re.escape(unit) for unit in sorted(duration_units, key=len, reverse=True))
+        alternatives = '|'.join(re.escape(keyword) for keyword in keywords)
+        self.pattern = re.compile(rf'(\d+)({units})|(?=({alternatives}))')
+
+class SegmentCache:
+    """任务片段解析结果的 LRU 缓存，线程安全。
+    
+    同样的片段（如“健身1小时”）在不同用户的输入中大量重复，命中时只需一次字典查找。
+    键为 (解析器类, 去除首尾空白的片段)，关键词表不同的子类不会互相命中。
+    """
+    
+    def __init__(self, max_size: int = Config.SEGMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        """查找缓存，命中时标记为最近使用"""
+        with self._lock:
+            task = self._entries.get(key)
+            if task is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return task
+    
+    def put(self, key: tuple, task: Dict[str, Any]):
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = task
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def clear(self):
+        """清空缓存与统计"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """缓存统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+# 进程级默认缓存，规则解析器实例（包括 PersonalScheduleGenerator 的回退解析器）默认共享
+segment_cache = SegmentCache()
+
+class RuleBasedParser:
+    """基于规则的文本解析器"""
+    
+    # 时长单位及换算为分钟的倍数，顺序即优先级
+    duration_units = {
+        '小时': 60,
+        '分钟': 1,
+        'h': 60,
+        'min': 1
+    }
+    
+    time_preferences = {
+        '早晨': ['早晨', '早上', '早'],
+        '上午': ['上午'],
+        '下午': ['下午', '午后'],
+        '傍晚': ['傍晚', '黄昏'],
+        '晚上': ['晚上', '夜晚', '晚']
+    }
+    
+    priority_keywords = {
+        1: ['紧急', '重要', '必须', '关键'],
+        2: ['重要', '需要', '应该'],
+        3: ['一般', '普通', '可以'],
+        4: ['低', '不紧急', '可选']
+    }
+    
+    def __init__(self, cache: Optional[SegmentCache] = segment_cache):
+        # 片段解析结果缓存，传入 None 则不缓存
+        self.cache = cache
+    
+    @classmethod
+    def _get_matcher(cls) -> _CompiledMatcher:
+        """每个类只构建一次合并匹配器（子类修改关键词表后得到自己的匹配器）"""
+        matcher = cls.__dict__.get('_matcher')
+        if matcher is None:
+            matcher = _CompiledMatcher(cls.duration_units, cls.time_preferences, cls.priority_keywords)
+            cls._matcher = matcher
+        return matcher
     
     def parse_tasks(self, input_text: str) -> List[Dict[str, Any]]:
         """解析输入文本为任务列表"""
@@ -42,7 +170,7 @@ class RuleBasedParser:
         task_descriptions = self._extract_task_descriptions(input_text)
         
         for desc in task_descriptions:
-            task = self._parse_single_task(desc)
+            task = self._parse_segment(desc)
             if task:
                 tasks.append(task)
         
@@ -58,75 +186,185 @@ class RuleBasedParser:
         
         return [text.strip()]
     
+    def _parse_segment(self, segment: str) -> Dict[str, Any]:
+        """解析单个任务片段，优先查缓存"""
+        if self.cache is None:
+            return self._parse_single_task(segment)
+        
+        key = (type(self), segment.strip())
+        task = self.cache.get(key)
+        if task is None:
+            task = self._parse_single_task(key[1])
+            self.cache.put(key, task)
+        # 返回副本，调用方修改结果不影响缓存
+        return dict(task)
+    
     def _parse_single_task(self, task_text: str) -> Dict[str, Any]:
-        """解析单个任务"""
-        # 提取任务名称
-        task_name = self._extract_task_name(task_text)
+        """解析单个任务：一次扫描同时得到任务名称、时长、时间偏好和优先级。
         
-        # 提取时长
-        duration = self._extract_duration(task_text)
+        - 时长：按单位优先级取各单位的第一个匹配，默认60分钟
+        - 时间偏好/优先级：出现过的关键词中排序最靠前的类别，默认“上午”/3
+        - 任务名称：移除全部时长和关键词后的文本
+        """
+        matcher = self._get_matcher()
+        unit_rank = matcher.unit_rank
         
-        # 提取时间偏好
-        pref_time = self._extract_time_preference(task_text)
+        duration_match = None
+        duration_rank = len(unit_rank)
+        pref_rank = len(matcher.prefs)
+        priority_rank = len(matcher.priorities)
+        # (关键词或None, 起点, 终点)，按起点递增
+        spans = []
+        last_end = 0
+        overlapping = False
         
-        # 提取优先级
-        priority = self._extract_priority(task_text)
+        for match in matcher.pattern.finditer(task_text):
+            start = match.start()
+            keyword = match.group(3)
+            if keyword is None:
+                end = match.end()
+                rank = unit_rank[match.group(2)]
+                if rank < duration_rank:
+                    duration_rank, duration_match = rank, match
+            else:
+                end = start + len(keyword)
+                pref_rank = min(pref_rank, matcher.pref_rank[keyword])
+                priority_rank = min(priority_rank, matcher.priority_rank[keyword])
+                if keyword in matcher.needs_replay:
+                    overlapping = True
+            
+            if start < last_end:
+                overlapping = True
+            last_end = max(last_end, end)
+            spans.append((keyword, start, end))
+        
+        if duration_match:
+            duration = int(duration_match.group(1)) * self.duration_units[duration_match.group(2)]
+        else:
+            # 默认时长
+            duration = 60
+        
+        if overlapping:
+            task_name = self._remove_overlapping_spans(task_text, spans)
+        else:
+            pieces = []
+            position = 0
+            for _, start, end in spans:
+                pieces.append(task_text[position:start])
+                position = end
+            pieces.append(task_text[position:])
+            task_name = ''.join(pieces)
         
         return {
-            "task": task_name,
+            "task": task_name.strip(),
             "duration": duration,
-            "pref_time": pref_time,
-            "priority": priority
+            "pref_time": matcher.prefs[pref_rank] if pref_rank < len(matcher.prefs) else "上午",
+            "priority": matcher.priorities[priority_rank] if priority_rank < len(matcher.priorities) else 3
         }
     
-    def _extract_task_name(self, text: str) -> str:
-        """提取任务名称"""
-        # 移除时长和时间信息
-        cleaned = text
-        for pattern in self.time_patterns.keys():
-            cleaned = re.sub(pattern, '', cleaned)
-        
-        # 移除时间偏好词
-        for prefs in self.time_preferences.values():
-            for pref in prefs:
-                cleaned = cleaned.replace(pref, '')
-        
-        # 移除优先级词
-        for keywords in self.priority_keywords.values():
-            for keyword in keywords:
-                cleaned = cleaned.replace(keyword, '')
+    def _remove_overlapping_spans(self, text: str, spans: List[tuple]) -> str:
+        """关键词互相重叠时，先移除时长，再按关键词的移除顺序逐个移除，跳过与已移除文本重叠的位置"""
+        matcher = self._get_matcher()
+        removed = bytearray(len(text))
+        occurrences = []
+        for keyword, start, end in spans:
+            if keyword is None:
+                removed[start:end] = b'\x01' * (end - start)
+                continue
+            occurrences.append((matcher.removal_order[keyword], start, keyword))
+            for prefix in matcher.prefixes[keyword]:
+                occurrences.append((matcher.removal_order[prefix], start, prefix))
         
-        return cleaned.strip()
-    
-    def _extract_duration(self, text: str) -> int:
-        """提取任务时长（分钟）"""
-        for pattern, converter in self.time_patterns.items():
-            match = re.search(pattern, text)
-            if match:
-                return converter(match.group(1))
-        
-        # 默认时长
-        return 60
-    
-    def _extract_time_preference(self, text: str) -> str:
-        """提取时间偏好"""
-        for pref, keywords in self.time_preferences.items():
-            for keyword in keywords:
-                if keyword in text:
-                    return pref
+        for _, start, keyword in sorted(occurrences):
+            end = start + len(keyword)
+            if not any(removed[start:end]):
+                removed[start:end] = b'\x01' * (end - start)
         
-        # 默认偏好
-        return "上午"
+        return ''.join(char for char, flag in zip(text, removed) if not flag)
     
-    def _extract_priority(self, text: str) -> int:
-        """提取优先级"""
-        for priority, keywords in self.priority_keywords.items():
-            for keyword in keywords:
-                if keyword in text:
-                    return priority
+    def parse_stream(self, lines: Iterable[Union[str, bytes]], input_format: str = "text",
+                     text_field: str = "input_text", workers: int = 1,
+                     chunk_size: int = 1000, serialize: bool = False) -> Iterator[Any]:
+        """流式批量解析：逐行惰性读取，按输入顺序逐条产出结果，内存占用与总行数无关。
+        
+        - input_format: "text" 每行即一条输入；"jsonl" 每行一个 JSON 对象，取 text_field 字段（也可以是 JSON 字符串）
+        - 成功的行产出 {"line", "input_text", "tasks"}，无法解析的行产出 {"line", "error"}，空行跳过
+        - workers > 1 时按块分发到进程池，同时在途的块数有上限，避免一次读入全部输入
+        - serialize=True 时产出 (是否坏行, JSON 行)，序列化在工作进程中完成，主进程只需写出
+        """
+        chunks = _iter_chunks(lines, chunk_size)
         
-        # 默认优先级
-        return 3
+        if workers <= 1:
+            for chunk in chunks:
+                yield from self._parse_chunk(chunk, input_format, text_field, serialize)
+            return
+        
+        with multiprocessing.Pool(workers, initializer=_init_stream_worker, initargs=(type(self),)) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(_parse_stream_chunk, (chunk, input_format, text_field, serialize)))
+                if len(pending) >= workers * 2:
+                    yield from pending.popleft().get()
+            while pending:
+                yield from pending.popleft().get()
+    
+    def _parse_chunk(self, chunk: List[tuple], input_format: str, text_field: str,
+                     serialize: bool = False) -> List[Any]:
+        """解析一块 (行号, 行) 数据"""
+        records = []
+        for line_number, line in chunk:
+            record = self._parse_line(line_number, line, input_format, text_field)
+            if record is None:
+                continue
+            if serialize:
+                record = ("error" in record, json.dumps(record, ensure_ascii=False))
+            records.append(record)
+        return records
+    
+    def _parse_line(self, line_number: int, line: Union[str, bytes], input_format: str,
+                    text_field: str) -> Optional[Dict[str, Any]]:
+        """解析一行输入，空行返回 None"""
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+            line = line.strip()
+            if not line:
+                return None
+            
+            if input_format == "jsonl":
+                item = json.loads(line)
+                input_text = item.get(text_field) if isinstance(item, dict) else item
+                if not isinstance(input_text, str):
+                    raise ValueError(f"缺少文本字段: {text_field}")
+            else:
+                input_text = line
+            
+            return {"line": line_number, "input_text": input_text, "tasks": self.parse_tasks(input_text)}
+        except (UnicodeDecodeError, ValueError) as e:
+            return {"line": line_number, "error": str(e)}
+
+# 流式解析工作进程中的解析器实例（由进程池初始化函数创建）
+_stream_parser = None
+
+def _init_stream_worker(parser_cls: type):
+    """进程池初始化：每个工作进程创建一个解析器"""
+    global _stream_parser
+    _stream_parser = parser_cls()
+
+def _parse_stream_chunk(chunk: List[tuple], input_format: str, text_field: str, serialize: bool) -> List[Any]:
+    """工作进程中解析一块 (行号, 行) 数据"""
+    return _stream_parser._parse_chunk(chunk, input_format, text_field, serialize)
+
+def _iter_chunks(lines: Iterable[Union[str, bytes]], chunk_size: int) -> Iterator[List[tuple]]:
+    """把行迭代器按 chunk_size 切块，附带从1开始的行号"""
+    chunk = []
+    for line_number, line in enumerate(lines, 1):
+        chunk.append((line_number, line))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 class LightweightScheduleGenerator:
     """轻量级日程生成器"""
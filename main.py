@@ -6,44 +6,70 @@ import json
 print("Imported json")
 import os
 print("Imported os")
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, Callable, Iterator, Optional
 print("Imported typing")
 from config import Config
 print("Imported config")
 from model import ScheduleT5Model
 print("Imported model")
+from model_registry import model_registry
+from task_format import GenerationTimeout
 from scheduler import ScheduleRuleEngine
 print("Imported scheduler")
 from data_generator import DataGenerator
 print("Imported data_generator")
-from lightweight_main import RuleBasedParser
+from lightweight_main import RuleBasedParser, segment_cache
 
 print("Imported modules")
 
 class PersonalScheduleGenerator:
     """个人日程生成系统"""
     
-    def __init__(self, model_path: str = None):
+    def __init__(self, model_path: str = None, deadline_ms: Optional[float] = None):
         self.config = Config()
+        # 单个请求的默认时限（毫秒），None 表示不限制
+        self.deadline_ms = deadline_ms if deadline_ms is not None else self.config.REQUEST_DEADLINE_MS
         
         # 初始化模型
-        if model_path and os.path.exists(model_path):
+        if self.config.USE_MODEL_REGISTRY and not self.config.QUANTIZE:
+            source = model_path if model_path and os.path.exists(model_path) else self.config.MODEL_NAME
+            print(f"从模型注册表加载: {source}")
+            self.model = model_registry.get(
+                source,
+                decoding_strategy=self.config.DECODING_STRATEGY,
+                num_beams=self.config.NUM_BEAMS
+            )
+        elif model_path and os.path.exists(model_path):
             print(f"加载已训练的模型: {model_path}")
-            self.model = ScheduleT5Model()
-            self.model.load_model(model_path)
+            self.model = ScheduleT5Model(
+                decoding_strategy=self.config.DECODING_STRATEGY,
+                num_beams=self.config.NUM_BEAMS
+            )
+            self.model.load_model(model_path, quantize=self.config.QUANTIZE)
         else:
             print("使用预训练模型")
-            self.model = ScheduleT5Model(self.config.MODEL_NAME)
+            self.model = ScheduleT5Model(
+                self.config.MODEL_NAME,
+                decoding_strategy=self.config.DECODING_STRATEGY,
+                num_beams=self.config.NUM_BEAMS,
+                quantize=self.config.QUANTIZE
+            )
         
         # 初始化规则引擎
         self.rule_engine = ScheduleRuleEngine(self.config)
         
         # 初始化数据生成器（用于生成示例数据）
         self.data_generator = DataGenerator()
-        # 基于规则的解析器（回退方案）
-        self.fallback_parser = RuleBasedParser()
+        # 基于规则的解析器（回退方案），与进程内其他规则解析器共享片段缓存
+        self.fallback_parser = RuleBasedParser(segment_cache)
+        # 规则解析结果同时作为推测解码的草稿
+        if self.config.SPECULATIVE_DRAFT and isinstance(self.model, ScheduleT5Model):
+            self.model.draft_parser = self.fallback_parser
     
-    def generate_schedule(self, input_text: str) -> Dict[str, Any]:
+    def generate_schedule(self, input_text: str,
+                          on_task_placed: Optional[Callable[[Dict[str, Any]], None]] = None,
+                          deadline_ms: Optional[float] = None) -> Dict[str, Any]:
         """生成个人日程。
 
         流程：
@@ -51,16 +77,48 @@ class PersonalScheduleGenerator:
         2) 使用规则引擎进行调度，产出包含已安排与未安排任务的 schedule 结构。
         3) 验证日程，输出 is_valid 与错误/警告信息。
         4) 汇总统计信息，统一返回结构化结果。
+
+        deadline_ms 为本次请求的时限（缺省使用构造时的设置）。模型解析阶段最多占用
+        MODEL_STAGE_SHARE 比例的时限，超出则中止生成并改用规则解析。
+        结果中的 pipeline 记录解析路径（model / fallback_empty / fallback_timeout）与各阶段耗时。
+
+        传入 on_task_placed 时走流式路径（见 generate_schedule_stream，时限相同），
+        每安排一个任务即回调一次，最终返回相同结构的结果。
         """
+        if on_task_placed is not None:
+            for event in self.generate_schedule_stream(input_text, deadline_ms):
+                if event["event"] == "task_placed":
+                    on_task_placed(event["task"])
+                else:
+                    return event["result"]
+        
+        if deadline_ms is None:
+            deadline_ms = self.deadline_ms
+        model_budget = deadline_ms * self.config.MODEL_STAGE_SHARE / 1000 if deadline_ms else None
+        stage_ms = {}
+        
         print(f"输入: {input_text}")
         
         # 1. 使用模型解析任务
         print("\n1. 解析任务...")
-        tasks = self.model.predict_tasks(input_text)
+        stage_start = time.perf_counter()
+        try:
+            tasks = self.model.predict_tasks(input_text, max_time=model_budget)
+            parse_path = "model"
+        except GenerationTimeout:
+            print(f"模型解析超出时限（{model_budget * 1000:.0f}ms），使用规则解析回退...")
+            tasks = []
+            parse_path = "fallback_timeout"
+        stage_ms["model"] = (time.perf_counter() - stage_start) * 1000
+        
         # 如果模型未能解析出任务，则使用规则解析作为回退，确保后续始终有 schedule 结构
         if not tasks:
-            print("模型未能解析任务，使用规则解析回退...")
+            if parse_path == "model":
+                print("模型未能解析任务，使用规则解析回退...")
+                parse_path = "fallback_empty"
+            stage_start = time.perf_counter()
             tasks = self.fallback_parser.parse_tasks(input_text)
+            stage_ms["fallback"] = (time.perf_counter() - stage_start) * 1000
         
         print("解析的任务:")
         for task in tasks:
@@ -68,22 +126,112 @@ class PersonalScheduleGenerator:
         
         # 2. 使用规则引擎安排日程
         print("\n2. 安排日程...")
+        stage_start = time.perf_counter()
         schedule_result = self.rule_engine.schedule_tasks(tasks)
+        stage_ms["schedule"] = (time.perf_counter() - stage_start) * 1000
         
         # 3. 验证日程
         print("\n3. 验证日程...")
+        stage_start = time.perf_counter()
         validation_result = self.rule_engine.validate_schedule(schedule_result)
+        stage_ms["validate"] = (time.perf_counter() - stage_start) * 1000
         
         # 4. 格式化输出
-        result = {
+        result = self._build_result(input_text, tasks, schedule_result, validation_result)
+        result["pipeline"] = {
+            "path": parse_path,
+            "deadline_ms": deadline_ms,
+            "stage_ms": stage_ms,
+            "total_ms": sum(stage_ms.values())
+        }
+        return result
+    
+    def generate_schedule_stream(self, input_text: str, deadline_ms: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """流式生成日程：模型贪心解码的同时增量解析，最高优先级任务一解析完成即安排。
+
+        依次产出 {"event": "task_placed", "task": ..., "elapsed_seconds": ...}，
+        最后产出 {"event": "done", "result": ..., "elapsed_seconds": ...}，
+        result 与 generate_schedule 的返回结构相同（含 pipeline）。
+
+        deadline_ms 的含义与 generate_schedule 相同。模型超时前已产出的任务可能已经安排，
+        因此超时后只补充规则解析出的、模型尚未给出的任务（按任务名去重）。
+        """
+        if deadline_ms is None:
+            deadline_ms = self.deadline_ms
+        model_budget = deadline_ms * self.config.MODEL_STAGE_SHARE / 1000 if deadline_ms else None
+        start = time.perf_counter()
+        parsed_tasks = []
+        stage_ms = {}
+        parse_path = "model"
+        
+        def task_stream():
+            nonlocal parse_path
+            try:
+                for task in self.model.stream_tasks(input_text, max_time=model_budget):
+                    parsed_tasks.append(task)
+                    yield task
+            except GenerationTimeout:
+                print(f"模型解析超出时限（{model_budget * 1000:.0f}ms），使用规则解析回退...")
+                parse_path = "fallback_timeout"
+            stage_ms["model"] = (time.perf_counter() - start) * 1000
+            
+            # 如果模型未能解析出任务（或超时），则使用规则解析作为回退
+            if parse_path == "model" and not parsed_tasks:
+                print("模型未能解析任务，使用规则解析回退...")
+                parse_path = "fallback_empty"
+            if parse_path != "model":
+                fallback_start = time.perf_counter()
+                model_task_names = {task["task"] for task in parsed_tasks}
+                fallback_tasks = [
+                    task for task in self.fallback_parser.parse_tasks(input_text)
+                    if task["task"] not in model_task_names
+                ]
+                stage_ms["fallback"] = (time.perf_counter() - fallback_start) * 1000
+                for task in fallback_tasks:
+                    parsed_tasks.append(task)
+                    yield task
+        
+        for event, payload in self.rule_engine.stream_schedule(task_stream()):
+            if event == "placed":
+                yield {"event": "task_placed", "task": payload, "elapsed_seconds": time.perf_counter() - start}
+            else:
+                schedule_result = payload
+        # 最高优先级任务与解析交替安排（耗时计入模型阶段），其余任务在解析结束后安排
+        stage_ms["schedule"] = (time.perf_counter() - start) * 1000 - sum(stage_ms.values())
+        
+        stage_start = time.perf_counter()
+        validation_result = self.rule_engine.validate_schedule(schedule_result)
+        stage_ms["validate"] = (time.perf_counter() - stage_start) * 1000
+        
+        result = self._build_result(input_text, parsed_tasks, schedule_result, validation_result)
+        result["pipeline"] = {
+            "path": parse_path,
+            "deadline_ms": deadline_ms,
+            "stage_ms": stage_ms,
+            "total_ms": sum(stage_ms.values())
+        }
+        yield {
+            "event": "done",
+            "result": result,
+            "elapsed_seconds": time.perf_counter() - start
+        }
+    
+    def schedule_parsed_tasks(self, input_text: str, tasks: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """对已解析的任务执行调度与验证并汇总结果（不含解析步骤，供异步服务在线程池中调用）"""
+        schedule_result = self.rule_engine.schedule_tasks(tasks)
+        validation_result = self.rule_engine.validate_schedule(schedule_result)
+        return self._build_result(input_text, tasks, schedule_result, validation_result)
+    
+    def _build_result(self, input_text: str, tasks: List[Dict[str, Any]],
+                      schedule_result: Dict[str, Any], validation_result: Dict[str, Any]) -> Dict[str, Any]:
+        """汇总为统一的结构化结果"""
+        return {
             "input": input_text,
             "parsed_tasks": tasks,
             "schedule": schedule_result,
             "validation": validation_result,
             "summary": self._generate_summary(schedule_result, validation_result)
         }
-        
-        return result
     
     def _generate_summary(self, schedule_result: Dict[str, Any], validation_result: Dict[str, Any]) -> Dict[str, Any]:
         """生成日程摘要"""
@@ -156,6 +304,10 @@ class PersonalScheduleGenerator:
         
         if summary["warnings"]:
             print(f"  - 警告: {', '.join(summary['warnings'])}")
+        
+        if "pipeline" in result:
+            pipeline = result["pipeline"]
+            print(f"  - 解析路径: {pipeline['path']}，耗时 {pipeline['total_ms']:.0f} 毫秒")
     
     def generate_example_data(self, num_samples: int = 5) -> List[Dict[str, Any]]:
         """生成示例数据"""
@@ -0,0 +1,73 @@
+"""
+评估指标 - 比较解析出的任务列表与标注任务列表
+"""
+
+from typing import List, Dict, Any
+
+def compute_task_metrics(predictions: List[List[Dict[str, Any]]],
+                         references: List[List[Dict[str, Any]]]) -> Dict[str, float]:
+    """计算任务级指标。
+
+    - exact_match: 整条样本的任务列表完全一致的比例
+    - task_precision / task_recall / task_f1: 按任务名匹配（同名任务按出现次数计）
+    - duration_accuracy / priority_accuracy / pref_time_accuracy: 在匹配上的任务中对应字段正确的比例
+    """
+    exact_match = 0
+    num_predicted = 0
+    num_reference = 0
+    num_matched = 0
+    duration_correct = 0
+    priority_correct = 0
+    pref_time_correct = 0
+
+    for predicted_tasks, reference_tasks in zip(predictions, references):
+        if predicted_tasks == reference_tasks:
+            exact_match += 1
+
+        num_predicted += len(predicted_tasks)
+        num_reference += len(reference_tasks)
+
+        # 按任务名贪心匹配，每个标注任务最多匹配一次
+        unmatched = list(reference_tasks)
+        for task in predicted_tasks:
+            for i, reference in enumerate(unmatched):
+                if reference["task"] == task["task"]:
+                    num_matched += 1
+                    duration_correct += int(reference["duration"] == task["duration"])
+                    priority_correct += int(reference["priority"] == task["priority"])
+                    pref_time_correct += int(reference["pref_time"] == task["pref_time"])
+                    del unmatched[i]
+                    break
+
+    precision = num_matched / num_predicted if num_predicted else 0.0
+    recall = num_matched / num_reference if num_reference else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+
+    return {
+        "num_samples": len(references),
+        "exact_match": exact_match / len(references) if references else 0.0,
+        "task_precision": precision,
+        "task_recall": recall,
+        "task_f1": f1,
+        "duration_accuracy": duration_correct / num_matched if num_matched else 0.0,
+        "priority_accuracy": priority_correct / num_matched if num_matched else 0.0,
+        "pref_time_accuracy": pref_time_correct / num_matched if num_matched else 0.0
+    }
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """延迟统计（毫秒）：均值与 p50/p95/p99"""
+    if not latencies:
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+
+    ordered = sorted(latencies)
+
+    def percentile(q: float) -> float:
+        index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+        return ordered[index] * 1000
+
+    return {
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99)
+    }
@@ -5,114 +5,91 @@ T5模型类 - 用于意图识别和任务解析
 import torch
 print("Imported torch")
 import torch.nn as nn
-from transformers import T5ForConditionalGeneration, T5Tokenizer
+import transformers
+from transformers import T5Config, T5ForConditionalGeneration, T5Tokenizer, T5TokenizerFast, TextIteratorStreamer
 print("Imported transformers")
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator
 print("Imported typing")
 import json
 print("Imported json")
+import os
+import time
+from threading import Thread
+from task_format import TaskOutputMixin, IncrementalOutputParser
+from config import Config
 
 print("model.py imported")
 
-class ScheduleT5Model:
-    def __init__(self, model_name: str = "t5-base"):
+# load_model 的 quantize 缺省值：沿用构造时的设置（显式传入 None 表示不量化）
+_USE_DEFAULT = object()
+
+def load_tokenizer(name_or_path: str, use_fast: Optional[bool] = None):
+    """加载分词器：use_fast 时使用 T5TokenizerFast（批量编码在 Rust 中并行完成），否则使用 T5Tokenizer。
+
+    use_fast 为 None 时在调用时读取 Config.USE_FAST_TOKENIZER，运行时修改该配置即可生效。
+    """
+    if use_fast is None:
+        use_fast = Config.USE_FAST_TOKENIZER
+    tokenizer_class = T5TokenizerFast if use_fast else T5Tokenizer
+    return tokenizer_class.from_pretrained(name_or_path)
+
+class ScheduleT5Model(TaskOutputMixin):
+    # 支持的量化方式及检查点中可能存在的权重文件（用于判断量化缓存是否过期）
+    QUANTIZE_MODES = ["int8"]
+    CHECKPOINT_FILES = ["pytorch_model.bin", "model.safetensors", "config.json"]
+    
+    # 特殊token
+    SPECIAL_TOKENS = [
+        "<task>", "</task>",
+        "<duration>", "</duration>",
+        "<time>", "</time>",
+        "<priority>", "</priority>"
+    ]
+
+    def __init__(self, model_name: str = "t5-base", decoding_strategy: str = "adaptive", num_beams: int = 4,
+                 quantize: Optional[str] = None):
         self.model_name = model_name
-        self.tokenizer = T5Tokenizer.from_pretrained(model_name)
+        self.decoding_strategy = decoding_strategy
+        self.num_beams = num_beams
+        self.quantize = quantize
+        # 各解码层级服务的请求数
+        self.decoding_stats = {"greedy": 0, "beam": 0}
+        # 推测解码的草稿来源（需提供 parse_tasks，如 RuleBasedParser），为 None 时不使用
+        self.draft_parser = None
+        self.draft_stats = {"forward_passes": 0, "generated_tokens": 0, "accepted_draft_tokens": 0}
+        self.tokenizer = load_tokenizer(model_name)
         self.model = T5ForConditionalGeneration.from_pretrained(model_name)
         
         # 添加特殊token
-        self.special_tokens = [
-            "<task>", "</task>",
-            "<duration>", "</duration>",
-            "<time>", "</time>",
-            "<priority>", "</priority>"
-        ]
+        self.special_tokens = list(self.SPECIAL_TOKENS)
         self.tokenizer.add_tokens(self.special_tokens)
         self.model.resize_token_embeddings(len(self.tokenizer))
         
-    def format_output(self, tasks: List[Dict[str, Any]]) -> str:
-        """将任务列表格式化为输出文本"""
-        output_parts = []
-        for task in tasks:
-            task_str = (
-                f"<task>{task['task']}</task> "
-                f"<duration>{task['duration']}</duration> "
-                f"<time>{task['pref_time']}</time> "
-                f"<priority>{task['priority']}</priority>"
-            )
-            output_parts.append(task_str)
-        return " | ".join(output_parts)
-    
-    def parse_output(self, output_text: str) -> List[Dict[str, Any]]:
-        """将模型生成的标注文本解析为任务列表，稳健处理缺失/异常字段。
-
-        规则：
-        - 使用 " | " 分隔多个任务块
-        - 任务名/时长为必填，缺失或非法则跳过该块
-        - 偏好时间缺失或为空默认 "上午"
-        - 优先级缺失或非数字默认 3
-        """
-        tasks = []
-        # 模型输出按分隔符拆分为多个任务块
-        task_blocks = output_text.split(" | ")
-        
-        for block in task_blocks:
-            try:
-                # 提取任务名称
-                task_start = block.find("<task>") + 6
-                task_end = block.find("</task>")
-                if task_start < 6 or task_end == -1:
-                    # 块不包含有效的任务标签，跳过
-                    continue
-                task_name = block[task_start:task_end].strip()
-                
-                # 提取时长
-                duration_start = block.find("<duration>") + 10
-                duration_end = block.find("</duration>")
-                if duration_start < 10 or duration_end == -1:
-                    # 缺失时长则跳过该块
-                    continue
-                duration_str = block[duration_start:duration_end].strip()
-                if duration_str == "":
-                    # 空时长不合法，跳过
-                    continue
-                duration = int(duration_str)
-                
-                # 提取偏好时间
-                time_start = block.find("<time>") + 6
-                time_end = block.find("</time>")
-                if time_start < 6 or time_end == -1:
-                    pref_time = "上午"
-                else:
-                    pref_time = block[time_start:time_end].strip() or "上午"
-                
-                # 提取优先级
-                priority_start = block.find("<priority>") + 10
-                priority_end = block.find("</priority>")
-                if priority_start < 10 or priority_end == -1:
-                    priority = 3
-                else:
-                    priority_str = block[priority_start:priority_end].strip()
-                    priority = int(priority_str) if priority_str.isdigit() else 3
-                
-                tasks.append({
-                    "task": task_name,
-                    "duration": duration,
-                    "pref_time": pref_time,
-                    "priority": priority
-                })
-            except (ValueError, IndexError) as e:
-                print(f"解析任务块时出错: {block}, 错误: {e}")
-                continue
-        
-        return tasks
+        if quantize:
+            self.model = self.quantize_model(self.model, quantize)
     
+    @classmethod
+    def from_prepared(cls, tokenizer: T5Tokenizer, model: T5ForConditionalGeneration,
+                      decoding_strategy: str = "adaptive", num_beams: int = 4) -> "ScheduleT5Model":
+        """由已包含特殊token的分词器和模型直接构造，跳过下载、add_tokens 与 resize_token_embeddings"""
+        instance = cls.__new__(cls)
+        instance.model_name = model.config.name_or_path
+        instance.decoding_strategy = decoding_strategy
+        instance.num_beams = num_beams
+        instance.quantize = None
+        instance.decoding_stats = {"greedy": 0, "beam": 0}
+        instance.draft_parser = None
+        instance.draft_stats = {"forward_passes": 0, "generated_tokens": 0, "accepted_draft_tokens": 0}
+        instance.special_tokens = list(cls.SPECIAL_TOKENS)
+        instance.tokenizer = tokenizer
+        instance.model = model
+        return instance
+        
     def encode_input(self, input_text: str) -> Dict[str, torch.Tensor]:
-        """编码输入文本"""
+        """编码单条输入文本（不做填充，编码器只处理实际长度的序列）"""
         return self.tokenizer(
             input_text,
             max_length=512,
-            padding="max_length",
             truncation=True,
             return_tensors="pt"
         )
@@ -127,73 +104,248 @@ class ScheduleT5Model:
             return_tensors="pt"
         )
     
-    def generate(self, input_text: str, max_length: int = 512) -> str:
-        """生成任务解析结果"""
+    def encode_batch(self, input_texts: List[str]) -> Dict[str, torch.Tensor]:
+        """批量编码输入文本，按批内最长序列动态填充"""
+        return self.tokenizer(
+            input_texts,
+            max_length=512,
+            padding="longest",
+            truncation=True,
+            return_tensors="pt"
+        )
+    
+    def _generation_kwargs(self, max_length: int, num_beams: Optional[int],
+                           max_time: Optional[float] = None) -> Dict[str, Any]:
+        """生成参数：束搜索时启用 early_stopping 与 no_repeat_ngram_size；max_time（秒）限制生成耗时"""
+        if num_beams is None:
+            num_beams = self.num_beams
+        
+        generation_kwargs = {"max_length": max_length, "num_beams": num_beams}
+        if num_beams > 1:
+            generation_kwargs.update(early_stopping=True, no_repeat_ngram_size=2)
+        if max_time is not None:
+            generation_kwargs["max_time"] = max_time
+        return generation_kwargs
+    
+    def generate(self, input_text: str, max_length: int = 512, num_beams: Optional[int] = None,
+                 max_time: Optional[float] = None) -> str:
+        """生成任务解析结果（num_beams=1 即贪心解码；设置了 draft_parser 时贪心解码走推测解码）"""
+        generation_kwargs = self._generation_kwargs(max_length, num_beams, max_time)
+        if self.draft_parser is not None and generation_kwargs["num_beams"] == 1:
+            draft_text = self.format_output(self.draft_parser.parse_tasks(input_text))
+            return self.generate_with_draft(input_text, draft_text, max_length, max_time=max_time)
+        
         inputs = self.encode_input(input_text)
         with torch.no_grad():
-            outputs = self.model.generate(
-                **inputs,
-                max_length=max_length,
-                num_beams=4,
-                early_stopping=True,
-                no_repeat_ngram_size=2
-            )
+            outputs = self.model.generate(**inputs, **generation_kwargs)
         
         return self.tokenizer.decode(outputs[0], skip_special_tokens=True)
     
-    def predict_tasks(self, input_text: str) -> List[Dict[str, Any]]:
-        """预测任务列表"""
-        output_text = self.generate(input_text)
-        return self.parse_output(output_text)
-    
-    def save_model(self, save_path: str):
-        """保存模型"""
-        self.model.save_pretrained(save_path)
-        self.tokenizer.save_pretrained(save_path)
+    def generate_batch(self, input_texts: List[str], max_length: int = 512,
+                       num_beams: Optional[int] = None) -> List[str]:
+        """批量生成任务解析结果，一次前向处理整批输入"""
+        inputs = self.encode_batch(input_texts)
+        with torch.no_grad():
+            outputs = self.model.generate(**inputs, **self._generation_kwargs(max_length, num_beams))
+        
+        return self.tokenizer.batch_decode(outputs, skip_special_tokens=True)
     
-    def load_model(self, load_path: str):
-        """加载模型"""
-        self.model = T5ForConditionalGeneration.from_pretrained(load_path)
-        self.tokenizer = T5Tokenizer.from_pretrained(load_path)
+    def generate_with_draft(self, input_text: str, draft_text: str, max_length: int = 512,
+                            max_draft_tokens: int = 64, max_time: Optional[float] = None) -> str:
+        """以草稿文本为候选续写的贪心解码（推测解码）。
 
-class ScheduleDataset(torch.utils.data.Dataset):
-    """自定义数据集类"""
-    
-    def __init__(self, data: List[Dict[str, Any]], tokenizer, max_length: int = 512):
-        self.data = data
-        self.tokenizer = tokenizer
-        self.max_length = max_length
+        每次前向把在草稿中查到的候选 token 一并送入解码器并行验证，接受与模型贪心预测一致的
+        最长前缀，在第一个不一致处改用模型自己的 token，再按最近生成的 token 在草稿中重新对齐。
+        草稿正确时整段输出只需少量前向；结果与普通贪心解码一致。
+        """
+        inputs = self.encode_batch([input_text])
+        eos_token_id = self.model.config.eos_token_id
+        draft_ids = self.tokenizer(draft_text, add_special_tokens=False)["input_ids"] + [eos_token_id]
         
-    def __len__(self):
-        return len(self.data)
+        generated = [self.model.config.decoder_start_token_id]
+        draft_position = 0
+        past_key_values = None
+        deadline = time.perf_counter() + max_time if max_time is not None else None
+        
+        with torch.no_grad():
+            encoder_outputs = self.model.get_encoder()(**inputs)
+            while len(generated) < max_length and generated[-1] != eos_token_id:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                candidate_start = self._lookup_draft(generated, draft_ids, draft_position)
+                candidates = draft_ids[candidate_start:candidate_start + max_draft_tokens]
+                candidates = candidates[:max_length - len(generated) - 1]
+                
+                # 首次前向输入完整前缀，之后只输入缓存之外的最新 token 与候选
+                fed_tokens = generated if past_key_values is None else generated[-1:]
+                outputs = self.model(
+                    encoder_outputs=encoder_outputs,
+                    attention_mask=inputs["attention_mask"],
+                    decoder_input_ids=torch.tensor([fed_tokens + candidates]),
+                    past_key_values=past_key_values,
+                    use_cache=True
+                )
+                predictions = outputs.logits[0, -(len(candidates) + 1):].argmax(-1).tolist()
+                
+                accepted = 0
+                while accepted < len(candidates) and predictions[accepted] == candidates[accepted]:
+                    accepted += 1
+                new_tokens = candidates[:accepted] + [predictions[accepted]]
+                if eos_token_id in new_tokens:
+                    new_tokens = new_tokens[:new_tokens.index(eos_token_id) + 1]
+                generated.extend(new_tokens)
+                draft_position = candidate_start + accepted
+                
+                # 缓存保留到已确认的 token（最新生成的 token 下一步再输入）
+                past_key_values = self._crop_cache(outputs.past_key_values, len(generated) - 1)
+                
+                self.draft_stats["forward_passes"] += 1
+                self.draft_stats["accepted_draft_tokens"] += accepted
+        
+        self.draft_stats["generated_tokens"] += len(generated) - 1
+        
+        return self.tokenizer.decode(generated, skip_special_tokens=True)
     
-    def __getitem__(self, idx):
-        item = self.data[idx]
+    def _lookup_draft(self, generated: List[int], draft_ids: List[int], draft_position: int,
+                      max_ngram: int = 3) -> int:
+        """在草稿中查找与已生成序列末尾 n-gram 匹配的位置，返回候选续写的起始下标。
+
+        优先从上次对齐的位置向后查找，n-gram 由长到短；找不到时返回 len(draft_ids)（无候选）。
+        """
+        if len(generated) == 1:
+            return 0
         
-        # 编码输入
-        input_encoding = self.tokenizer(
-            item["input_text"],
-            max_length=self.max_length,
-            padding="max_length",
-            truncation=True,
-            return_tensors="pt"
+        for ngram_size in range(min(max_ngram, len(generated) - 1), 0, -1):
+            suffix = generated[-ngram_size:]
+            search_starts = list(range(max(draft_position - ngram_size, 0), len(draft_ids) - ngram_size))
+            search_starts += list(range(0, max(draft_position - ngram_size, 0)))
+            for start in search_starts:
+                if draft_ids[start:start + ngram_size] == suffix:
+                    return start + ngram_size
+        
+        return len(draft_ids)
+    
+    def _crop_cache(self, past_key_values, length: int):
+        """将解码器自注意力缓存截断到 length 个位置（交叉注意力缓存不变）"""
+        if hasattr(past_key_values, "crop"):
+            past_key_values.crop(length)
+            return past_key_values
+        return tuple(
+            (layer[0][:, :, :length], layer[1][:, :, :length]) + tuple(layer[2:])
+            for layer in past_key_values
         )
+    
+    def get_draft_stats(self) -> Dict[str, Any]:
+        """推测解码统计：每次前向平均确认的 token 数与草稿接受率"""
+        stats = dict(self.draft_stats)
+        passes = stats["forward_passes"]
+        generated = stats["generated_tokens"]
+        stats["tokens_per_pass"] = generated / passes if passes else 0.0
+        stats["draft_acceptance"] = stats["accepted_draft_tokens"] / generated if generated else 0.0
+        return stats
+    
+    def stream_tasks(self, input_text: str, max_length: int = 512,
+                     max_time: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """流式预测任务：后台线程贪心生成，边生成边增量解析，每完成一个任务块立即产出。
+
+        max_time（秒）限制生成耗时；超时时已产出的任务均来自完整的任务块，
+        末尾可能被截断的部分不再解析，改为抛出 GenerationTimeout。
+        """
+        deadline = time.perf_counter() + max_time if max_time is not None else None
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        inputs = self.encode_input(input_text)
+        errors = []
+        thread = Thread(
+            target=self._generate_to_streamer,
+            args=(inputs, streamer, max_length, max_time, errors),
+            daemon=True
+        )
+        thread.start()
         
-        # 格式化输出
-        model = ScheduleT5Model()
-        output_text = model.format_output(item["output_tasks"])
+        parser = IncrementalOutputParser(self.parse_output)
+        for text in streamer:
+            for task in parser.feed(text):
+                yield task
+        thread.join()
+        # 生成线程中的异常（如显存不足、输入无效）在调用方重新抛出
+        if errors:
+            raise errors[0]
+        self._check_deadline(deadline)
         
-        # 编码输出
-        target_encoding = self.tokenizer(
-            output_text,
-            max_length=self.max_length,
-            padding="max_length",
-            truncation=True,
-            return_tensors="pt"
-        )
+        for task in parser.flush():
+            yield task
+    
+    def _generate_to_streamer(self, inputs: Dict[str, torch.Tensor], streamer: TextIteratorStreamer, max_length: int,
+                              max_time: Optional[float], errors: List[BaseException]):
+        """在后台线程中执行贪心生成（no_grad 是线程局部的，需在线程内设置）。
+
+        生成出错时记录异常并结束 streamer，否则消费端会一直阻塞在 streamer 上。
+        """
+        try:
+            with torch.no_grad():
+                self.model.generate(**inputs, **self._generation_kwargs(max_length, 1, max_time), streamer=streamer)
+        except BaseException as e:
+            errors.append(e)
+            streamer.end()
+    
+    def save_model(self, save_path: str):
+        """保存模型"""
+        self.model.save_pretrained(save_path)
+        self.tokenizer.save_pretrained(save_path)
+    
+    def load_model(self, load_path: str, quantize: Optional[str] = _USE_DEFAULT):
+        """加载模型。
+
+        quantize 缺省时沿用构造时的设置，显式传入 None 时加载 fp32 模型。量化模式下优先读取检查点目录中缓存的
+        量化权重，缓存不存在、早于检查点或由其他版本的 torch / transformers 写出时重新量化并写回缓存，避免每次启动重复量化。
+        """
+        if quantize is _USE_DEFAULT:
+            quantize = self.quantize
+        self.tokenizer = load_tokenizer(load_path)
+        
+        if not quantize:
+            self.model = T5ForConditionalGeneration.from_pretrained(load_path)
+            self.quantize = None
+            return
         
-        return {
-            "input_ids": input_encoding["input_ids"].squeeze(),
-            "attention_mask": input_encoding["attention_mask"].squeeze(),
-            "labels": target_encoding["input_ids"].squeeze()
-        }
+        cache_path = self.quantized_cache_path(load_path, quantize)
+        cache = self._load_quantized_cache(cache_path, load_path)
+        if cache is not None:
+            # 按检查点配置构造同结构的模型并同样量化，再载入缓存的量化权重（不反序列化任意对象）
+            model = self.quantize_model(T5ForConditionalGeneration(T5Config.from_pretrained(load_path)), quantize)
+            model.load_state_dict(cache["state_dict"])
+            self.model = model
+        else:
+            model = T5ForConditionalGeneration.from_pretrained(load_path)
+            self.model = self.quantize_model(model, quantize)
+            torch.save({"versions": self._cache_versions(), "state_dict": self.model.state_dict()}, cache_path)
+        self.quantize = quantize
+    
+    def quantize_model(self, model: nn.Module, quantize: str) -> nn.Module:
+        """对线性层做动态量化（仅用于 CPU 推理，量化后的模型不可再训练）"""
+        if quantize not in self.QUANTIZE_MODES:
+            raise ValueError(f"不支持的量化方式: {quantize}，可选: {self.QUANTIZE_MODES}")
+        model.eval()
+        return torch.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    
+    def quantized_cache_path(self, load_path: str, quantize: str) -> str:
+        """量化权重缓存路径（与检查点放在同一目录）"""
+        return os.path.join(load_path, f"model_{quantize}_state_dict.pt")
+    
+    def _cache_versions(self) -> Dict[str, str]:
+        """量化权重的打包格式取决于 torch 与 transformers 的版本"""
+        return {"torch": str(torch.__version__), "transformers": transformers.__version__}
+    
+    def _load_quantized_cache(self, cache_path: str, load_path: str) -> Optional[Dict[str, Any]]:
+        """读取量化权重缓存：不存在、早于检查点中的任何权重/配置文件或版本不一致时返回 None"""
+        if not os.path.exists(cache_path):
+            return None
+        cache_mtime = os.path.getmtime(cache_path)
+        for filename in self.CHECKPOINT_FILES:
+            checkpoint_file = os.path.join(load_path, filename)
+            if os.path.exists(checkpoint_file) and os.path.getmtime(checkpoint_file) > cache_mtime:
+                return None
+        cache = torch.load(cache_path, weights_only=True)
+        if cache.get("versions") != self._cache_versions():
+            return None
+        return cache
@@ -0,0 +1,155 @@
+"""
+模型注册表 - 进程内共享的T5权重与分词器，权重以内存映射方式从 safetensors 读取
+"""
+
+import json
+import os
+import shutil
+import struct
+import threading
+import torch
+from transformers import T5Config, T5ForConditionalGeneration, T5Tokenizer
+from typing import Dict, Tuple, List
+from config import Config
+from model import ScheduleT5Model, load_tokenizer
+
+# 预处理产物中的文件
+WEIGHTS_FILE = "model.safetensors"
+REGISTRY_META_FILE = "registry.json"
+
+# safetensors 数据类型到 torch 数据类型的映射
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool
+}
+
+def load_mmap_state_dict(weights_path: str) -> Dict[str, torch.Tensor]:
+    """将 safetensors 文件整体映射为一块只读语义的存储，各参数为其上的视图，不复制数据。
+
+    使用私有映射（MAP_PRIVATE）：未被写入的页面直接来自系统页缓存，
+    因此映射同一文件的多个进程共享同一份物理内存。
+    """
+    with open(weights_path, 'rb') as f:
+        header_size = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_size))
+    header.pop("__metadata__", None)
+
+    data_start = 8 + header_size
+    storage = torch.UntypedStorage.from_file(weights_path, shared=False, nbytes=os.path.getsize(weights_path))
+    buffer = torch.empty(0, dtype=torch.uint8).set_(storage)
+
+    state_dict = {}
+    for name, info in header.items():
+        start, end = info["data_offsets"]
+        state_dict[name] = (
+            buffer[data_start + start:data_start + end]
+            .view(SAFETENSORS_DTYPES[info["dtype"]])
+            .reshape(info["shape"])
+        )
+    return state_dict
+
+class ModelRegistry:
+    """模型注册表。
+
+    - prepare: 为模型源（hub 名称或本地检查点）生成预处理产物：已添加特殊token的分词器，
+      以及完成 resize_token_embeddings 的 safetensors 权重，之后启动无需重复这两步
+    - get: 每个模型源在进程内只加载一次，返回共享同一份权重和分词器的 ScheduleT5Model
+    - preload: 在 fork 工作进程之前调用，子进程直接复用父进程已映射的页面
+    """
+
+    def __init__(self, prepared_dir: str = Config.PREPARED_MODEL_DIR):
+        self.prepared_dir = prepared_dir
+        self._loaded: Dict[str, Tuple[T5Tokenizer, T5ForConditionalGeneration]] = {}
+        self._lock = threading.Lock()
+
+    def artifact_dir(self, source: str) -> str:
+        """预处理产物目录：本地检查点放在其目录下，hub 模型放在 prepared_dir 下"""
+        if os.path.isdir(source):
+            return os.path.join(source, "prepared")
+        return os.path.join(self.prepared_dir, source.replace("/", "__"))
+
+    def prepare(self, source: str) -> str:
+        """生成（或复用）预处理产物，返回其目录"""
+        artifact_dir = self.artifact_dir(source)
+        if self._is_prepared(artifact_dir, source):
+            return artifact_dir
+
+        print(f"预处理模型: {source}")
+        model = ScheduleT5Model(source)
+
+        # 先写入临时目录再重命名，避免多个进程同时启动时读到不完整的产物
+        tmp_dir = f"{artifact_dir}.tmp{os.getpid()}"
+        model.model.save_pretrained(tmp_dir, safe_serialization=True)
+        model.tokenizer.save_pretrained(tmp_dir)
+        with open(os.path.join(tmp_dir, REGISTRY_META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({"source": source, "vocab_size": len(model.tokenizer)}, f, ensure_ascii=False, indent=2)
+
+        if os.path.exists(artifact_dir):
+            shutil.rmtree(artifact_dir, ignore_errors=True)
+        try:
+            os.rename(tmp_dir, artifact_dir)
+        except OSError:
+            # 其他进程已先完成预处理
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        return artifact_dir
+
+    def _is_prepared(self, artifact_dir: str, source: str) -> bool:
+        """产物完整，且（本地检查点时）不早于检查点文件"""
+        meta_path = os.path.join(artifact_dir, REGISTRY_META_FILE)
+        if not os.path.exists(meta_path) or not os.path.exists(os.path.join(artifact_dir, WEIGHTS_FILE)):
+            return False
+        if not os.path.isdir(source):
+            return True
+
+        prepared_mtime = os.path.getmtime(meta_path)
+        for filename in ScheduleT5Model.CHECKPOINT_FILES:
+            checkpoint_file = os.path.join(source, filename)
+            if os.path.exists(checkpoint_file) and os.path.getmtime(checkpoint_file) > prepared_mtime:
+                return False
+        return True
+
+    def _load(self, artifact_dir: str) -> Tuple[T5Tokenizer, T5ForConditionalGeneration]:
+        """从预处理产物加载分词器与内存映射的模型"""
+        tokenizer = load_tokenizer(artifact_dir)
+        config = T5Config.from_pretrained(artifact_dir)
+
+        # 在 meta 设备上构建模型结构，不分配权重内存，再直接挂载映射出的张量
+        with torch.device("meta"):
+            model = T5ForConditionalGeneration(config)
+        model.load_state_dict(load_mmap_state_dict(os.path.join(artifact_dir, WEIGHTS_FILE)), strict=False, assign=True)
+        # safetensors 只保存一份共享词嵌入，需重新绑定
+        model.tie_weights()
+
+        missing = [name for name, param in model.named_parameters() if param.is_meta]
+        if missing:
+            raise RuntimeError(f"预处理产物缺少权重: {missing}")
+
+        model.requires_grad_(False)
+        model.eval()
+        return tokenizer, model
+
+    def get(self, source: str, decoding_strategy: str = "adaptive", num_beams: int = 4) -> ScheduleT5Model:
+        """获取模型：同一模型源在进程内只加载一次"""
+        with self._lock:
+            if source not in self._loaded:
+                self._loaded[source] = self._load(self.prepare(source))
+            tokenizer, model = self._loaded[source]
+
+        return ScheduleT5Model.from_prepared(tokenizer, model, decoding_strategy, num_beams)
+
+    def preload(self, sources: List[str]):
+        """预加载模型（在 fork 工作进程之前调用）"""
+        for source in sources:
+            self.get(source)
+
+# 进程级默认注册表
+model_registry = ModelRegistry()
@@ -0,0 +1,201 @@
+"""
+ONNX 推理运行时 - 精简的T5任务解析器，仅依赖 onnxruntime、tokenizers 与 numpy
+"""
+
+import json
+import os
+import time
+import numpy as np
+import onnxruntime as ort
+from tokenizers import Tokenizer
+from typing import List, Dict, Optional
+from task_format import TaskOutputMixin
+
+# 导出目录中的文件
+ENCODER_FILE = "encoder.onnx"
+DECODER_INIT_FILE = "decoder_init.onnx"
+DECODER_STEP_FILE = "decoder_step.onnx"
+TOKENIZER_FILE = "tokenizer.json"
+EXPORT_CONFIG_FILE = "export_config.json"
+
+# 每层解码器缓存的张量：自注意力 key/value 与交叉注意力 key/value
+PAST_KINDS = ["self_key", "self_value", "cross_key", "cross_value"]
+
+def past_names(num_layers: int, prefix: str = "past") -> List[str]:
+    """展平后的缓存张量名称，顺序与 transformers 的 past_key_values 一致"""
+    return [f"{prefix}_{layer}_{kind}" for layer in range(num_layers) for kind in PAST_KINDS]
+
+class ScheduleOnnxModel(TaskOutputMixin):
+    """与 ScheduleT5Model 接口一致（generate / predict_tasks）的 ONNX 推理模型。
+
+    编码器运行一次，解码器首步计算交叉注意力缓存，后续每步只输入新 token 并复用缓存，
+    支持贪心解码与束搜索（束搜索参数与 ScheduleT5Model.generate 一致）。
+    """
+
+    def __init__(self, export_dir: str, decoding_strategy: str = "adaptive", num_beams: int = 4,
+                 num_threads: Optional[int] = None):
+        self.export_dir = export_dir
+        self.decoding_strategy = decoding_strategy
+        self.num_beams = num_beams
+        # 各解码层级服务的请求数
+        self.decoding_stats = {"greedy": 0, "beam": 0}
+
+        with open(os.path.join(export_dir, EXPORT_CONFIG_FILE), 'r', encoding='utf-8') as f:
+            self.export_config = json.load(f)
+        self.decoder_start_token_id = self.export_config["decoder_start_token_id"]
+        self.eos_token_id = self.export_config["eos_token_id"]
+        self.past_names = past_names(self.export_config["num_layers"])
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.encoder = self._load_session(ENCODER_FILE, options)
+        self.decoder_init = self._load_session(DECODER_INIT_FILE, options)
+        self.decoder_step = self._load_session(DECODER_STEP_FILE, options)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(export_dir, TOKENIZER_FILE))
+        self.tokenizer.enable_truncation(self.export_config["max_length"])
+
+    def _load_session(self, filename: str, options: ort.SessionOptions) -> ort.InferenceSession:
+        """加载 ONNX 计算图"""
+        return ort.InferenceSession(
+            os.path.join(self.export_dir, filename),
+            options,
+            providers=["CPUExecutionProvider"]
+        )
+
+    def encode_input(self, input_text: str) -> Dict[str, np.ndarray]:
+        """编码输入文本（不做填充）"""
+        encoding = self.tokenizer.encode(input_text)
+        return {
+            "input_ids": np.array([encoding.ids], dtype=np.int64),
+            "attention_mask": np.array([encoding.attention_mask], dtype=np.int64)
+        }
+
+    def generate(self, input_text: str, max_length: int = 512, num_beams: Optional[int] = None,
+                 max_time: Optional[float] = None) -> str:
+        """生成任务解析结果（num_beams=1 即贪心解码；max_time 秒后停止生成）"""
+        if num_beams is None:
+            num_beams = self.num_beams
+        deadline = time.perf_counter() + max_time if max_time is not None else None
+
+        inputs = self.encode_input(input_text)
+        encoder_hidden_states = self.encoder.run(None, inputs)[0]
+
+        if num_beams > 1:
+            token_ids = self._beam_search(
+                encoder_hidden_states, inputs["attention_mask"], max_length, num_beams, deadline=deadline
+            )
+        else:
+            token_ids = self._greedy_search(encoder_hidden_states, inputs["attention_mask"], max_length, deadline)
+
+        return self.tokenizer.decode(token_ids, skip_special_tokens=True)
+
+    def _decode_step(self, decoder_input_ids: np.ndarray, encoder_hidden_states: np.ndarray,
+                     attention_mask: np.ndarray, past: Optional[List[np.ndarray]] = None) -> List[np.ndarray]:
+        """运行一步解码器，返回 [logits, 展平的缓存...]"""
+        feed = {
+            "decoder_input_ids": decoder_input_ids,
+            "encoder_hidden_states": encoder_hidden_states,
+            "encoder_attention_mask": attention_mask
+        }
+        if past is None:
+            return self.decoder_init.run(None, feed)
+        feed.update(zip(self.past_names, past))
+        return self.decoder_step.run(None, feed)
+
+    def _greedy_search(self, encoder_hidden_states: np.ndarray, attention_mask: np.ndarray,
+                       max_length: int, deadline: Optional[float] = None) -> List[int]:
+        """贪心解码"""
+        token_ids = [self.decoder_start_token_id]
+        past = None
+
+        while True:
+            outputs = self._decode_step(
+                np.array([[token_ids[-1]]], dtype=np.int64), encoder_hidden_states, attention_mask, past
+            )
+            logits, past = outputs[0], outputs[1:]
+            next_token = int(logits[0, -1].argmax())
+            token_ids.append(next_token)
+            if next_token == self.eos_token_id or len(token_ids) >= max_length:
+                return token_ids
+            if deadline is not None and time.perf_counter() >= deadline:
+                return token_ids
+
+    def _beam_search(self, encoder_hidden_states: np.ndarray, attention_mask: np.ndarray, max_length: int,
+                     num_beams: int, no_repeat_ngram_size: int = 2, length_penalty: float = 1.0,
+                     deadline: Optional[float] = None) -> List[int]:
+        """束搜索（early_stopping：收集到 num_beams 个完成假设即停止）"""
+        encoder_hidden_states = np.repeat(encoder_hidden_states, num_beams, axis=0)
+        attention_mask = np.repeat(attention_mask, num_beams, axis=0)
+
+        beams = [[self.decoder_start_token_id] for _ in range(num_beams)]
+        # 初始时只保留第一个束，避免重复的候选
+        beam_scores = np.full(num_beams, -1e9, dtype=np.float32)
+        beam_scores[0] = 0.0
+        finished = []
+        past = None
+
+        while True:
+            decoder_input_ids = np.array([[tokens[-1]] for tokens in beams], dtype=np.int64)
+            outputs = self._decode_step(decoder_input_ids, encoder_hidden_states, attention_mask, past)
+            log_probs = self._log_softmax(outputs[0][:, -1, :])
+            vocab_size = log_probs.shape[-1]
+
+            for i, tokens in enumerate(beams):
+                banned_tokens = self._banned_ngram_tokens(tokens, no_repeat_ngram_size)
+                log_probs[i, banned_tokens] = -np.inf
+
+            scores = (beam_scores[:, None] + log_probs).reshape(-1)
+            candidates = np.argsort(-scores)[:2 * num_beams]
+
+            next_beams, next_scores, beam_indices = [], [], []
+            for rank, index in enumerate(candidates):
+                beam_index, token = divmod(int(index), vocab_size)
+                score = float(scores[index])
+                if token == self.eos_token_id:
+                    # 只有排名在前 num_beams 的结束符才算作完成假设
+                    if rank < num_beams:
+                        finished.append((self._hypothesis_score(beams[beam_index], score, length_penalty),
+                                         beams[beam_index] + [token]))
+                    continue
+                next_beams.append(beams[beam_index] + [token])
+                next_scores.append(score)
+                beam_indices.append(beam_index)
+                if len(next_beams) == num_beams:
+                    break
+
+            beams, beam_scores = next_beams, np.array(next_scores, dtype=np.float32)
+            if len(finished) >= num_beams or len(beams[0]) >= max_length:
+                break
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            # 按选中的束重排缓存
+            past = [tensor[beam_indices] for tensor in outputs[1:]]
+
+        # 达到最大长度或超时时完成假设不足，未完成的束按当前得分参与比较
+        if len(finished) < num_beams:
+            for tokens, score in zip(beams, beam_scores):
+                finished.append((self._hypothesis_score(tokens, float(score), length_penalty), tokens))
+
+        return max(finished, key=lambda x: x[0])[1]
+
+    def _hypothesis_score(self, tokens: List[int], score: float, length_penalty: float) -> float:
+        """按生成长度（不含起始符）归一化的假设得分"""
+        return score / max(len(tokens) - 1, 1) ** length_penalty
+
+    def _banned_ngram_tokens(self, tokens: List[int], ngram_size: int) -> List[int]:
+        """会导致 n-gram 重复的下一个 token"""
+        if ngram_size <= 0 or len(tokens) + 1 < ngram_size:
+            return []
+        prefix = tokens[len(tokens) - ngram_size + 1:]
+        return [
+            tokens[i + ngram_size - 1]
+            for i in range(len(tokens) - ngram_size + 1)
+            if tokens[i:i + ngram_size - 1] == prefix
+        ]
+
+    def _log_softmax(self, logits: np.ndarray) -> np.ndarray:
+        """按最后一维计算 log_softmax"""
+        shifted = logits - logits.max(axis=-1, keepdims=True)
+        return shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
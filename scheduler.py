@@ -3,7 +3,7 @@
 """
 
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator
 import copy
 
 class TimeSlot:
@@ -195,31 +195,74 @@ class ScheduleRuleEngine:
         remaining_tasks = []
         
         for task in sorted_tasks:
-            if len(scheduled_tasks) >= self.config.MAX_TASKS_PER_DAY:
-                remaining_tasks.append(task)
+            available_slots = self._place_task(task, available_slots, scheduled_tasks, remaining_tasks)
+        
+        return self._build_schedule_result(scheduled_tasks, remaining_tasks)
+    
+    def stream_schedule(self, task_stream: Iterable[Dict[str, Any]]) -> Iterator[Tuple[str, Any]]:
+        """增量安排任务：任务逐个到达时，最高优先级任务立即安排，其余任务在输入结束后按优先级安排。
+
+        schedule_tasks 对优先级做稳定排序，最高优先级任务按到达顺序最先安排，
+        因此结果与对完整任务列表调用 schedule_tasks 一致。
+        依次产出 ("placed", 已安排任务)，最后产出 ("done", 日程结果)。
+        """
+        top_priority = min(self.config.PRIORITY_LEVELS.values())
+        available_slots = self.get_available_time_slots()
+        
+        scheduled_tasks = []
+        remaining_tasks = []
+        deferred_tasks = []
+        
+        for task in task_stream:
+            if task["priority"] > top_priority:
+                deferred_tasks.append(task)
                 continue
             
-            # 寻找最佳时间段
-            best_slot = self.find_best_time_slot(task, available_slots)
-            
-            if best_slot:
-                # 安排任务
-                scheduled_task = copy.deepcopy(task)
-                scheduled_task["start_time"] = best_slot.start_time
-                scheduled_task["end_time"] = self._calculate_end_time(
-                    best_slot.start_time, task["duration"]
-                )
-                scheduled_tasks.append(scheduled_task)
-                
-                # 更新可用时间段
-                task_slot = TimeSlot(
-                    scheduled_task["start_time"],
-                    scheduled_task["end_time"]
-                )
-                available_slots = self._remove_overlapping_slots(available_slots, task_slot)
-            else:
-                remaining_tasks.append(task)
-        
+            num_scheduled = len(scheduled_tasks)
+            available_slots = self._place_task(task, available_slots, scheduled_tasks, remaining_tasks)
+            if len(scheduled_tasks) > num_scheduled:
+                yield "placed", scheduled_tasks[-1]
+        
+        for task in sorted(deferred_tasks, key=lambda x: x["priority"]):
+            num_scheduled = len(scheduled_tasks)
+            available_slots = self._place_task(task, available_slots, scheduled_tasks, remaining_tasks)
+            if len(scheduled_tasks) > num_scheduled:
+                yield "placed", scheduled_tasks[-1]
+        
+        yield "done", self._build_schedule_result(scheduled_tasks, remaining_tasks)
+    
+    def _place_task(self, task: Dict[str, Any], available_slots: List[TimeSlot],
+                    scheduled_tasks: List[Dict[str, Any]], remaining_tasks: List[Dict[str, Any]]) -> List[TimeSlot]:
+        """为单个任务寻找时间段并安排，返回更新后的可用时间段"""
+        if len(scheduled_tasks) >= self.config.MAX_TASKS_PER_DAY:
+            remaining_tasks.append(task)
+            return available_slots
+        
+        # 寻找最佳时间段
+        best_slot = self.find_best_time_slot(task, available_slots)
+        
+        if not best_slot:
+            remaining_tasks.append(task)
+            return available_slots
+        
+        # 安排任务
+        scheduled_task = copy.deepcopy(task)
+        scheduled_task["start_time"] = best_slot.start_time
+        scheduled_task["end_time"] = self._calculate_end_time(
+            best_slot.start_time, task["duration"]
+        )
+        scheduled_tasks.append(scheduled_task)
+        
+        # 更新可用时间段
+        task_slot = TimeSlot(
+            scheduled_task["start_time"],
+            scheduled_task["end_time"]
+        )
+        return self._remove_overlapping_slots(available_slots, task_slot)
+    
+    def _build_schedule_result(self, scheduled_tasks: List[Dict[str, Any]],
+                               remaining_tasks: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """插入固定任务并汇总日程结果"""
         # 添加固定任务到日程表
         for fixed_task in self.fixed_tasks:
             scheduled_tasks.append({
@@ -248,11 +291,12 @@ class ScheduleRuleEngine:
         return end.strftime("%H:%M")
     
     def validate_schedule(self, schedule: Dict[str, Any]) -> Dict[str, Any]:
-        """验证日程表的有效性"""
+        """验证日程表的有效性（invalid_tasks 为出现在错误中的任务名）"""
         validation_result = {
             "is_valid": True,
             "errors": [],
-            "warnings": []
+            "warnings": [],
+            "invalid_tasks": []
         }
         
         scheduled_tasks = schedule["scheduled_tasks"]
@@ -271,6 +315,9 @@ class ScheduleRuleEngine:
                     validation_result["errors"].append(
                         f"任务重叠: {task1['task']} 和 {task2['task']}"
                     )
+                    for name in (task1["task"], task2["task"]):
+                        if name not in validation_result["invalid_tasks"]:
+                            validation_result["invalid_tasks"].append(name)
         
         # 检查睡眠时间
         sleep_tasks = [task for task in scheduled_tasks if task["task"] == "睡眠"]
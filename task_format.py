@@ -0,0 +1,238 @@
+"""
+任务输出格式 - 模型输出文本的格式化、解析与校验（不依赖 torch/transformers）
+"""
+
+import re
+import time
+from typing import List, Dict, Any, Callable, Optional
+
+class GenerationTimeout(Exception):
+    """模型生成超出时间预算"""
+
+class IncrementalOutputParser:
+    """parse_output 的增量版本：逐段接收生成文本，每当一个 </priority> 块完成即解析出任务"""
+    
+    BLOCK_END = "</priority>"
+    
+    def __init__(self, parse_output: Callable[[str], List[Dict[str, Any]]]):
+        self.parse_output = parse_output
+        self.buffer = ""
+    
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """追加生成文本，返回新完成的任务"""
+        self.buffer += text
+        tasks = []
+        while True:
+            block_end = self.buffer.find(self.BLOCK_END)
+            if block_end == -1:
+                break
+            block_end += len(self.BLOCK_END)
+            block, self.buffer = self.buffer[:block_end], self.buffer[block_end:]
+            tasks.extend(self.parse_output(block))
+        return tasks
+    
+    def flush(self) -> List[Dict[str, Any]]:
+        """生成结束后解析剩余文本（如缺少优先级字段的最后一个块）"""
+        remaining, self.buffer = self.buffer, ""
+        if not remaining.strip():
+            return []
+        return self.parse_output(remaining)
+
+class TaskOutputMixin:
+    """任务输出文本的格式化、解析、校验以及自适应解码策略。
+
+    子类需提供 generate(input_text, num_beams=...) 以及 decoding_strategy、
+    decoding_stats 属性。
+    """
+    
+    # 输入文本中的时长表达，如 "2小时"、"1小时30分钟"、"45min"
+    DURATION_PATTERN = re.compile(
+        r'(\d+)\s*(?:小时|h)(?:\s*(\d+)\s*(?:分钟|min))?|(\d+)\s*(?:分钟|min)'
+    )
+    
+    def format_output(self, tasks: List[Dict[str, Any]]) -> str:
+        """将任务列表格式化为输出文本"""
+        output_parts = []
+        for task in tasks:
+            task_str = (
+                f"<task>{task['task']}</task> "
+                f"<duration>{task['duration']}</duration> "
+                f"<time>{task['pref_time']}</time> "
+                f"<priority>{task['priority']}</priority>"
+            )
+            output_parts.append(task_str)
+        return " | ".join(output_parts)
+    
+    def parse_output(self, output_text: str) -> List[Dict[str, Any]]:
+        """将模型生成的标注文本解析为任务列表，稳健处理缺失/异常字段。
+
+        规则：
+        - 使用 " | " 分隔多个任务块
+        - 任务名/时长为必填，缺失或非法则跳过该块
+        - 偏好时间缺失或为空默认 "上午"
+        - 优先级缺失或非数字默认 3
+        """
+        tasks = []
+        # 模型输出按分隔符拆分为多个任务块
+        task_blocks = output_text.split(" | ")
+        
+        for block in task_blocks:
+            try:
+                # 提取任务名称
+                task_start = block.find("<task>") + 6
+                task_end = block.find("</task>")
+                if task_start < 6 or task_end == -1:
+                    # 块不包含有效的任务标签，跳过
+                    continue
+                task_name = block[task_start:task_end].strip()
+                
+                # 提取时长
+                duration_start = block.find("<duration>") + 10
+                duration_end = block.find("</duration>")
+                if duration_start < 10 or duration_end == -1:
+                    # 缺失时长则跳过该块
+                    continue
+                duration_str = block[duration_start:duration_end].strip()
+                if duration_str == "":
+                    # 空时长不合法，跳过
+                    continue
+                duration = int(duration_str)
+                
+                # 提取偏好时间
+                time_start = block.find("<time>") + 6
+                time_end = block.find("</time>")
+                if time_start < 6 or time_end == -1:
+                    pref_time = "上午"
+                else:
+                    pref_time = block[time_start:time_end].strip() or "上午"
+                
+                # 提取优先级
+                priority_start = block.find("<priority>") + 10
+                priority_end = block.find("</priority>")
+                if priority_start < 10 or priority_end == -1:
+                    priority = 3
+                else:
+                    priority_str = block[priority_start:priority_end].strip()
+                    priority = int(priority_str) if priority_str.isdigit() else 3
+                
+                tasks.append({
+                    "task": task_name,
+                    "duration": duration,
+                    "pref_time": pref_time,
+                    "priority": priority
+                })
+            except (ValueError, IndexError) as e:
+                print(f"解析任务块时出错: {block}, 错误: {e}")
+                continue
+        
+        return tasks
+    
+    def extract_input_durations(self, input_text: str) -> List[int]:
+        """提取输入文本中出现的所有时长（分钟）"""
+        durations = []
+        for match in self.DURATION_PATTERN.finditer(input_text):
+            hours, minutes, only_minutes = match.groups()
+            if hours is not None:
+                durations.append(int(hours) * 60 + int(minutes or 0))
+            else:
+                durations.append(int(only_minutes))
+        return durations
+    
+    def validate_output(self, input_text: str, tasks: List[Dict[str, Any]]) -> bool:
+        """校验解析结果与输入是否一致。
+
+        - 至少解析出一个任务
+        - 每个任务名都必须出现在输入中
+        - 时长必须为正数；若输入给出了时长，解析出的时长必须是其中之一
+        """
+        if not tasks:
+            return False
+        
+        input_durations = set(self.extract_input_durations(input_text))
+        for task in tasks:
+            if not task["task"] or task["task"] not in input_text:
+                return False
+            if task["duration"] <= 0:
+                return False
+            if input_durations and task["duration"] not in input_durations:
+                return False
+        
+        return True
+    
+    def predict_tasks(self, input_text: str, max_time: Optional[float] = None) -> List[Dict[str, Any]]:
+        """预测任务列表。
+
+        adaptive 策略先用贪心解码，解析结果通过 validate_output 校验则直接返回，
+        否则升级为束搜索；beam 策略始终使用束搜索。
+        max_time（秒）为整个解析阶段的时间预算，各次生成共享；超出时抛出 GenerationTimeout。
+        """
+        deadline = time.perf_counter() + max_time if max_time is not None else None
+        
+        if self.decoding_strategy == "adaptive":
+            output_text = self.generate(input_text, num_beams=1, max_time=self._remaining_time(deadline))
+            self._check_deadline(deadline)
+            tasks = self.parse_output(output_text)
+            if self.validate_output(input_text, tasks):
+                self.decoding_stats["greedy"] += 1
+                return tasks
+        
+        self.decoding_stats["beam"] += 1
+        output_text = self.generate(input_text, max_time=self._remaining_time(deadline))
+        self._check_deadline(deadline)
+        return self.parse_output(output_text)
+    
+    def _remaining_time(self, deadline: Optional[float]) -> Optional[float]:
+        """距截止时间的剩余秒数；已超时则抛出 GenerationTimeout"""
+        if deadline is None:
+            return None
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            raise GenerationTimeout("模型解析超出时间预算")
+        return remaining
+    
+    def _check_deadline(self, deadline: Optional[float]):
+        """生成返回时已到截止时间，说明输出可能被截断"""
+        if deadline is not None and time.perf_counter() >= deadline:
+            raise GenerationTimeout("模型解析超出时间预算")
+    
+    def generate_batch(self, input_texts: List[str], max_length: int = 512,
+                       num_beams: Optional[int] = None) -> List[str]:
+        """批量生成（默认逐条调用 generate，支持批量前向的子类可覆盖）"""
+        return [self.generate(text, max_length=max_length, num_beams=num_beams) for text in input_texts]
+    
+    def predict_tasks_batch(self, input_texts: List[str]) -> List[List[Dict[str, Any]]]:
+        """批量预测任务列表，解码策略与 predict_tasks 相同。
+
+        adaptive 策略先整批贪心解码，未通过校验的样本再合成一批做束搜索。
+        """
+        results = [None] * len(input_texts)
+        pending = list(range(len(input_texts)))
+        
+        if self.decoding_strategy == "adaptive" and pending:
+            outputs = self.generate_batch(input_texts, num_beams=1)
+            failed = []
+            for index, output_text in zip(pending, outputs):
+                tasks = self.parse_output(output_text)
+                if self.validate_output(input_texts[index], tasks):
+                    results[index] = tasks
+                    self.decoding_stats["greedy"] += 1
+                else:
+                    failed.append(index)
+            pending = failed
+        
+        if pending:
+            outputs = self.generate_batch([input_texts[index] for index in pending])
+            for index, output_text in zip(pending, outputs):
+                results[index] = self.parse_output(output_text)
+                self.decoding_stats["beam"] += 1
+        
+        return results
+    
+    def get_decoding_stats(self) -> Dict[str, Any]:
+        """各解码层级服务的请求数及占比"""
+        total = sum(self.decoding_stats.values())
+        stats = {"total": total}
+        for tier, count in self.decoding_stats.items():
+            stats[tier] = count
+            stats[f"{tier}_ratio"] = count / total if total else 0.0
+        return stats
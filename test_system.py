@@ -6,9 +6,12 @@ import json
 import os
 from config import Config
 from data_generator import DataGenerator
-from model import ScheduleT5Model
+from model import ScheduleT5Model, IncrementalOutputParser
 from scheduler import ScheduleRuleEngine
 from main import PersonalScheduleGenerator
+from lightweight_main import RuleBasedParser, SegmentCache
+from metrics import compute_task_metrics
+from benchmark_scheduler import generate_scenario, build_day_engines
 
 def test_data_generator():
     """测试数据生成器"""
@@ -33,9 +36,18 @@ def test_data_generator():
     loaded_data = generator.load_dataset(test_file)
     print(f"保存和加载测试: {'通过' if len(loaded_data) == len(dataset) else '失败'}")
     
+    # JSONL 流式保存（生成器）与按下标随机读取
+    jsonl_file = "test_data.jsonl"
+    generator.save_dataset((sample for sample in dataset), jsonl_file)
+    loaded_jsonl = generator.load_dataset(jsonl_file)
+    jsonl_ok = len(loaded_jsonl) == len(dataset) and loaded_jsonl[-1] == dataset[-1] and list(loaded_jsonl) == dataset
+    loaded_jsonl.close()
+    print(f"JSONL 保存和随机读取测试: {'通过' if jsonl_ok else '失败'}")
+    
     # 清理测试文件
-    if os.path.exists(test_file):
-        os.remove(test_file)
+    for path in [test_file, jsonl_file, jsonl_file + ".idx"]:
+        if os.path.exists(path):
+            os.remove(path)
     
     print("数据生成器测试完成\n")
 
@@ -65,6 +77,17 @@ def test_model():
     encoded = model.encode_input(input_text)
     print(f"输入编码形状: {encoded['input_ids'].shape}")
     
+    # 测试解码结果校验（自适应解码的升级依据）
+    print(f"解码结果校验: {'通过' if model.validate_output(input_text, parsed_tasks) else '失败'}")
+    
+    # 测试增量解析（按小片段喂入，结果应与整体解析一致）
+    parser = IncrementalOutputParser(model.parse_output)
+    streamed_tasks = []
+    for i in range(0, len(formatted_output), 5):
+        streamed_tasks.extend(parser.feed(formatted_output[i:i + 5]))
+    streamed_tasks.extend(parser.flush())
+    print(f"增量解析测试: {'通过' if streamed_tasks == parsed_tasks else '失败'}")
+    
     print("模型功能测试完成\n")
 
 def test_scheduler():
@@ -105,8 +128,223 @@ def test_scheduler():
     if validation['warnings']:
         print(f"警告: {validation['warnings']}")
     
+    # 测试增量调度（结果应与整体调度一致）
+    stream_events = list(scheduler.stream_schedule(iter(tasks)))
+    placed_count = sum(1 for event, _ in stream_events if event == "placed")
+    print(f"增量调度测试: {'通过' if stream_events[-1][1] == scheduler.schedule_tasks(tasks) else '失败'} (流式安排 {placed_count} 个)")
+    
+    # 压力场景：同一种子可复现，额外固定任务与配置中的固定任务不重叠
+    scenario = generate_scenario(200, num_days=3, pref_skew=1.0, fixed_density=0.3, seed=7)
+    fixed_ok = all(
+        not fixed.overlaps_with(other)
+        for engine in build_day_engines(scenario, None)
+        for index, fixed in enumerate(engine.fixed_tasks)
+        for other in engine.fixed_tasks[index + 1:]
+    )
+    reproducible = scenario == generate_scenario(200, num_days=3, pref_skew=1.0, fixed_density=0.3, seed=7)
+    print(f"压力场景生成测试: {'通过' if fixed_ok and reproducible else '失败'} ({len(scenario['tasks'])} 个任务, {len(scenario['fixed_tasks_by_day'])} 天)")
+    
     print("规则引擎测试完成\n")
 
+def test_rule_parser():
+    """测试规则解析器"""
+    print("="*50)
+    print("测试规则解析器")
+    print("="*50)
+    
+    parser = RuleBasedParser()
+    tasks = parser.parse_tasks("写周报2小时，健身1小时，下午开会")
+    print(f"解析结果: {tasks}")
+    
+    # 测试流式批量解析（结果应与逐条解析一致，坏行单独报告）
+    inputs = ["写周报2小时，健身1小时", "学习编程3小时，阅读1小时", "打扫卫生1小时，散步30分钟"]
+    lines = [json.dumps({"input_text": text}, ensure_ascii=False) for text in inputs] + ["{坏行", ""]
+    records = list(parser.parse_stream(lines, input_format="jsonl", chunk_size=2))
+    parsed = [record["tasks"] for record in records if "error" not in record]
+    bad = [record["line"] for record in records if "error" in record]
+    passed = parsed == [parser.parse_tasks(text) for text in inputs] and bad == [4]
+    print(f"流式解析测试: {'通过' if passed else '失败'} (成功 {len(parsed)} 行, 坏行 {len(bad)} 行)")
+    
+    # 测试片段缓存（重复片段命中缓存，结果与不缓存一致，超出容量时淘汰）
+    cached_parser = RuleBasedParser(SegmentCache(max_size=2))
+    cached_tasks = [cached_parser.parse_tasks(text) for text in inputs + inputs[-1:]]
+    stats = cached_parser.cache.get_stats()
+    passed = cached_tasks == [RuleBasedParser(cache=None).parse_tasks(text) for text in inputs + inputs[-1:]]
+    print(f"片段缓存测试: {'通过' if passed and stats['hits'] == 2 else '失败'} (命中 {stats['hits']}, 淘汰 {stats['evictions']})")
+    
+    print("规则解析器测试完成\n")
+
+def test_metrics():
+    """测试评估指标"""
+    print("="*50)
+    print("测试评估指标")
+    print("="*50)
+    
+    reference = [
+        {"task": "写周报", "duration": 120, "pref_time": "上午", "priority": 1},
+        {"task": "健身", "duration": 60, "pref_time": "傍晚", "priority": 2}
+    ]
+    predicted = [
+        {"task": "写周报", "duration": 120, "pref_time": "上午", "priority": 1},
+        {"task": "健身", "duration": 90, "pref_time": "傍晚", "priority": 2},
+        {"task": "开会", "duration": 60, "pref_time": "下午", "priority": 3}
+    ]
+    
+    metrics = compute_task_metrics([predicted, reference], [reference, reference])
+    print(json.dumps(metrics, ensure_ascii=False, indent=2))
+    expected = {"exact_match": 0.5, "task_recall": 1.0, "task_precision": 0.8, "duration_accuracy": 0.75}
+    passed = all(abs(metrics[key] - value) < 1e-9 for key, value in expected.items())
+    print(f"指标计算测试: {'通过' if passed else '失败'}")
+    
+    print("评估指标测试完成\n")
+
+def test_packed_loss():
+    """测试序列打包：打包批的损失应等于逐样本（不打包）计算的逐 token 平均损失"""
+    print("="*50)
+    print("测试序列打包损失")
+    print("="*50)
+    
+    import numpy as np
+    import torch
+    from transformers import T5Config, T5ForConditionalGeneration
+    from training_data import PackedCollator, forward_batch
+    
+    torch.manual_seed(0)
+    config = T5Config(vocab_size=64, d_model=32, d_kv=8, d_ff=64, num_layers=2, num_heads=4,
+                      decoder_start_token_id=0, pad_token_id=0, eos_token_id=1)
+    model = T5ForConditionalGeneration(config).eval()
+    
+    rng = np.random.default_rng(0)
+    features = [
+        {"input_ids": rng.integers(2, 64, size=input_length), "labels": rng.integers(2, 64, size=label_length)}
+        for input_length, label_length in [(7, 4), (5, 6), (9, 3), (4, 5)]
+    ]
+    
+    with torch.no_grad():
+        packed = PackedCollator(pad_token_id=0, decoder_start_token_id=0)([features[:3], features[3:]])
+        packed_loss = forward_batch(model, packed).loss.item()
+        
+        # 逐样本计算损失，按目标 token 数加权平均
+        total_loss = 0.0
+        for feature in features:
+            loss = model(
+                input_ids=torch.from_numpy(feature["input_ids"])[None],
+                labels=torch.from_numpy(feature["labels"])[None]
+            ).loss.item()
+            total_loss += loss * len(feature["labels"])
+        unpacked_loss = total_loss / sum(len(feature["labels"]) for feature in features)
+    
+    passed = abs(packed_loss - unpacked_loss) < 1e-4
+    print(f"打包损失 {packed_loss:.6f}, 逐样本损失 {unpacked_loss:.6f}")
+    print(f"序列打包损失测试: {'通过' if passed else '失败'}")
+    
+    print("序列打包损失测试完成\n")
+
+def test_speculative_parity():
+    """测试推测解码：无论草稿正确、为空、错误或部分扰动，结果都应与普通贪心解码一致"""
+    print("="*50)
+    print("测试推测解码一致性")
+    print("="*50)
+    
+    import numpy as np
+    import torch
+    from transformers import T5Config, T5ForConditionalGeneration
+    from model import ScheduleT5Model
+    
+    class IdTokenizer:
+        """把空格分隔的整数直接作为 token 编号（0 为填充，1 为结束符），供小型随机模型使用"""
+        def __call__(self, texts, add_special_tokens=True, return_tensors=None, **kwargs):
+            single = isinstance(texts, str)
+            ids = [[int(token) for token in text.split()] + ([1] if add_special_tokens else [])
+                   for text in ([texts] if single else texts)]
+            if return_tensors == "pt":
+                input_ids = torch.tensor(ids)
+                return {"input_ids": input_ids, "attention_mask": torch.ones_like(input_ids)}
+            return {"input_ids": ids[0] if single else ids}
+        
+        def decode(self, ids, skip_special_tokens=False):
+            return " ".join(str(int(i)) for i in ids if not (skip_special_tokens and int(i) in (0, 1)))
+    
+    torch.manual_seed(0)
+    # 不共享输出层权重：共享时随机初始化的小模型几乎总是预测填充符，输出为空
+    config = T5Config(vocab_size=64, d_model=32, d_kv=8, d_ff=64, num_layers=2, num_heads=4,
+                      decoder_start_token_id=0, pad_token_id=0, eos_token_id=1, tie_word_embeddings=False)
+    model = ScheduleT5Model.from_prepared(IdTokenizer(), T5ForConditionalGeneration(config).eval())
+    
+    rng = np.random.default_rng(0)
+    inputs = [" ".join(map(str, rng.integers(2, 64, size=int(rng.integers(4, 12))))) for _ in range(6)]
+    
+    def perturb(tokens):
+        tokens = list(tokens)
+        if tokens:
+            tokens[int(rng.integers(len(tokens)))] = str(rng.integers(2, 64))
+            del tokens[int(rng.integers(len(tokens)))]
+        return tokens + [str(rng.integers(2, 64))]
+    
+    matched = total = 0
+    for kind in ["correct", "empty", "wrong", "perturbed"]:
+        model.draft_stats = {"forward_passes": 0, "generated_tokens": 0, "accepted_draft_tokens": 0}
+        for max_length in [8, 32]:
+            for input_text in inputs:
+                with torch.no_grad():
+                    expected_ids = model.model.generate(**model.encode_batch([input_text]), max_length=max_length, num_beams=1)
+                expected = model.tokenizer.decode(expected_ids[0], skip_special_tokens=True)
+                draft = {
+                    "correct": expected,
+                    "empty": "",
+                    "wrong": " ".join(map(str, rng.integers(2, 64, size=10))),
+                    "perturbed": " ".join(perturb(expected.split()))
+                }[kind]
+                matched += model.generate_with_draft(input_text, draft, max_length) == expected
+                total += 1
+        stats = model.get_draft_stats()
+        print(f"{kind:<10} 每次前向 {stats['tokens_per_pass']:.2f} token, 草稿接受率 {stats['draft_acceptance']:.1%}")
+    
+    print(f"与贪心解码一致: {matched}/{total}")
+    print(f"推测解码一致性测试: {'通过' if matched == total else '失败'}")
+    
+    print("推测解码一致性测试完成\n")
+
+def test_micro_batcher_stop():
+    """测试微批处理器停止：等待窗口中已取出与仍在排队的请求都应以 RuntimeError 失败，之后的请求被拒绝"""
+    print("="*50)
+    print("测试微批处理器停止")
+    print("="*50)
+    
+    import asyncio
+    from inference_server import MicroBatcher
+    
+    class StubModel:
+        def predict_tasks_batch(self, input_texts):
+            return [[] for _ in input_texts]
+    
+    async def run():
+        batcher = MicroBatcher(StubModel(), max_batch_size=8, max_wait_ms=500)
+        await batcher.start()
+        # 3 条请求凑不满一批，50 毫秒后停止时已被取出、仍在等待窗口中
+        requests = [asyncio.create_task(batcher.parse(f"请求{i}")) for i in range(3)]
+        await asyncio.sleep(0.05)
+        await batcher.stop()
+        # 未失败的请求会一直挂起，等待设上限
+        done, pending = await asyncio.wait(requests, timeout=5)
+        for task in pending:
+            task.cancel()
+        results = [task.exception() if task in done else None for task in requests]
+        try:
+            await batcher.parse("停止后的请求")
+            rejected = False
+        except RuntimeError:
+            rejected = True
+        return results, rejected
+    
+    results, rejected = asyncio.run(run())
+    failed = sum(isinstance(result, RuntimeError) for result in results)
+    passed = failed == len(results) and rejected
+    print(f"{failed}/{len(results)} 个未完成的请求以 RuntimeError 失败，停止后的请求{'被拒绝' if rejected else '未被拒绝'}")
+    print(f"微批处理器停止测试: {'通过' if passed else '失败'}")
+    
+    print("微批处理器停止测试完成\n")
+
 def test_integration():
     """测试系统集成"""
     print("="*50)
@@ -154,6 +392,11 @@ def main():
         test_data_generator()
         test_model()
         test_scheduler()
+        test_rule_parser()
+        test_metrics()
+        test_packed_loss()
+        test_speculative_parity()
+        test_micro_batcher_stop()
         test_integration()
         
         print("="*60)
@@ -4,87 +4,280 @@
 
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader
-from transformers import T5ForConditionalGeneration, T5Tokenizer, AdamW, get_linear_schedule_with_warmup
-from model import ScheduleT5Model, ScheduleDataset
+import torch.nn.functional as F
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, IterableDataset, DistributedSampler, RandomSampler, Subset
+from transformers import T5Config, T5ForConditionalGeneration, T5Tokenizer, AdamW, get_linear_schedule_with_warmup
+from model import ScheduleT5Model
+from training_data import (
+    load_pretokenized, ScheduleCollator, LengthGroupedBatchSampler,
+    PackedDataset, PackedCollator, StreamingScheduleDataset, forward_batch, count_real_tokens
+)
+from checkpointing import AsyncCheckpointer, get_rng_state, set_rng_state, latest_checkpoint, load_checkpoint
 from data_generator import DataGenerator
+from dataset_io import load_dataset
+from metrics import compute_task_metrics
+from training_metrics import StepMetricsWriter, ProfilerWindow, new_step_timings, rank_path
 from config import Config
+import argparse
+import contextlib
+import copy
+import itertools
+import math
 import json
 import os
+import random
+import time
 from tqdm import tqdm
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 
 class ScheduleTrainer:
     """日程模型训练器"""
     
     def __init__(self, config: Config):
         self.config = config
-        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        print(f"使用设备: {self.device}")
+        
+        # 分布式训练：由 torchrun 设置的环境变量决定，直接运行时为单进程
+        self.world_size = int(os.environ.get("WORLD_SIZE", 1))
+        self.rank = int(os.environ.get("RANK", 0))
+        self.distributed = self.world_size > 1
+        self.is_main_process = self.rank == 0
+        if config.MIXED_PRECISION not in (None, "bf16"):
+            raise ValueError(f"不支持的混合精度模式: {config.MIXED_PRECISION}")
+        if config.EVAL_METRIC != "val_loss" and not config.GENERATION_EVAL_SAMPLES:
+            raise ValueError(f"EVAL_METRIC={config.EVAL_METRIC} 需要开启生成式指标（GENERATION_EVAL_SAMPLES > 0）")
+        if config.BATCH_SIZE % self.world_size != 0:
+            raise ValueError(f"BATCH_SIZE ({config.BATCH_SIZE}) 必须能被训练进程数 ({self.world_size}) 整除")
+        # 每个进程的批大小，各进程合起来的全局批大小与单进程训练相同
+        self.local_batch_size = config.BATCH_SIZE // self.world_size
+        
+        if self.distributed:
+            self._init_distributed()
+            local_rank = int(os.environ.get("LOCAL_RANK", 0))
+            self.device = torch.device(f"cuda:{local_rank}" if torch.cuda.is_available() else "cpu")
+        else:
+            self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.log(f"使用设备: {self.device}" + (f", {self.world_size} 个训练进程" if self.distributed else ""))
+        torch.manual_seed(config.SEED)
+        # 单进程训练的打乱顺序由该生成器按 (SEED, epoch) 决定，恢复训练时可复现
+        self._shuffle_generator = torch.Generator()
         
         # 初始化模型
-        self.model = ScheduleT5Model(config.MODEL_NAME)
+        self.model = self._build_model()
         self.model.model.to(self.device)
+        if config.GRADIENT_CHECKPOINTING:
+            self.model.model.gradient_checkpointing_enable()
+        # 训练前向使用 DDP 包装的模型（构造时从主进程广播参数，反向时同步梯度）；
+        # 评估、保存与生成仍使用原模型
+        if self.distributed:
+            self.train_model = DistributedDataParallel(
+                self.model.model,
+                device_ids=[self.device.index] if self.device.type == "cuda" else None,
+                # 梯度检查点在反向时重跑前向，需声明静态图，DDP 才能正确同步重算部分的梯度
+                static_graph=config.GRADIENT_CHECKPOINTING
+            )
+        else:
+            self.train_model = self.model.model
         
         # 创建输出目录
-        os.makedirs(config.OUTPUT_DIR, exist_ok=True)
+        if self.is_main_process:
+            os.makedirs(config.OUTPUT_DIR, exist_ok=True)
+    
+    def _build_model(self) -> ScheduleT5Model:
+        """构建待训练的模型"""
+        return ScheduleT5Model(
+            self.config.MODEL_NAME,
+            decoding_strategy=self.config.DECODING_STRATEGY,
+            num_beams=self.config.NUM_BEAMS
+        )
+    
+    def _init_distributed(self):
+        """初始化进程组，并把本机 CPU 核数均分给各训练进程，避免线程超额占用"""
+        dist.init_process_group(self.config.DIST_BACKEND)
+        num_threads = self.config.DIST_THREADS_PER_PROCESS
+        if num_threads is None:
+            local_world_size = int(os.environ.get("LOCAL_WORLD_SIZE", self.world_size))
+            num_threads = max(1, (os.cpu_count() or 1) // local_world_size)
+        torch.set_num_threads(num_threads)
+    
+    def log(self, message: str):
+        """只在主进程输出日志"""
+        if self.is_main_process:
+            print(message)
+    
+    def _barrier(self):
+        """分布式训练时等待所有进程到达此处"""
+        if self.distributed:
+            dist.barrier()
+    
+    def _all_reduce_sum(self, values: List[float]) -> List[float]:
+        """各进程的统计量求和"""
+        if not self.distributed:
+            return values
+        tensor = torch.tensor(values, dtype=torch.float64)
+        dist.all_reduce(tensor)
+        return tensor.tolist()
+    
+    def close(self):
+        """释放分布式进程组"""
+        if self.distributed and dist.is_initialized():
+            dist.destroy_process_group()
         
     def prepare_data(self):
         """准备训练和验证数据"""
-        print("准备数据...")
+        self.log("准备数据...")
         
-        # 检查数据文件是否存在
-        if not os.path.exists(self.config.TRAIN_DATA_PATH):
-            print("生成训练数据...")
-            generator = DataGenerator()
-            generator.generate_dataset(1000)
-            generator.save_dataset(generator.generate_dataset(1000), self.config.TRAIN_DATA_PATH)
+        stream = self.config.TRAIN_DATA_SOURCE == "stream"
         
-        if not os.path.exists(self.config.VAL_DATA_PATH):
-            print("生成验证数据...")
-            generator = DataGenerator()
-            generator.save_dataset(generator.generate_dataset(200), self.config.VAL_DATA_PATH)
-        
-        # 加载数据
-        with open(self.config.TRAIN_DATA_PATH, 'r', encoding='utf-8') as f:
-            train_data = json.load(f)
-        
-        with open(self.config.VAL_DATA_PATH, 'r', encoding='utf-8') as f:
-            val_data = json.load(f)
+        # 数据文件与预分词产物由主进程生成，其他进程等待其完成后直接读取
+        if self.is_main_process:
+            self._generate_data_files(stream)
+            self._load_datasets(stream)
+        self._barrier()
+        if not self.is_main_process:
+            self._load_datasets(stream)
         
-        # 创建数据集
-        self.train_dataset = ScheduleDataset(
-            train_data, 
-            self.model.tokenizer, 
-            self.config.MAX_LENGTH
-        )
-        self.val_dataset = ScheduleDataset(
-            val_data, 
-            self.model.tokenizer, 
-            self.config.MAX_LENGTH
+        # 动态填充：每批只填充到本批最长序列，目标填充位置不计入损失
+        collator = ScheduleCollator(
+            self.model.tokenizer.pad_token_id,
+            None if self.config.DYNAMIC_PADDING else self.config.MAX_LENGTH
         )
         
         # 创建数据加载器
-        self.train_loader = DataLoader(
-            self.train_dataset,
-            batch_size=self.config.BATCH_SIZE,
-            shuffle=True,
-            num_workers=0
-        )
+        if stream:
+            # 无限数据流：生成与分词在工作进程中完成，每个 epoch 取固定步数
+            self.train_dataset = StreamingScheduleDataset(
+                self.model.tokenizer,
+                self.config.STREAM_SEED,
+                self.config.MAX_LENGTH,
+                rank=self.rank
+            )
+            self.train_loader = DataLoader(
+                self.train_dataset,
+                batch_size=self.local_batch_size,
+                num_workers=self.config.NUM_WORKERS,
+                persistent_workers=self.config.NUM_WORKERS > 0,
+                collate_fn=collator
+            )
+        else:
+            if self.config.PACK_SEQUENCES:
+                # 打包模式：多个样本拼入同一窗口，验证集仍逐样本计算，损失可与其他模式比较
+                self.train_dataset = PackedDataset(self.train_dataset, self.config.PACK_LENGTH)
+                self.log(f"打包: {len(self.train_dataset.dataset)} 样本 -> {len(self.train_dataset)} 个窗口")
+                self.train_loader = DataLoader(
+                    self.train_dataset,
+                    batch_size=self.local_batch_size,
+                    **self._shuffle_kwargs(self.train_dataset),
+                    num_workers=0,
+                    collate_fn=PackedCollator(
+                        self.model.tokenizer.pad_token_id,
+                        self.model.model.config.decoder_start_token_id
+                    )
+                )
+            elif self.config.GROUP_BY_LENGTH:
+                self.train_loader = DataLoader(
+                    self.train_dataset,
+                    batch_sampler=LengthGroupedBatchSampler(
+                        self.train_dataset.lengths,
+                        self.config.BATCH_SIZE,
+                        seed=self.config.SEED,
+                        rank=self.rank,
+                        world_size=self.world_size
+                    ),
+                    num_workers=0,
+                    collate_fn=collator
+                )
+            else:
+                self.train_loader = DataLoader(
+                    self.train_dataset,
+                    batch_size=self.local_batch_size,
+                    **self._shuffle_kwargs(self.train_dataset),
+                    num_workers=0,
+                    collate_fn=collator
+                )
         self.val_loader = DataLoader(
             self.val_dataset,
             batch_size=self.config.BATCH_SIZE,
             shuffle=False,
-            num_workers=0
+            num_workers=0,
+            collate_fn=collator
         )
+        # 训练中验证可只用验证集的固定随机子集，缩短验证耗时；训练结束后的评估仍用完整验证集
+        self.eval_loader = self.val_loader
+        if self.config.EVAL_SUBSAMPLE and self.config.EVAL_SUBSAMPLE < len(self.val_dataset):
+            indices = random.Random(self.config.SEED).sample(range(len(self.val_dataset)), self.config.EVAL_SUBSAMPLE)
+            self.eval_loader = DataLoader(
+                Subset(self.val_dataset, sorted(indices)),
+                batch_size=self.config.BATCH_SIZE,
+                shuffle=False,
+                num_workers=0,
+                collate_fn=collator
+            )
+        
+        # 每个 epoch 的训练步数；流式数据跨 epoch 使用同一个迭代器，样本不会重复
+        self.steps_per_epoch = self.config.STREAM_STEPS_PER_EPOCH if stream else len(self.train_loader)
+        self._train_iterator = None
         
-        print(f"训练数据: {len(train_data)} 样本")
-        print(f"验证数据: {len(val_data)} 样本")
+        self.log(f"训练数据: {'无限数据流, ' if stream else ''}每个 epoch {self.steps_per_epoch} 批"
+                 + ("（每进程）" if self.distributed else ""))
+        self.log(f"验证数据: {len(self.val_dataset)} 样本（训练中验证 {len(self.eval_loader.dataset)} 样本，"
+                 f"生成式指标 {len(self.generation_eval_samples)} 样本）")
     
-    def train(self):
-        """训练模型"""
-        print("开始训练...")
+    def _generate_data_files(self, stream: bool):
+        """生成缺失的数据文件（流式训练数据不需要训练数据文件）"""
+        if not stream and not os.path.exists(self.config.TRAIN_DATA_PATH):
+            print("生成训练数据...")
+            generator = DataGenerator(seed=self.config.SEED)
+            generator.save_dataset(generator.generate_dataset(1000), self.config.TRAIN_DATA_PATH)
+        
+        if not os.path.exists(self.config.VAL_DATA_PATH):
+            print("生成验证数据...")
+            # 验证集使用不同的种子，与训练集互不重复
+            generator = DataGenerator(seed=self.config.SEED + 1)
+            generator.save_dataset(generator.generate_dataset(200), self.config.VAL_DATA_PATH)
+    
+    def _load_datasets(self, stream: bool):
+        """加载预分词数据（首次或分词器/数据变化时重新分词），以及生成式指标所用的原始验证样本"""
+        self.val_dataset = load_pretokenized(
+            self.config.VAL_DATA_PATH,
+            self.model.tokenizer,
+            self.config.PRETOKENIZED_DIR,
+            self.config.MAX_LENGTH
+        )
+        # .jsonl 验证集按下标随机读取，不整体读入内存
+        val_samples = load_dataset(self.config.VAL_DATA_PATH)
+        num_samples = min(self.config.GENERATION_EVAL_SAMPLES, len(val_samples))
+        self.generation_eval_samples = random.Random(self.config.SEED).sample(val_samples, num_samples)
+        if not stream:
+            self.train_dataset = load_pretokenized(
+                self.config.TRAIN_DATA_PATH,
+                self.model.tokenizer,
+                self.config.PRETOKENIZED_DIR,
+                self.config.MAX_LENGTH
+            )
+    
+    def _shuffle_kwargs(self, dataset) -> Dict[str, Any]:
+        """逐样本打乱的 DataLoader 参数：分布式训练时由 DistributedSampler 把样本切分给各进程。
+        
+        两种方式打乱顺序相同（按 SEED + epoch 的 randperm），各进程第 k 批合起来即单进程的第 k 批；
+        末尾不足一个全局批的样本都被丢弃（DistributedSampler 不再重复样本补齐），每个 epoch 的批数一致。
+        """
+        if not self.distributed:
+            return {"sampler": RandomSampler(dataset, generator=self._shuffle_generator), "drop_last": True}
+        return {"sampler": DistributedSampler(
+            dataset, num_replicas=self.world_size, rank=self.rank, shuffle=True, seed=self.config.SEED,
+            drop_last=True
+        ), "drop_last": True}
+    
+    def train(self, resume_from: Optional[str] = None):
+        """训练模型（分布式训练时只有主进程评估、保存模型和输出日志）。
+        
+        每 CHECKPOINT_EVERY_STEPS 次参数更新保存一次完整训练状态；resume_from 为检查点路径时
+        从该检查点的位置继续训练（数据顺序、随机数状态与未中断时一致）。
+        """
+        self.log("开始训练...")
         
         # 优化器和学习率调度器
         optimizer = AdamW(
@@ -93,106 +286,367 @@ class ScheduleTrainer:
             weight_decay=0.01
         )
         
-        total_steps = len(self.train_loader) * self.config.NUM_EPOCHS
+        # 学习率调度按参数更新次数计算（梯度累积时少于训练批数）
+        accumulation_steps = self.config.GRADIENT_ACCUMULATION_STEPS
+        total_steps = math.ceil(self.steps_per_epoch / accumulation_steps) * self.config.NUM_EPOCHS
         scheduler = get_linear_schedule_with_warmup(
             optimizer,
             num_warmup_steps=self.config.WARMUP_STEPS,
             num_training_steps=total_steps
         )
         
+        # 训练进度（所有进程相同），随检查点保存；验证相关字段只在主进程更新
+        progress = {
+            "epoch": 0,
+            "step_in_epoch": 0,  # 本 epoch 已训练的微批数
+            "global_step": 0,    # 参数更新次数
+            "best_metric": None,
+            "evals_without_improvement": 0,
+            "train_losses": [],
+            "val_losses": [],
+            "eval_history": []
+        }
+        # 本进程在当前 epoch 的累计统计
+        rank_stats = {"train_loss": 0.0, "steps": 0, "real_tokens": 0, "seconds": 0.0}
+        resume_rng_state = None
+        if resume_from:
+            progress, rank_stats, resume_rng_state = self._load_training_state(resume_from, optimizer, scheduler)
+        
+        checkpoint_every = self.config.CHECKPOINT_EVERY_STEPS
+        eval_every = self.config.EVAL_EVERY_STEPS
+        stop = False
+        
+        # 每次参数更新的度量（各进程写各自的文件，恢复训练时追加），profiler 只在主进程开启
+        metrics_writer = None
+        if self.config.TRAIN_METRICS_PATH:
+            metrics_writer = StepMetricsWriter(
+                rank_path(self.config.TRAIN_METRICS_PATH, self.rank, self.world_size),
+                append=bool(resume_from)
+            )
+        profiler = None
+        if self.config.PROFILE_STEPS and self.is_main_process:
+            profiler = ProfilerWindow(*self.config.PROFILE_STEPS, self.config.PROFILE_DIR)
+        checkpointer = None
+        if checkpoint_every and self.is_main_process:
+            checkpointer = AsyncCheckpointer(self.config.CHECKPOINT_DIR, self.config.CHECKPOINT_KEEP)
+        
         # 训练循环
-        best_val_loss = float('inf')
-        train_losses = []
-        val_losses = []
+        self.log(f"有效批大小: {self.config.BATCH_SIZE * accumulation_steps}"
+                 f"（{accumulation_steps} 个微批累积）, 精度: {self.config.MIXED_PRECISION or 'fp32'}"
+                 + (", 梯度检查点" if self.config.GRADIENT_CHECKPOINTING else ""))
+        optimizer.zero_grad()
         
-        for epoch in range(self.config.NUM_EPOCHS):
-            print(f"\nEpoch {epoch + 1}/{self.config.NUM_EPOCHS}")
+        for epoch in range(progress["epoch"], self.config.NUM_EPOCHS):
+            self.log(f"\nEpoch {epoch + 1}/{self.config.NUM_EPOCHS}")
             
             # 训练阶段
             self.model.model.train()
-            train_loss = 0.0
-            train_progress = tqdm(self.train_loader, desc="训练")
+            start_step = progress["step_in_epoch"]
+            epoch_start = time.perf_counter() - rank_stats["seconds"]
+            batches = self._epoch_batches(epoch, start_step)
+            # 创建数据迭代器会消耗全局随机数，恢复的随机数状态需在其之后设置
+            if resume_rng_state is not None:
+                set_rng_state(resume_rng_state)
+                resume_rng_state = None
+            train_progress = tqdm(
+                batches,
+                total=self.steps_per_epoch,
+                initial=start_step,
+                desc="训练",
+                disable=not self.is_main_process
+            )
             
-            for batch in train_progress:
-                # 将数据移到设备
-                input_ids = batch["input_ids"].to(self.device)
-                attention_mask = batch["attention_mask"].to(self.device)
-                labels = batch["labels"].to(self.device)
+            wait_start = time.perf_counter()
+            for step, batch in enumerate(train_progress, start_step):
+                data_wait = time.perf_counter() - wait_start
                 
-                # 前向传播
-                outputs = self.model.model(
-                    input_ids=input_ids,
-                    attention_mask=attention_mask,
-                    labels=labels
-                )
+                # 梯度累积：每 accumulation_steps 个微批更新一次参数，epoch 末尾不足的一组也更新
+                group_start = step - step % accumulation_steps
+                group_size = min(accumulation_steps, self.steps_per_epoch - group_start)
+                update = step == group_start + group_size - 1
                 
-                loss = outputs.loss
-                train_loss += loss.item()
+                if step == group_start:
+                    # 本次参数更新的计时从等待第一个微批开始
+                    timings = new_step_timings()
+                    update_start = wait_start
+                    if profiler is not None:
+                        profiler.before_update(progress["global_step"] + 1)
                 
-                # 反向传播
-                optimizer.zero_grad()
-                loss.backward()
-                torch.nn.utils.clip_grad_norm_(self.model.model.parameters(), 1.0)
-                optimizer.step()
-                scheduler.step()
+                batch_tokens = count_real_tokens(batch, self.model.tokenizer.pad_token_id)
+                rank_stats["real_tokens"] += batch_tokens
+                timings["data_wait"] += data_wait
+                timings["real_tokens"] += batch_tokens
+                timings["padded_tokens"] += batch["input_ids"].numel() + batch["labels"].numel()
+                
+                # 前向与反向传播
+                loss = self._backward(batch, group_size, sync=update, timings=timings)
+                rank_stats["train_loss"] += loss
+                rank_stats["steps"] += 1
+                
+                if update:
+                    optimizer_start = time.perf_counter()
+                    self._optimizer_step(optimizer, scheduler)
+                    self._synchronize()
+                    timings["optimizer"] = time.perf_counter() - optimizer_start
+                    progress["global_step"] += 1
+                    if metrics_writer is not None:
+                        metrics_writer.write_step(
+                            progress["global_step"], epoch, timings,
+                            time.perf_counter() - update_start, scheduler.get_last_lr()[0]
+                        )
+                    if profiler is not None:
+                        profiler.after_update(progress["global_step"])
+                    progress["step_in_epoch"] = step + 1
+                    # 同一步既验证又保存检查点时先验证：检查点包含本次验证后的最佳指标、早停计数与随机数状态，
+                    # 从它恢复的训练与未中断时一致（不会重复或漏掉这次验证）
+                    if eval_every and progress["global_step"] % eval_every == 0:
+                        stop = self._evaluate_and_track(progress)
+                    if checkpoint_every and progress["global_step"] % checkpoint_every == 0:
+                        rank_stats["seconds"] = time.perf_counter() - epoch_start
+                        self._save_checkpoint(checkpointer, optimizer, scheduler, progress, rank_stats)
                 
                 # 更新进度条
-                train_progress.set_postfix({"loss": f"{loss.item():.4f}"})
+                train_progress.set_postfix({"loss": f"{loss:.4f}"})
+                if stop:
+                    break
+                wait_start = time.perf_counter()
             
-            avg_train_loss = train_loss / len(self.train_loader)
-            train_losses.append(avg_train_loss)
+            epoch_seconds = time.perf_counter() - epoch_start
+            # 汇总各进程的损失与 token 数（训练损失为各进程每步损失的平均）
+            train_loss, steps, real_tokens = self._all_reduce_sum(
+                [rank_stats["train_loss"], rank_stats["steps"], rank_stats["real_tokens"]]
+            )
+            avg_train_loss = train_loss / max(steps, 1)
+            progress["train_losses"].append(avg_train_loss)
+            self.log(f"训练吞吐: {real_tokens / epoch_seconds:,.0f} 真实token/秒 ({epoch_seconds:.1f} 秒)")
+            self.log(f"训练损失: {avg_train_loss:.4f}")
             
-            # 验证阶段
-            val_loss = self.evaluate()
-            val_losses.append(val_loss)
+            # 未按步数验证时每个 epoch 结束验证一次（各进程参数相同，只在主进程验证与保存）
+            if not eval_every and not stop:
+                stop = self._evaluate_and_track(progress)
             
-            print(f"训练损失: {avg_train_loss:.4f}, 验证损失: {val_loss:.4f}")
+            progress["epoch"] = epoch + 1
+            progress["step_in_epoch"] = 0
+            rank_stats = {"train_loss": 0.0, "steps": 0, "real_tokens": 0, "seconds": 0.0}
+            self._barrier()
+            if stop:
+                self.log(f"连续 {self.config.EARLY_STOPPING_PATIENCE} 次验证 {self.config.EVAL_METRIC} 没有改进，提前停止训练")
+                break
+        
+        if checkpointer is not None:
+            checkpointer.wait()
+        if metrics_writer is not None:
+            metrics_writer.close()
+        if profiler is not None:
+            profiler.close()
+        
+        if self.is_main_process:
+            # 保存最终模型
+            self.save_model(f"{self.config.OUTPUT_DIR}/final_model")
             
-            # 保存最佳模型
-            if val_loss < best_val_loss:
-                best_val_loss = val_loss
-                self.save_model(f"{self.config.OUTPUT_DIR}/best_model")
-                print(f"保存最佳模型，验证损失: {val_loss:.4f}")
+            # 保存训练历史
+            self.save_training_history(progress["train_losses"], progress["val_losses"], progress["eval_history"])
         
-        # 保存最终模型
-        self.save_model(f"{self.config.OUTPUT_DIR}/final_model")
+        self.log("训练完成!")
+    
+    def _epoch_batches(self, epoch: int, start_step: int = 0):
+        """一个 epoch 的训练批：数据文件每轮遍历一遍，流式数据从持续的迭代器中取 steps_per_epoch 批。
+        
+        start_step > 0（恢复训练）时跳过本 epoch 已训练的批：打乱顺序只取决于 (SEED, epoch)，
+        流式数据按相同种子重新生成，跳过的批只做数据加载，不做前向计算。
+        """
+        if isinstance(self.train_loader.dataset, IterableDataset):
+            if self._train_iterator is None:
+                self._train_iterator = iter(self.train_loader)
+                for _ in itertools.islice(self._train_iterator, epoch * self.steps_per_epoch + start_step):
+                    pass
+            return itertools.islice(self._train_iterator, self.steps_per_epoch - start_step)
+        
+        self._shuffle_generator.manual_seed(self.config.SEED + epoch)
+        for sampler in (self.train_loader.sampler, self.train_loader.batch_sampler):
+            if hasattr(sampler, "set_epoch"):
+                sampler.set_epoch(epoch)
+        return itertools.islice(iter(self.train_loader), start_step, None)
+    
+    def _checkpoint_layout(self) -> Dict[str, int]:
+        """决定数据切分与批组成的配置，恢复训练时必须一致"""
+        return {
+            "world_size": self.world_size,
+            "batch_size": self.config.BATCH_SIZE,
+            "accumulation_steps": self.config.GRADIENT_ACCUMULATION_STEPS
+        }
+    
+    def _save_checkpoint(self, checkpointer: Optional[AsyncCheckpointer], optimizer, scheduler,
+                         progress: Dict[str, Any], rank_stats: Dict[str, Any]):
+        """保存完整训练状态。所有进程都需调用（收集各进程的随机数状态与统计），由主进程交给后台线程写盘"""
+        rank_state = {"rng": get_rng_state(), "stats": dict(rank_stats)}
+        if self.distributed:
+            rank_states = [None] * self.world_size
+            dist.all_gather_object(rank_states, rank_state)
+        else:
+            rank_states = [rank_state]
+        
+        if checkpointer is not None:
+            checkpointer.save(progress["global_step"], {
+                "model": self.model.model.state_dict(),
+                "optimizer": optimizer.state_dict(),
+                "scheduler": scheduler.state_dict(),
+                "progress": progress,
+                "rank_states": rank_states,
+                "layout": self._checkpoint_layout()
+            })
+    
+    def _load_training_state(self, path: str, optimizer, scheduler):
+        """从检查点恢复模型、优化器与学习率调度，返回 (训练进度, 本进程统计, 本进程随机数状态)"""
+        checkpoint = load_checkpoint(path)
+        if checkpoint["layout"] != self._checkpoint_layout():
+            raise ValueError(f"检查点的训练配置 {checkpoint['layout']} 与当前配置 {self._checkpoint_layout()} 不一致，"
+                             f"无法按原数据顺序恢复")
+        
+        self.model.model.load_state_dict(checkpoint["model"])
+        optimizer.load_state_dict(checkpoint["optimizer"])
+        scheduler.load_state_dict(checkpoint["scheduler"])
+        
+        progress = checkpoint["progress"]
+        rank_state = checkpoint["rank_states"][self.rank]
+        self.log(f"从检查点恢复: {path}（第 {progress['epoch'] + 1} 轮第 {progress['step_in_epoch']} 批，"
+                 f"已更新 {progress['global_step']} 次）")
+        return progress, rank_state["stats"], rank_state["rng"]
+    
+    def _backward(self, batch: Dict[str, torch.Tensor], accumulation_size: int, sync: bool = True,
+                  timings: Optional[Dict[str, Any]] = None) -> float:
+        """一个微批的前向与反向，损失按本组累积的微批数缩放，返回未缩放的（本进程）损失。
+        
+        分布式训练时各进程的损失是本地目标 token 上的平均，而 DDP 对梯度取等权平均；
+        先按 本地 token 数 * 进程数 / 全局 token 数 缩放，同步后的梯度即全局批上按 token 平均的梯度，
+        与单进程训练一致。累积中间的微批不做梯度同步（no_sync），每次参数更新只同步一次。
+        传入 timings 时累加前向与反向耗时（秒）及损失。
+        """
+        context = self.train_model.no_sync() if self.distributed and not sync else contextlib.nullcontext()
+        with context:
+            forward_start = time.perf_counter()
+            with torch.profiler.record_function("forward"):
+                loss, label_tokens = self._training_loss(batch)
+            loss_value = loss.item()
+            if self.distributed:
+                global_tokens = self._all_reduce_sum([label_tokens])[0]
+                loss = loss * (label_tokens * self.world_size / global_tokens)
+            backward_start = time.perf_counter()
+            with torch.profiler.record_function("backward"):
+                (loss / accumulation_size).backward()
+            self._synchronize()
         
-        # 保存训练历史
-        self.save_training_history(train_losses, val_losses)
+        if timings is not None:
+            timings["forward"] += backward_start - forward_start
+            timings["backward"] += time.perf_counter() - backward_start
+            timings["loss"] += loss_value
+            timings["micro_batches"] += 1
+        return loss_value
+    
+    def _optimizer_step(self, optimizer, scheduler):
+        """梯度裁剪后更新参数与学习率，并清空累积的梯度"""
+        with torch.profiler.record_function("optimizer"):
+            torch.nn.utils.clip_grad_norm_(self.model.model.parameters(), 1.0)
+            optimizer.step()
+            scheduler.step()
+            optimizer.zero_grad()
+    
+    def _synchronize(self):
+        """GPU 上等待已排队的计算完成，使计时反映实际耗时（CPU 上无操作）"""
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+    
+    def _evaluate_and_track(self, progress: Dict[str, Any]) -> bool:
+        """验证（只在主进程），按 EVAL_METRIC 保存最佳模型并更新早停计数；返回是否停止训练（各进程一致）"""
+        stop = False
+        if self.is_main_process:
+            metrics = {"step": progress["global_step"], "val_loss": self.evaluate(self.eval_loader)}
+            if self.generation_eval_samples:
+                metrics.update(self.evaluate_generation(self.generation_eval_samples))
+            progress["val_losses"].append(metrics["val_loss"])
+            progress["eval_history"].append(metrics)
+            
+            summary = f"验证 (第 {progress['global_step']} 次更新): 损失 {metrics['val_loss']:.4f}"
+            if "task_f1" in metrics:
+                summary += (f", 任务F1 {metrics['task_f1']:.3f}, 时长准确率 {metrics['duration_accuracy']:.3f}, "
+                            f"优先级准确率 {metrics['priority_accuracy']:.3f}")
+            print(summary)
+            
+            # 保存最佳模型
+            value = metrics[self.config.EVAL_METRIC]
+            best = progress["best_metric"]
+            min_delta = self.config.EARLY_STOPPING_MIN_DELTA
+            if self.config.EVAL_METRIC == "val_loss":
+                improved = best is None or value < best - min_delta
+            else:
+                improved = best is None or value > best + min_delta
+            if improved:
+                progress["best_metric"] = value
+                progress["evals_without_improvement"] = 0
+                self.save_model(f"{self.config.OUTPUT_DIR}/best_model")
+                print(f"保存最佳模型，{self.config.EVAL_METRIC}: {value:.4f}")
+            else:
+                progress["evals_without_improvement"] += 1
+            
+            patience = self.config.EARLY_STOPPING_PATIENCE
+            stop = bool(patience) and progress["evals_without_improvement"] >= patience
         
-        print("训练完成!")
+        self.model.model.train()
+        return self._all_reduce_sum([float(stop)])[0] > 0
     
-    def evaluate(self) -> float:
-        """评估模型"""
+    def evaluate(self, loader: Optional[DataLoader] = None) -> float:
+        """评估模型（教师强制下的平均损失，默认使用完整验证集）"""
+        loader = loader or self.val_loader
         self.model.model.eval()
         val_loss = 0.0
         
         with torch.no_grad():
-            for batch in tqdm(self.val_loader, desc="验证"):
-                input_ids = batch["input_ids"].to(self.device)
-                attention_mask = batch["attention_mask"].to(self.device)
-                labels = batch["labels"].to(self.device)
-                
-                outputs = self.model.model(
-                    input_ids=input_ids,
-                    attention_mask=attention_mask,
-                    labels=labels
-                )
-                
-                val_loss += outputs.loss.item()
+            for batch in tqdm(loader, desc="验证"):
+                val_loss += self._compute_loss(batch, self.model.model).item()
+        
+        return val_loss / len(loader)
+    
+    def evaluate_generation(self, samples: List[Dict[str, Any]]) -> Dict[str, float]:
+        """生成式指标：批量贪心解码，用 parse_output 解析后与标注任务比较（compute_task_metrics）"""
+        self.model.model.eval()
+        batch_size = self.config.GENERATION_EVAL_BATCH_SIZE
+        # 按输入长度排序后成批，减少批内填充
+        samples = sorted(samples, key=lambda sample: len(sample["input_text"]))
+        
+        predictions = []
+        for start in range(0, len(samples), batch_size):
+            input_texts = [sample["input_text"] for sample in samples[start:start + batch_size]]
+            outputs = self.model.generate_batch(input_texts, max_length=self.config.MAX_LENGTH, num_beams=1)
+            predictions.extend(self.model.parse_output(output_text) for output_text in outputs)
         
-        return val_loss / len(self.val_loader)
+        return compute_task_metrics(predictions, [sample["output_tasks"] for sample in samples])
+    
+    def _training_loss(self, batch: Dict[str, torch.Tensor]) -> Tuple[torch.Tensor, int]:
+        """训练用的损失（按目标 token 平均，子类可覆盖，如蒸馏损失）及计入损失的目标 token 数"""
+        return self._compute_loss(batch, self.train_model), int((batch["labels"] != -100).sum())
+    
+    def _compute_loss(self, batch: Dict[str, torch.Tensor], model: nn.Module) -> torch.Tensor:
+        """将一批数据移到设备并用 model（原模型或 DDP 包装的模型）前向计算损失（普通批与打包批均可）"""
+        batch = {key: value.to(self.device) for key, value in batch.items()}
+        with self._autocast():
+            return forward_batch(model, batch).loss
+    
+    def _autocast(self):
+        """MIXED_PRECISION="bf16" 时前向在 autocast 下以 bfloat16 计算，参数与优化器状态保持 fp32"""
+        return torch.autocast(self.device.type, dtype=torch.bfloat16, enabled=self.config.MIXED_PRECISION == "bf16")
     
     def save_model(self, save_path: str):
         """保存模型"""
         self.model.save_model(save_path)
         print(f"模型已保存到: {save_path}")
     
-    def save_training_history(self, train_losses: List[float], val_losses: List[float]):
-        """保存训练历史"""
+    def save_training_history(self, train_losses: List[float], val_losses: List[float],
+                              eval_history: Optional[List[Dict[str, float]]] = None):
+        """保存训练历史（eval_history 为每次验证的步数与各项指标）"""
         history = {
             "train_losses": train_losses,
-            "val_losses": val_losses
+            "val_losses": val_losses,
+            "eval_history": eval_history or []
         }
         
         with open(f"{self.config.OUTPUT_DIR}/training_history.json", 'w') as f:
@@ -203,29 +657,137 @@ class ScheduleTrainer:
         print("\n测试模型...")
         self.model.model.eval()
         
-        for input_text in test_inputs:
+        # 整批解析（按配置的解码策略：adaptive 时先整批贪心解码，校验失败的样本再合批束搜索）
+        predictions = self.model.predict_tasks_batch(test_inputs)
+        for input_text, tasks in zip(test_inputs, predictions):
             print(f"\n输入: {input_text}")
-            
-            # 生成输出
-            output_text = self.model.generate(input_text)
-            print(f"输出: {output_text}")
-            
-            # 解析任务
-            tasks = self.model.parse_output(output_text)
             print("解析的任务:")
             for task in tasks:
                 print(f"  - {task['task']}: {task['duration']}分钟, {task['pref_time']}, 优先级{task['priority']}")
+        
+        stats = self.model.get_decoding_stats()
+        print(f"\n解码层级分布: 贪心 {stats['greedy']} ({stats['greedy_ratio']:.0%}), "
+              f"束搜索 {stats['beam']} ({stats['beam_ratio']:.0%})")
+
+def build_student_config(tokenizer: T5Tokenizer, config: Config) -> T5Config:
+    """学生模型结构：与教师共用分词器（词表一致，软目标可逐 token 对齐），层数与宽度由 Config 指定"""
+    return T5Config(
+        vocab_size=len(tokenizer),
+        d_model=config.STUDENT_D_MODEL,
+        d_ff=config.STUDENT_D_FF,
+        d_kv=config.STUDENT_D_KV,
+        num_heads=config.STUDENT_NUM_HEADS,
+        num_layers=config.STUDENT_NUM_LAYERS,
+        num_decoder_layers=config.STUDENT_NUM_LAYERS,
+        pad_token_id=tokenizer.pad_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        decoder_start_token_id=tokenizer.pad_token_id
+    )
+
+def distillation_loss(student_logits: torch.Tensor, teacher_logits: torch.Tensor, labels: torch.Tensor,
+                      hard_loss: torch.Tensor, temperature: float, alpha: float) -> torch.Tensor:
+    """alpha * T² * KL(教师 || 学生) + (1 - alpha) * 硬标签交叉熵，KL 在非填充的目标位置上按 token 平均"""
+    mask = labels != -100
+    vocab_size = student_logits.size(-1)
+    student_log_probs = F.log_softmax(student_logits[mask].float() / temperature, dim=-1)
+    teacher_log_probs = F.log_softmax(teacher_logits[mask][:, :vocab_size].float() / temperature, dim=-1)
+    soft_loss = F.kl_div(student_log_probs, teacher_log_probs, reduction="batchmean", log_target=True)
+    return alpha * temperature ** 2 * soft_loss + (1 - alpha) * hard_loss
+
+class DistillationTrainer(ScheduleTrainer):
+    """知识蒸馏训练器：已训练的教师模型为 DataGenerator 实时数据流提供软目标（可选地也提供硬标签），
+    训练本地构建、从头初始化的小型 T5 学生模型。
+    
+    学生与教师共用分词器，保存的检查点与 ScheduleT5Model 格式相同，
+    可直接作为 PersonalScheduleGenerator 的 model_path 使用。
+    """
+    
+    def __init__(self, config: Config, teacher_path: str):
+        self.teacher_path = teacher_path
+        config = copy.copy(config)
+        # 学生在无限数据流上训练，输出、检查点与度量放在单独的目录
+        config.TRAIN_DATA_SOURCE = "stream"
+        config.LEARNING_RATE = config.DISTILL_LEARNING_RATE
+        config.OUTPUT_DIR = config.DISTILL_OUTPUT_DIR
+        config.CHECKPOINT_DIR = os.path.join(config.DISTILL_OUTPUT_DIR, "checkpoints")
+        if config.TRAIN_METRICS_PATH:
+            config.TRAIN_METRICS_PATH = os.path.join(config.DISTILL_OUTPUT_DIR, "train_metrics.jsonl")
+        super().__init__(config)
+    
+    def _build_model(self) -> ScheduleT5Model:
+        """加载冻结的教师模型，并按 Config 构建随机初始化的学生模型"""
+        self.teacher = ScheduleT5Model(
+            self.teacher_path,
+            decoding_strategy=self.config.DECODING_STRATEGY,
+            num_beams=self.config.NUM_BEAMS
+        )
+        self.teacher.model.to(self.device)
+        self.teacher.model.eval()
+        self.teacher.model.requires_grad_(False)
+        
+        student = ScheduleT5Model.from_prepared(
+            self.teacher.tokenizer,
+            T5ForConditionalGeneration(build_student_config(self.teacher.tokenizer, self.config)),
+            decoding_strategy=self.config.DECODING_STRATEGY,
+            num_beams=self.config.NUM_BEAMS
+        )
+        teacher_params = sum(param.numel() for param in self.teacher.model.parameters())
+        student_params = sum(param.numel() for param in student.model.parameters())
+        self.log(f"教师模型: {self.teacher_path} ({teacher_params / 1e6:.1f}M 参数), "
+                 f"学生模型: {student_params / 1e6:.1f}M 参数")
+        return student
+    
+    def _training_loss(self, batch: Dict[str, torch.Tensor]) -> Tuple[torch.Tensor, int]:
+        """教师给出软目标（及可选的硬标签），学生按蒸馏损失训练；验证损失仍为标注上的交叉熵"""
+        batch = {key: value.to(self.device) for key, value in batch.items()}
+        with self._autocast():
+            with torch.no_grad():
+                if self.config.DISTILL_TEACHER_LABELS:
+                    batch["labels"] = self._teacher_labels(batch)
+                teacher_logits = forward_batch(self.teacher.model, batch).logits
+            outputs = forward_batch(self.train_model, batch)
+        loss = distillation_loss(
+            outputs.logits, teacher_logits, batch["labels"], outputs.loss,
+            self.config.DISTILL_TEMPERATURE, self.config.DISTILL_ALPHA
+        )
+        return loss, int((batch["labels"] != -100).sum())
+    
+    def _teacher_labels(self, batch: Dict[str, torch.Tensor]) -> torch.Tensor:
+        """教师贪心解码的结果作为硬标签（去掉解码起始符，结束符之后的填充不计入损失）"""
+        generated = self.teacher.model.generate(
+            input_ids=batch["input_ids"],
+            attention_mask=batch["attention_mask"],
+            max_length=self.config.MAX_LENGTH,
+            num_beams=1
+        )
+        labels = generated[:, 1:]
+        return labels.masked_fill(labels == self.teacher.tokenizer.pad_token_id, -100)
 
 def main():
     """主训练函数"""
+    parser = argparse.ArgumentParser(description="训练日程解析模型")
+    parser.add_argument("--resume", nargs="?", const="latest", default=None,
+                        help="从检查点继续训练（不指定路径时使用 CHECKPOINT_DIR 中最新的检查点）")
+    parser.add_argument("--distill", metavar="TEACHER_PATH", default=None,
+                        help="知识蒸馏：以该检查点为教师训练小型学生模型（输出到 DISTILL_OUTPUT_DIR）")
+    args = parser.parse_args()
+    
     config = Config()
-    trainer = ScheduleTrainer(config)
+    if args.distill:
+        trainer = DistillationTrainer(config, args.distill)
+    else:
+        trainer = ScheduleTrainer(config)
     
     # 准备数据
     trainer.prepare_data()
     
     # 训练模型
-    trainer.train()
+    resume_from = args.resume
+    if resume_from == "latest":
+        resume_from = latest_checkpoint(trainer.config.CHECKPOINT_DIR)
+        if resume_from is None:
+            trainer.log("未找到检查点，从头开始训练")
+    trainer.train(resume_from)
     
     # 测试模型
     test_inputs = [
@@ -234,7 +796,10 @@ def main():
         "上下文：周六 在家 ｜ 需求：打扫卫生1小时，看电影2小时，散步30分钟"
     ]
     
-    trainer.test_model(test_inputs)
+    if trainer.is_main_process:
+        trainer.test_model(test_inputs)
+    
+    trainer.close()
 
 if __name__ == "__main__":
     main()
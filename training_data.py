@@ -0,0 +1,455 @@
+"""
+训练数据 - 一次性将 JSON 数据集分词为磁盘上的紧凑整数数组，训练时通过 np.memmap 读取；
+动态填充、按长度分组、序列打包，以及由 DataGenerator 实时生成的无限数据流
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import numpy as np
+import torch
+import transformers
+from torch.utils.data import Dataset, IterableDataset, Sampler, get_worker_info
+from typing import List, Dict, Any, Optional, Iterator
+from config import Config
+from task_format import TaskOutputMixin
+from data_generator import DataGenerator
+from dataset_io import load_dataset
+
+# 预处理产物格式版本，格式变化时递增以使旧产物失效
+PRETOKENIZED_VERSION = 2
+
+# 预处理产物中的文件
+INPUT_IDS_FILE = "input_ids.bin"
+LABELS_FILE = "labels.bin"
+INPUT_OFFSETS_FILE = "input_offsets.bin"  # int64 偏移，长度为样本数 + 1
+LABEL_OFFSETS_FILE = "label_offsets.bin"
+META_FILE = "meta.json"
+
+# 打包批的 3D 注意力掩码依赖 T5Stack 经 get_extended_attention_mask / invert_attention_mask 扩展掩码；
+# transformers 4.46 起编码器改为 attention_mask[:, None, None, :]、解码器改用 _update_causal_mask，3D 掩码会错误广播
+PACKED_MASK_MAX_TRANSFORMERS = (4, 46)
+
+# 仅用于把标注任务格式化为目标文本
+_output_format = TaskOutputMixin()
+
+def tokenizer_fingerprint(tokenizer, max_length: int) -> str:
+    """分词器指纹：词表（含添加的特殊token）、特殊token设置、截断长度与产物格式版本"""
+    payload = json.dumps({
+        "version": PRETOKENIZED_VERSION,
+        "class": type(tokenizer).__name__,
+        "vocab": sorted(tokenizer.get_vocab().items()),
+        "special_tokens": tokenizer.special_tokens_map,
+        "max_length": max_length
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def _source_signature(data_path: str) -> Dict[str, Any]:
+    """数据文件的大小与修改时间，用于判断产物是否过期"""
+    stat = os.stat(data_path)
+    return {"path": os.path.abspath(data_path), "size": stat.st_size, "mtime": stat.st_mtime}
+
+def pretokenized_dir(data_path: str, cache_dir: str = Config.PRETOKENIZED_DIR) -> str:
+    """数据文件对应的预处理产物目录"""
+    return os.path.join(cache_dir, os.path.splitext(os.path.basename(data_path))[0])
+
+def _append_flat(data_file, offsets_file, sequences: List[List[int]], dtype, position: int) -> int:
+    """把一批变长序列接在 token 文件末尾，各序列的结束偏移追加到偏移文件；position 为已写入的 token 数，返回新的总数"""
+    lengths = np.fromiter((len(sequence) for sequence in sequences), dtype=np.int64, count=len(sequences))
+    num_tokens = int(lengths.sum())
+    np.fromiter(
+        (token for sequence in sequences for token in sequence),
+        dtype=dtype,
+        count=num_tokens
+    ).tofile(data_file)
+    (position + np.cumsum(lengths)).tofile(offsets_file)
+    return position + num_tokens
+
+def pretokenize_dataset(data_path: str, tokenizer, output_dir: str,
+                        max_length: int = Config.MAX_LENGTH, batch_size: int = 1000) -> str:
+    """对数据集（.json / .jsonl）做一次性分词，输入与目标均不填充，按样本首尾相接存储。
+
+    每批分词结果直接追加到 token 文件与偏移文件（int64，长度 n+1），不在内存中累积，
+    .jsonl 又逐批流式读取，内存占用与数据集大小无关（.json 格式本身需整体读入）。
+    """
+    print(f"预处理数据: {data_path} -> {output_dir}")
+    samples = iter(load_dataset(data_path))
+
+    # 词表小于 65536 时用 uint16 存储，体积减半
+    dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else np.int32
+
+    # 先写入临时目录再重命名，避免读到不完整的产物
+    tmp_dir = f"{output_dir}.tmp{os.getpid()}"
+    os.makedirs(tmp_dir, exist_ok=True)
+    num_samples = 0
+    num_input_tokens = 0
+    num_label_tokens = 0
+    with open(os.path.join(tmp_dir, INPUT_IDS_FILE), 'wb') as input_file, \
+            open(os.path.join(tmp_dir, LABELS_FILE), 'wb') as label_file, \
+            open(os.path.join(tmp_dir, INPUT_OFFSETS_FILE), 'wb') as input_offsets_file, \
+            open(os.path.join(tmp_dir, LABEL_OFFSETS_FILE), 'wb') as label_offsets_file:
+        # 偏移数组以 0 开头
+        np.zeros(1, dtype=np.int64).tofile(input_offsets_file)
+        np.zeros(1, dtype=np.int64).tofile(label_offsets_file)
+        while True:
+            batch = list(itertools.islice(samples, batch_size))
+            if not batch:
+                break
+            input_ids = tokenizer(
+                [item["input_text"] for item in batch],
+                max_length=max_length,
+                truncation=True
+            )["input_ids"]
+            labels = tokenizer(
+                [_output_format.format_output(item["output_tasks"]) for item in batch],
+                max_length=max_length,
+                truncation=True
+            )["input_ids"]
+            num_input_tokens = _append_flat(input_file, input_offsets_file, input_ids, dtype, num_input_tokens)
+            num_label_tokens = _append_flat(label_file, label_offsets_file, labels, dtype, num_label_tokens)
+            num_samples += len(batch)
+
+    meta = {
+        "fingerprint": tokenizer_fingerprint(tokenizer, max_length),
+        "source": _source_signature(data_path),
+        "num_samples": num_samples,
+        "dtype": np.dtype(dtype).name,
+        "max_length": max_length,
+        "num_input_tokens": num_input_tokens,
+        "num_label_tokens": num_label_tokens
+    }
+    with open(os.path.join(tmp_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir, ignore_errors=True)
+    os.rename(tmp_dir, output_dir)
+
+    print(f"预处理完成: {num_samples} 样本, 输入 {num_input_tokens} token, 目标 {num_label_tokens} token")
+    return output_dir
+
+def is_pretokenized(data_path: str, tokenizer, output_dir: str, max_length: int = Config.MAX_LENGTH) -> bool:
+    """产物存在，且分词器指纹与数据文件均未变化"""
+    meta_path = os.path.join(output_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    return (
+        meta["fingerprint"] == tokenizer_fingerprint(tokenizer, max_length)
+        and meta["source"] == _source_signature(data_path)
+    )
+
+def load_pretokenized(data_path: str, tokenizer, cache_dir: str = Config.PRETOKENIZED_DIR,
+                      max_length: int = Config.MAX_LENGTH) -> "PretokenizedDataset":
+    """加载预处理产物，不存在或已过期时先重新预处理"""
+    output_dir = pretokenized_dir(data_path, cache_dir)
+    if not is_pretokenized(data_path, tokenizer, output_dir, max_length):
+        pretokenize_dataset(data_path, tokenizer, output_dir, max_length)
+    return PretokenizedDataset(output_dir)
+
+class PretokenizedDataset(Dataset):
+    """读取预处理产物的数据集：token 数组以只读 np.memmap 映射，取样本只返回其上的视图，不复制数据。
+
+    映射在首次访问时打开，DataLoader 工作进程各自重新映射，不会序列化整个数组。
+    """
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        with open(os.path.join(data_dir, META_FILE), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.input_offsets = np.fromfile(os.path.join(data_dir, INPUT_OFFSETS_FILE), dtype=np.int64)
+        self.label_offsets = np.fromfile(os.path.join(data_dir, LABEL_OFFSETS_FILE), dtype=np.int64)
+        self._input_ids: Optional[np.memmap] = None
+        self._labels: Optional[np.memmap] = None
+
+    def _open(self):
+        """打开内存映射（空数组无法映射，直接使用空数组）"""
+        dtype = np.dtype(self.meta["dtype"])
+        self._input_ids = self._memmap(INPUT_IDS_FILE, dtype, self.meta["num_input_tokens"])
+        self._labels = self._memmap(LABELS_FILE, dtype, self.meta["num_label_tokens"])
+
+    def _memmap(self, filename: str, dtype: np.dtype, num_tokens: int) -> np.ndarray:
+        """映射一个 token 文件"""
+        if num_tokens == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(os.path.join(self.data_dir, filename), dtype=dtype, mode='r', shape=(num_tokens,))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_input_ids"] = None
+        state["_labels"] = None
+        return state
+
+    def __len__(self):
+        return len(self.input_offsets) - 1
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """每个样本的输入与目标 token 数之和（直接由偏移得到，不读取 token 数据）"""
+        return np.diff(self.input_offsets) + np.diff(self.label_offsets)
+
+    def __getitem__(self, idx) -> Dict[str, np.ndarray]:
+        if self._input_ids is None:
+            self._open()
+        return {
+            "input_ids": self._input_ids[self.input_offsets[idx]:self.input_offsets[idx + 1]],
+            "labels": self._labels[self.label_offsets[idx]:self.label_offsets[idx + 1]]
+        }
+
+class ScheduleCollator:
+    """把一批变长样本拼成张量。
+
+    默认填充到本批最长序列（动态填充）；指定 max_length 时填充到固定长度。
+    目标的填充位置设为 label_pad_token_id（-100），不计入损失。
+    """
+
+    def __init__(self, pad_token_id: int, max_length: Optional[int] = None, label_pad_token_id: int = -100):
+        self.pad_token_id = pad_token_id
+        self.max_length = max_length
+        self.label_pad_token_id = label_pad_token_id
+
+    def _pad(self, sequences: List[np.ndarray], pad_value: int) -> np.ndarray:
+        """整批只分配一次数组，再逐行拷贝"""
+        length = self.max_length or max((len(sequence) for sequence in sequences), default=0)
+        padded = np.full((len(sequences), length), pad_value, dtype=np.int64)
+        for i, sequence in enumerate(sequences):
+            padded[i, :len(sequence)] = sequence
+        return padded
+
+    def __call__(self, features: List[Dict[str, np.ndarray]]) -> Dict[str, torch.Tensor]:
+        input_ids = self._pad([feature["input_ids"] for feature in features], self.pad_token_id)
+        labels = self._pad([feature["labels"] for feature in features], self.label_pad_token_id)
+        lengths = np.array([len(feature["input_ids"]) for feature in features])
+        attention_mask = (np.arange(input_ids.shape[1]) < lengths[:, None]).astype(np.int64)
+        return {
+            "input_ids": torch.from_numpy(input_ids),
+            "attention_mask": torch.from_numpy(attention_mask),
+            "labels": torch.from_numpy(labels)
+        }
+
+class LengthGroupedBatchSampler(Sampler):
+    """按长度分组的批采样器（用于 DataLoader 的 batch_sampler）：打乱后每 batch_size * mega_batch_mult
+    个样本为一组，组内按长度排序后切成批，使同一批中的样本长度相近、填充最少；
+    批的顺序再次打乱，避免按长度单调变化。
+
+    分布式训练时 batch_size 为全局批大小，各进程取每个全局批中的 batch[rank::world_size]，
+    因此全局批的组成与单进程训练相同；不足 batch_size 的末尾批在单进程与分布式训练中都被丢弃，
+    与逐样本打乱时 DataLoader 的 drop_last 一致，各进程步数也一致。
+    每个 epoch 调用 set_epoch 以得到不同且可复现的顺序。
+    """
+
+    def __init__(self, lengths: np.ndarray, batch_size: int, mega_batch_mult: int = 50, seed: int = 0,
+                 rank: int = 0, world_size: int = 1):
+        self.lengths = np.asarray(lengths)
+        self.batch_size = batch_size
+        self.mega_batch_size = batch_size * mega_batch_mult
+        self.seed = seed
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        """设置 epoch，用于生成该轮的打乱顺序"""
+        self.epoch = epoch
+
+    def __len__(self):
+        # 每组样本数是 batch_size 的整数倍，只有最后一组会切出不足 batch_size 的批
+        return len(self.lengths) // self.batch_size
+
+    def __iter__(self) -> Iterator[List[int]]:
+        rng = np.random.default_rng(self.seed + self.epoch)
+        indices = rng.permutation(len(self.lengths))
+
+        batches = []
+        for start in range(0, len(indices), self.mega_batch_size):
+            mega_batch = indices[start:start + self.mega_batch_size]
+            # 稳定排序，保证相同长度的样本保持打乱后的顺序
+            mega_batch = mega_batch[np.argsort(-self.lengths[mega_batch], kind="stable")]
+            batches.extend(
+                mega_batch[i:i + self.batch_size].tolist() for i in range(0, len(mega_batch), self.batch_size)
+            )
+
+        for batch_index in rng.permutation(len(batches)):
+            batch = batches[batch_index]
+            if len(batch) == self.batch_size:
+                yield batch[self.rank::self.world_size]
+
+class StreamingScheduleDataset(IterableDataset):
+    """由 DataGenerator 实时生成样本的无限数据集，不在磁盘上落地任何数据文件。
+
+    每个 DataLoader 工作进程用 (seed, epoch, 训练进程 rank, 工作进程编号) 派生独立的随机数种子，
+    各进程的样本流互不重复且可复现；生成与分词都在工作进程中完成，与训练计算重叠。
+    """
+
+    def __init__(self, tokenizer, seed: int = Config.STREAM_SEED, max_length: int = Config.MAX_LENGTH,
+                 tokenize_batch_size: int = 64, rank: int = 0):
+        self.tokenizer = tokenizer
+        self.seed = seed
+        self.rank = rank
+        self.max_length = max_length
+        self.tokenize_batch_size = tokenize_batch_size
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        """设置 epoch，重新迭代时得到新的样本流"""
+        self.epoch = epoch
+
+    def worker_seed(self) -> int:
+        """当前工作进程的随机数种子（主进程加载时工作进程编号为0）"""
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info is not None else 0
+        # SeedSequence 把多个整数混合成统计上独立的 128 位种子
+        state = np.random.SeedSequence([self.seed, self.epoch, self.rank, worker_id]).generate_state(4)
+        return int.from_bytes(state.tobytes(), "little")
+
+    def __iter__(self) -> Iterator[Dict[str, np.ndarray]]:
+        generator = DataGenerator(seed=self.worker_seed())
+        while True:
+            samples = generator.generate_batch(self.tokenize_batch_size)
+            input_ids = self.tokenizer(
+                [sample["input_text"] for sample in samples],
+                max_length=self.max_length,
+                truncation=True
+            )["input_ids"]
+            labels = self.tokenizer(
+                [_output_format.format_output(sample["output_tasks"]) for sample in samples],
+                max_length=self.max_length,
+                truncation=True
+            )["input_ids"]
+            for sample_input_ids, sample_labels in zip(input_ids, labels):
+                yield {
+                    "input_ids": np.asarray(sample_input_ids, dtype=np.int64),
+                    "labels": np.asarray(sample_labels, dtype=np.int64)
+                }
+
+def pack_samples(input_lengths: List[int], label_lengths: List[int], max_length: int) -> List[List[int]]:
+    """按顺序把样本装入窗口：输入与目标的累计长度都不超过 max_length（超长的单个样本独占一个窗口）"""
+    packs = []
+    current = []
+    input_total = 0
+    label_total = 0
+    for index, (input_length, label_length) in enumerate(zip(input_lengths, label_lengths)):
+        if current and (input_total + input_length > max_length or label_total + label_length > max_length):
+            packs.append(current)
+            current = []
+            input_total = 0
+            label_total = 0
+        current.append(index)
+        input_total += input_length
+        label_total += label_length
+    if current:
+        packs.append(current)
+    return packs
+
+class PackedDataset(Dataset):
+    """打包数据集：每一项是装入同一窗口的若干个样本，由 PackedCollator 拼接"""
+
+    def __init__(self, dataset: PretokenizedDataset, max_length: int = Config.PACK_LENGTH):
+        self.dataset = dataset
+        self.packs = pack_samples(
+            np.diff(dataset.input_offsets).tolist(),
+            np.diff(dataset.label_offsets).tolist(),
+            max_length
+        )
+
+    def __len__(self):
+        return len(self.packs)
+
+    def __getitem__(self, idx) -> List[Dict[str, np.ndarray]]:
+        return [self.dataset[index] for index in self.packs[idx]]
+
+class PackedCollator:
+    """把打包的样本拼成窗口，并构造使样本之间互不可见的注意力掩码。
+
+    - attention_mask [B, 输入长, 输入长]：编码器自注意力，只在同一样本内
+    - decoder_attention_mask [B, 目标长, 目标长]：解码器自注意力，同一样本内且因果
+    - cross_attention_mask [B, 目标长, 输入长]：解码器只关注对应样本的编码结果
+    - decoder_input_ids：每个样本的目标各自右移，以解码起始符开头
+
+    T5 使用相对位置偏置，样本内的相对距离不受打包影响，因此结果与逐样本计算一致
+    （test_system.test_packed_loss 校验打包损失与逐样本损失相等）。
+    仅支持 transformers < 4.46（见 PACKED_MASK_MAX_TRANSFORMERS），更新的版本在此直接报错。
+    """
+
+    def __init__(self, pad_token_id: int, decoder_start_token_id: int, label_pad_token_id: int = -100):
+        transformers_version = tuple(int(part) for part in transformers.__version__.split(".")[:2])
+        if transformers_version >= PACKED_MASK_MAX_TRANSFORMERS:
+            raise RuntimeError(
+                f"序列打包需要 transformers < {'.'.join(map(str, PACKED_MASK_MAX_TRANSFORMERS))}，"
+                f"当前为 {transformers.__version__}（新版 T5 不支持 3D 注意力掩码）"
+            )
+        self.pad_token_id = pad_token_id
+        self.decoder_start_token_id = decoder_start_token_id
+        self.label_pad_token_id = label_pad_token_id
+
+    def __call__(self, packs: List[List[Dict[str, np.ndarray]]]) -> Dict[str, torch.Tensor]:
+        input_length = max(sum(len(feature["input_ids"]) for feature in pack) for pack in packs)
+        label_length = max(sum(len(feature["labels"]) for feature in pack) for pack in packs)
+
+        input_ids = np.full((len(packs), input_length), self.pad_token_id, dtype=np.int64)
+        labels = np.full((len(packs), label_length), self.label_pad_token_id, dtype=np.int64)
+        decoder_input_ids = np.full((len(packs), label_length), self.pad_token_id, dtype=np.int64)
+        # 每个位置所属样本的编号（从1开始），填充位置为0
+        input_segments = np.zeros((len(packs), input_length), dtype=np.int64)
+        label_segments = np.zeros((len(packs), label_length), dtype=np.int64)
+
+        for row, pack in enumerate(packs):
+            input_position = 0
+            label_position = 0
+            for segment, feature in enumerate(pack, 1):
+                end = input_position + len(feature["input_ids"])
+                input_ids[row, input_position:end] = feature["input_ids"]
+                input_segments[row, input_position:end] = segment
+                input_position = end
+
+                end = label_position + len(feature["labels"])
+                labels[row, label_position:end] = feature["labels"]
+                decoder_input_ids[row, label_position] = self.decoder_start_token_id
+                decoder_input_ids[row, label_position + 1:end] = feature["labels"][:-1]
+                label_segments[row, label_position:end] = segment
+                label_position = end
+
+        input_keys = input_segments[:, None, :]
+        label_keys = label_segments[:, None, :]
+        causal = np.tril(np.ones((label_length, label_length), dtype=bool))
+        attention_mask = (input_segments[:, :, None] == input_keys) & (input_keys > 0)
+        decoder_attention_mask = (label_segments[:, :, None] == label_keys) & (label_keys > 0) & causal
+        cross_attention_mask = (label_segments[:, :, None] == input_keys) & (input_keys > 0)
+
+        return {
+            "input_ids": torch.from_numpy(input_ids),
+            "attention_mask": torch.from_numpy(attention_mask.astype(np.int64)),
+            "decoder_input_ids": torch.from_numpy(decoder_input_ids),
+            "decoder_attention_mask": torch.from_numpy(decoder_attention_mask.astype(np.int64)),
+            "cross_attention_mask": torch.from_numpy(cross_attention_mask.astype(np.int64)),
+            "labels": torch.from_numpy(labels)
+        }
+
+def forward_batch(model, batch: Dict[str, torch.Tensor]):
+    """对一批数据做前向（含损失），兼容普通批与打包批，model 可以是 DDP 包装后的模型。
+
+    打包批的交叉注意力掩码与编码器掩码不同，而 T5ForConditionalGeneration 把 attention_mask
+    同时用于两者，因此先单独运行编码器，再把交叉注意力掩码作为 attention_mask 传入。
+    """
+    if "cross_attention_mask" not in batch:
+        return model(**batch)
+
+    encoder_outputs = getattr(model, "module", model).get_encoder()(
+        input_ids=batch["input_ids"],
+        attention_mask=batch["attention_mask"],
+        return_dict=True
+    )
+    return model(
+        encoder_outputs=encoder_outputs,
+        attention_mask=batch["cross_attention_mask"],
+        decoder_input_ids=batch["decoder_input_ids"],
+        decoder_attention_mask=batch["decoder_attention_mask"],
+        labels=batch["labels"]
+    )
+
+def count_real_tokens(batch: Dict[str, torch.Tensor], pad_token_id: int) -> int:
+    """一批中真实（非填充）的输入与目标 token 数"""
+    return int((batch["input_ids"] != pad_token_id).sum()) + int((batch["labels"] != -100).sum())
@@ -0,0 +1,123 @@
+"""
+训练过程度量 - 每次参数更新的耗时拆分、吞吐与内存写入 JSONL，以及按步数区间开启的 torch profiler
+"""
+
+import json
+import os
+import resource
+import sys
+import time
+import torch
+from typing import Dict, Any, Optional
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB）；ru_maxrss 在 Linux 上以 KB 计，在 macOS 上以字节计"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def current_rss_mb() -> float:
+    """当前进程的常驻内存（MB）；无 /proc 的平台退回峰值"""
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+def rank_path(path: str, rank: int, world_size: int) -> str:
+    """分布式训练时每个进程写各自的文件：metrics.jsonl -> metrics.rank1.jsonl"""
+    if world_size <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.rank{rank}{ext}"
+
+def new_step_timings() -> Dict[str, Any]:
+    """一次参数更新内累计的计时与 token 数（秒）"""
+    return {
+        "data_wait": 0.0,
+        "forward": 0.0,
+        "backward": 0.0,
+        "optimizer": 0.0,
+        "loss": 0.0,
+        "micro_batches": 0,
+        "real_tokens": 0,
+        "padded_tokens": 0
+    }
+
+class StepMetricsWriter:
+    """把每次参数更新的度量写成一行 JSON（行缓冲，训练中断时已完成的步不会丢失）"""
+
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, 'a' if append else 'w', encoding='utf-8', buffering=1)
+
+    def write_step(self, step: int, epoch: int, timings: Dict[str, Any], step_seconds: float,
+                   learning_rate: float):
+        """写入一次参数更新的度量：耗时拆分、每秒真实 token 数、填充比例、损失、学习率与当前 RSS"""
+        padded_tokens = timings["padded_tokens"]
+        record = {
+            "step": step,
+            "epoch": epoch,
+            "time": time.time(),
+            "step_seconds": step_seconds,
+            "data_wait_seconds": timings["data_wait"],
+            "forward_seconds": timings["forward"],
+            "backward_seconds": timings["backward"],
+            "optimizer_seconds": timings["optimizer"],
+            "micro_batches": timings["micro_batches"],
+            "real_tokens": timings["real_tokens"],
+            "tokens_per_second": timings["real_tokens"] / step_seconds if step_seconds else 0.0,
+            "padding_ratio": 1 - timings["real_tokens"] / padded_tokens if padded_tokens else 0.0,
+            "loss": timings["loss"] / max(timings["micro_batches"], 1),
+            "learning_rate": learning_rate,
+            "rss_mb": current_rss_mb()
+        }
+        self._file.write(json.dumps(record) + "\n")
+
+    def close(self):
+        """关闭文件"""
+        self._file.close()
+
+class ProfilerWindow:
+    """在第 start_step..end_step 次参数更新（含两端）期间运行 torch profiler，结束后导出 Chrome trace
+    （可在 chrome://tracing 或 Perfetto 中查看），并打印耗时最多的算子"""
+
+    def __init__(self, start_step: int, end_step: int, output_dir: str):
+        if end_step < start_step:
+            raise ValueError(f"profiler 区间无效: {start_step}..{end_step}")
+        self.start_step = start_step
+        self.end_step = end_step
+        self.output_dir = output_dir
+        self._profiler: Optional[torch.profiler.profile] = None
+
+    def before_update(self, step: int):
+        """第 step 次参数更新的第一个微批开始前调用"""
+        if step != self.start_step or self._profiler is not None:
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        self._profiler = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True)
+        self._profiler.start()
+
+    def after_update(self, step: int):
+        """第 step 次参数更新完成后调用"""
+        if self._profiler is None or step < self.end_step:
+            return
+        self.close()
+
+    def close(self):
+        """停止 profiler 并导出 trace（训练在区间结束前停止时也会导出已记录的部分）"""
+        if self._profiler is None:
+            return
+        profiler, self._profiler = self._profiler, None
+        profiler.stop()
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        trace_path = os.path.join(self.output_dir, f"trace_steps_{self.start_step}-{self.end_step}.json")
+        profiler.export_chrome_trace(trace_path)
+        print(profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=15))
+        print(f"profiler trace 已保存到: {trace_path}")